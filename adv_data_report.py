@@ -1,12 +1,25 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import re
 import os
-from datetime import datetime, date, timedelta
-import base64
-from io import BytesIO
-import tempfile
+import threading
+
+from adv_report_core import (
+    HIGH_DIFF_THRESHOLD,
+    AFFILIATE_DIFF_THRESHOLD,
+    BUDGET_LOOKBACK_DAYS,
+    HISTORY_DAYS,
+    ENGINES,
+    load_report_workbook_cached,
+    compute_upload_digest,
+    validate_report_upload,
+    get_parsed_upload_cache,
+    process_daily_report_web,
+    build_report_excel_bytes,
+    report_filename,
+)
+from adv_report_jobs import QUEUED, RUNNING, DONE, FAILED, CANCELLED, JobQueue
+from adv_report_stages import write_profile_jsonl
+from adv_report_store import DailyAggregateStore, required_days
 
 # ==================== Streamlit页面配置（必须放在最前面） ====================
 st.set_page_config(
@@ -53,530 +66,195 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ==================== 核心处理函数 ====================
-def process_daily_report_web(uploaded_file, progress_bar=None, status_text=None):
+# ==================== 文件下载功能 ====================
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def render_excel_download_button(analysis_key, results):
     """
-    网页版处理日报Excel数据的主函数
+    下载按钮：报告在用户点击时才生成（st.download_button延迟数据），
+    页面中不再内嵌base64编码的整份文件
     """
-    
-    # 更新进度
-    if progress_bar and status_text:
-        progress_bar.progress(5)
-        status_text.text("📁 正在读取Excel文件...")
-    
-    # ====================== 1、导入Excel数据 ======================
-    try:
-        sheet1_all_data = pd.read_excel(uploaded_file, sheet_name='1--all data')
-        sheet3_advertiser = pd.read_excel(uploaded_file, sheet_name='3--匹配广告主')
-        sheet4_reject = pd.read_excel(uploaded_file, sheet_name='4--reject事件')
-        sheet2_reject_rule = pd.read_excel(uploaded_file, sheet_name='2-reject规则')
-        
-        if progress_bar and status_text:
-            progress_bar.progress(15)
-            status_text.text("✅ 成功读取Excel文件，开始数据处理...")
-            
-    except Exception as e:
-        raise Exception(f"读取文件失败：{str(e)}")
-    
-    # ====================== 关键优化：自动识别最新两天日期 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(20)
-        status_text.text("📅 自动识别最新两天日期...")
-    
-    sheet1_all_data['Date'] = sheet1_all_data['Time'].dt.date
-    sheet4_reject['Date'] = sheet4_reject['Time'].dt.date
-    
-    # 获取所有唯一日期并排序
-    all_dates = sorted(sheet1_all_data['Date'].unique(), reverse=True)
-    
-    if len(all_dates) < 2:
-        raise Exception(f"错误：数据中仅包含 {len(all_dates)} 天数据，至少需要2天！")
-    
-    # 定义最新两天（核心日期变量）
-    newest_date = all_dates[0]       # 最新一天
-    second_newest_date = all_dates[1] # 次新一天
-    
-    # 生成日期显示名称
-    newest_date_str = f"{newest_date.year}/{newest_date.month}/{newest_date.day}"
-    second_newest_date_str = f"{second_newest_date.year}/{second_newest_date.month}/{second_newest_date.day}"
-    newest_date_file_str = f"{newest_date.year}{newest_date.month:02d}{newest_date.day:02d}"
-    
-    date_mapping = {
-        'newest': {
-            'date': newest_date,
-            'str': newest_date_str,
-            'file_str': newest_date_file_str,
-            'col_name': f"{newest_date_str} Total Revenue",
-            'reject_rate_col': f"{newest_date_str} reject率(%)"
-        },
-        'second': {
-            'date': second_newest_date,
-            'str': second_newest_date_str,
-            'col_name': f"{second_newest_date_str} Total Revenue",
-            'reject_rate_col': f"{second_newest_date_str} reject率(%)"
-        }
-    }
-    
-    # ====================== 2、基础数据预处理 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(30)
-        status_text.text("🔧 基础数据预处理...")
-    
-    # 提取每个Offer ID的最新Status
-    offer_status_mapping = sheet1_all_data[sheet1_all_data['Date'] == newest_date][
-        ['Offer ID', 'Status']
-    ].drop_duplicates(subset=['Offer ID']).fillna('Unknown')
-    
-    # 精准判断新旧预算
-    non_newest_data = sheet1_all_data[sheet1_all_data['Date'] != newest_date].copy()
-    six_days_ago = newest_date - timedelta(days=6)
-    past_6_days_data = non_newest_data[non_newest_data['Date'] >= six_days_ago].copy()
-    old_budget_offers = set(
-        past_6_days_data[past_6_days_data['Total Revenue'] > 0]['Offer ID'].unique()
+    st.download_button(
+        "📥 下载完整分析报告",
+        data=lambda: get_cached_report_excel_bytes(analysis_key, results),
+        file_name=report_filename(results),
+        mime=XLSX_MIME,
+        on_click='ignore',
+        type='primary',
     )
-    all_offers = set(sheet1_all_data['Offer ID'].unique())
-    
-    def judge_budget_type(offer_id):
-        return '旧预算' if offer_id in old_budget_offers else '新预算'
-    
-    # ====================== 3、匹配广告主信息 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(40)
-        status_text.text("🔗 匹配广告主信息...")
-    
-    sheet1_all_data = pd.merge(
-        sheet1_all_data, 
-        sheet3_advertiser[['Advertiser', '二级广告主', '三级广告主']], 
-        on='Advertiser', 
-        how='left'
+
+
+# ==================== 页面结果缓存 ====================
+# Streamlit每次交互都会从头执行脚本：
+# - 当前会话的工作簿保存在st.session_state，切换标签/下载时不再解析
+# - 上传文件的表头校验与哈希按上传保存在st.session_state，重新运行时不再重新读取文件
+# - 分析结果与下载文件用st.cache_data缓存，键为文件哈希+分析阈值，跨会话共享
+class CacheStats:
+    """线程安全的缓存命中/未命中计数（进程内所有会话共享）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._misses = {}
+    
+    def record_call(self, name):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + 1
+    
+    def record_miss(self, name):
+        with self._lock:
+            self._misses[name] = self._misses.get(name, 0) + 1
+    
+    def snapshot(self):
+        """返回 {缓存名: {'hits': n, 'misses': n}}"""
+        with self._lock:
+            return {
+                name: {'hits': calls - self._misses.get(name, 0), 'misses': self._misses.get(name, 0)}
+                for name, calls in self._calls.items()
+            }
+
+
+@st.cache_resource
+def get_cache_stats():
+    return CacheStats()
+
+
+def get_session_workbook(uploaded_file, digest, streaming=False):
+    """
+    当前会话内按文件哈希复用已读取的工作簿，只保留最近一次上传
+    调用前已由validate_report_upload校验表头，读取时不再重复校验
+    """
+    stats = get_cache_stats()
+    stats.record_call('workbook')
+    cached = st.session_state.get('workbook_cache')
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    stats.record_miss('workbook')
+    workbook = load_report_workbook_cached(uploaded_file, streaming=streaming, validate=False)
+    st.session_state['workbook_cache'] = (digest, workbook)
+    return workbook
+
+
+def get_session_upload_check(uploaded_files, uploaded_file):
+    """
+    返回 (表头问题列表, 文件哈希)，每次上传只计算一次
+    按各文件的 (file_id, 大小) 识别同一次上传：页面每次重新运行（含任务轮询后的整页刷新）都直接复用
+    """
+    stats = get_cache_stats()
+    stats.record_call('upload')
+    upload_key = tuple((f.file_id, f.size) for f in uploaded_files)
+    cached = st.session_state.get('upload_check')
+    if cached is not None and cached[0] == upload_key:
+        return cached[1]
+    stats.record_miss('upload')
+    check = (validate_report_upload(uploaded_file), compute_upload_digest(uploaded_file))
+    st.session_state['upload_check'] = (upload_key, check)
+    return check
+
+
+# 设置后每次实际计算（缓存未命中）的阶段性能记录追加写入该JSON lines文件，供监控采集
+PROFILE_LOG = os.environ.get('ADV_REPORT_PROFILE_LOG')
+
+
+def log_report_profile(results, **context):
+    if PROFILE_LOG:
+        write_profile_jsonl(results['profile'], PROFILE_LOG, **context)
+
+
+@st.cache_resource
+def get_daily_aggregate_store():
+    return DailyAggregateStore()
+
+
+# 增量模式的入库与读取不能与其它会话的任务交错
+_store_lock = threading.Lock()
+
+
+def run_incremental_report(workbook, thresholds, progress_bar=None, status_text=None, engine='pandas', store=None):
+    """
+    增量模式：上传中的日期并入本地聚合存储（已入库的日期整分区替换），报告由存储中最近的汇总计算
+    结果依赖存储状态，不按分析参数复用
+    """
+    store = store or get_daily_aggregate_store()
+    with _store_lock:
+        store.ingest(workbook)
+        aggregates = store.load(days=required_days(thresholds['budget_lookback_days'], thresholds['history_days']))
+    results = process_daily_report_web(
+        None, progress_bar, status_text, aggregates=aggregates, engine=engine, **thresholds
     )
-    
-    # ====================== 4、核心计算：Offer级别的基础数据 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(50)
-        status_text.text("📊 计算Offer级别数据...")
-    
-    # 提取App ID映射
-    offer_app_mapping = sheet1_all_data[['Offer ID', 'App ID']].drop_duplicates(subset=['Offer ID']).fillna('')
-    
-    # 计算每个Offer ID在最新/次新一天的总收入
-    offer_newest_revenue = sheet1_all_data[sheet1_all_data['Date'] == newest_date].groupby('Offer ID').agg({
-        'Total Revenue': 'sum'
-    }).reset_index()
-    offer_newest_revenue.columns = ['Offer ID', date_mapping['newest']['col_name']]
-    
-    offer_second_revenue = sheet1_all_data[sheet1_all_data['Date'] == second_newest_date].groupby('Offer ID').agg({
-        'Total Revenue': 'sum'
-    }).reset_index()
-    offer_second_revenue.columns = ['Offer ID', date_mapping['second']['col_name']]
-    
-    # 合并Offer基础数据
-    offer_base_data = offer_app_mapping.copy()
-    offer_base_data = pd.merge(offer_base_data, offer_status_mapping, on='Offer ID', how='left')
-    offer_base_data = pd.merge(offer_base_data, offer_newest_revenue, on='Offer ID', how='left').fillna(0)
-    offer_base_data = pd.merge(offer_base_data, offer_second_revenue, on='Offer ID', how='left').fillna(0)
-    
-    # 计算Offer级流水差
-    offer_base_data['流水差（最新-次新）'] = (
-        offer_base_data[date_mapping['newest']['col_name']] - 
-        offer_base_data[date_mapping['second']['col_name']]
+    log_report_profile(results, engine=engine, mode='incremental')
+    return results
+
+
+# ==================== 后台分析任务 ====================
+# 分析在服务进程共享的任务队列中执行，按钮只提交任务，页面每隔JOB_POLL_SECONDS秒轮询进度；
+# 同时执行的任务数与排队上限见adv_report_jobs（ADV_REPORT_JOB_WORKERS / ADV_REPORT_JOB_MAX_PENDING）
+JOB_POLL_SECONDS = 1.0
+
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+
+def run_report_job(progress, digest, workbook, thresholds, engine='pandas', incremental_mode=False, store=None,
+                   stats=None):
+    """
+    后台任务：在任务队列的工作线程中执行分析
+    progress为JobProgress，同时作为进度条与状态文本（Streamlit组件只能在脚本线程中更新）
+    store / stats在提交时取得，工作线程中不调用st.cache_resource
+    """
+    if incremental_mode:
+        return run_incremental_report(workbook, thresholds, progress, progress, engine, store=store)
+    if stats is not None:
+        stats.record_miss('report')
+    results = process_daily_report_web(None, progress, progress, workbook=workbook, engine=engine, **thresholds)
+    log_report_profile(results, digest=digest, engine=engine, mode='upload')
+    return results
+
+
+def submit_report_job(analysis_key, digest, workbook, thresholds, engine='pandas', incremental_mode=False, name=''):
+    """
+    提交分析任务，返回任务id；排队已满时抛出RuntimeError
+    非增量模式按(文件哈希, 分析阈值, 执行引擎)复用：相同参数的任务排队、执行中或结果仍保留时不重复计算
+    """
+    stats = get_cache_stats()
+    key = None if incremental_mode else analysis_key
+    if key is not None:
+        stats.record_call('report')
+    return get_job_queue().submit(
+        run_report_job, digest, workbook, thresholds, engine=engine, incremental_mode=incremental_mode,
+        store=get_daily_aggregate_store() if incremental_mode else None, stats=stats, key=key, name=name
     )
-    
-    def calculate_offer_change_pct(row):
-        prev_revenue = row[date_mapping['second']['col_name']]
-        curr_revenue = row[date_mapping['newest']['col_name']]
-        if prev_revenue == 0:
-            return 1000.0 if curr_revenue > 0 else 0.0
-        return ((curr_revenue - prev_revenue) / abs(prev_revenue)) * 100
-    
-    offer_base_data['变化幅度(%)'] = offer_base_data.apply(calculate_offer_change_pct, axis=1)
-    offer_base_data['预算类型'] = offer_base_data['Offer ID'].apply(judge_budget_type)
-    
-    # 高差异Offer筛选
-    high_diff_mask = (offer_base_data['流水差（最新-次新）'].abs() >= 10)
-    high_diff_offers = offer_base_data[high_diff_mask]['Offer ID'].tolist()
-    
-    # ====================== 5、Affiliate维度精准分析 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(60)
-        status_text.text("👥 Affiliate维度分析...")
-    
-    offer_influence = pd.DataFrame(columns=['Offer ID', 'influence affiliate'])
-    
-    if high_diff_offers:
-        # 按Offer ID + Affiliate + Date分组计算
-        affiliate_daily_metrics = sheet1_all_data[sheet1_all_data['Offer ID'].isin(high_diff_offers)].groupby(
-            ['Offer ID', 'Affiliate', 'Date']
-        ).agg({
-            'Total Revenue': 'sum',
-            'Total Clicks': 'sum',
-            'Total Conversions': 'sum'
-        }).reset_index()
-        
-        # 分别提取最新/次新一天数据
-        aff_newest = affiliate_daily_metrics[affiliate_daily_metrics['Date'] == newest_date].copy()
-        aff_newest.columns = ['Offer ID', 'Affiliate', 'Date', 'Revenue_newest', 'Clicks_newest', 'Conversions_newest']
-        
-        aff_second = affiliate_daily_metrics[affiliate_daily_metrics['Date'] == second_newest_date].copy()
-        aff_second.columns = ['Offer ID', 'Affiliate', 'Date', 'Revenue_second', 'Clicks_second', 'Conversions_second']
-        
-        # 合并两天数据
-        aff_merged = pd.merge(
-            aff_newest, aff_second, 
-            on=['Offer ID', 'Affiliate'], 
-            how='outer'
-        ).fillna(0)
-        
-        # 计算差异指标
-        aff_merged['Revenue_Diff'] = aff_merged['Revenue_newest'] - aff_merged['Revenue_second']
-        aff_merged['Clicks_Diff'] = aff_merged['Clicks_newest'] - aff_merged['Clicks_second']
-        aff_merged['Clicks_Change_Pct'] = np.where(
-            aff_merged['Clicks_second'] > 0,
-            (aff_merged['Clicks_Diff'] / aff_merged['Clicks_second']) * 100,
-            np.where(aff_merged['Clicks_newest'] > 0, 1000.0, 0.0)
-        )
-        
-        # CR计算
-        aff_merged['CR_newest'] = np.where(
-            aff_merged['Clicks_newest'] > 0,
-            (aff_merged['Conversions_newest'] / aff_merged['Clicks_newest']) * 100,
-            0.0
-        )
-        aff_merged['CR_second'] = np.where(
-            aff_merged['Clicks_second'] > 0,
-            (aff_merged['Conversions_second'] / aff_merged['Clicks_second']) * 100,
-            0.0
-        )
-        aff_merged['CR_Change_Abs'] = aff_merged['CR_newest'] - aff_merged['CR_second']
-        
-        # 筛选有显著收入变化的Affiliate
-        significant_aff = aff_merged[aff_merged['Revenue_Diff'].abs() >= 5].copy()
-        significant_aff = significant_aff.sort_values(by='Revenue_Diff', ascending=False)
-        
-        def generate_influence_text(row):
-            affiliate = row['Affiliate']
-            revenue_newest = row['Revenue_newest']
-            revenue_second = row['Revenue_second']
-            revenue_diff = row['Revenue_Diff']
-            clicks_change = row['Clicks_Change_Pct']
-            cr_change = row['CR_Change_Abs']
-            
-            if revenue_newest > 0 and revenue_second == 0:
-                return f"{affiliate} 新增产生流水 {revenue_newest:.2f} 美金"
-            elif revenue_newest == 0 and revenue_second > 0:
-                return f"{affiliate} 停止产生流水，减少 {revenue_second:.2f} 美金"
-            else:
-                if revenue_second != 0:
-                    revenue_change_pct = (revenue_diff / abs(revenue_second)) * 100
-                else:
-                    revenue_change_pct = 1000.0 if revenue_diff > 0 else -1000.0
-                
-                if revenue_diff > 0:
-                    base_text = f"{affiliate} 增加 {revenue_diff:.2f} 美金/{abs(revenue_change_pct):.1f}%"
-                else:
-                    base_text = f"{affiliate} 减少 {abs(revenue_diff):.2f} 美金/{abs(revenue_change_pct):.1f}%"
-                
-                reasons = []
-                direction = "增加" if clicks_change > 0 else "减少"
-                reasons.append(f"Total Clicks{direction}{abs(clicks_change):.1f}%")
-                direction = "增加" if cr_change > 0 else "减少"
-                reasons.append(f"CR{direction}{abs(cr_change):.1f}%")
-                
-                return f"{base_text}，对应{', '.join(reasons)}"
-        
-        significant_aff['influence_text'] = significant_aff.apply(generate_influence_text, axis=1)
-        offer_influence = significant_aff.groupby('Offer ID')['influence_text'].apply(
-            lambda x: '\n'.join(x)
-        ).reset_index()
-        offer_influence.columns = ['Offer ID', 'influence affiliate']
-    
-    # ====================== 6、生成四个核心表格 ======================
-    if progress_bar and status_text:
-        progress_bar.progress(70)
-        status_text.text("📈 生成核心分析表格...")
-    
-    # 表格一：三级广告主日报表
-    table1_data = sheet1_all_data[sheet1_all_data['Date'].isin([newest_date, second_newest_date])].groupby(
-        ['三级广告主', 'Date']
-    ).agg({
-        'Total Revenue': 'sum',
-        'Total Profit': 'sum'
-    }).reset_index()
-    
-    table1 = pd.DataFrame()
-    table1['三级广告主'] = table1_data['三级广告主'].unique()
-    
-    for date_type in ['newest', 'second']:
-        current_date = date_mapping[date_type]['date']
-        current_date_str = date_mapping[date_type]['str']
-        temp = table1_data[table1_data['Date'] == current_date].set_index('三级广告主')
-        table1[f"{current_date_str} Total Revenue"] = table1['三级广告主'].map(temp['Total Revenue']).fillna(0)
-        table1[f"{current_date_str} Total Profit"] = table1['三级广告主'].map(temp['Total Profit']).fillna(0)
-    
-    table1 = table1[
-        ['三级广告主', 
-         f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
-         f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit"]
-    ].copy().round(2)
-    
-    # 表格二：高差异Offer ID详情
-    if high_diff_offers:
-        offer_details = sheet1_all_data[sheet1_all_data['Offer ID'].isin(high_diff_offers)][
-            ['Offer ID', 'GEO', 'Advertiser']
-        ].drop_duplicates(subset=['Offer ID']).reset_index(drop=True)
-        
-        table2 = pd.merge(offer_details, offer_base_data[
-            ['Offer ID', 'App ID', 'Status', date_mapping['newest']['col_name'], 
-             date_mapping['second']['col_name'], '流水差（最新-次新）', '变化幅度(%)', '预算类型']
-        ], on='Offer ID', how='left')
-        
-        table2 = pd.merge(table2, offer_influence, on='Offer ID', how='left')
-        table2['influence affiliate'] = table2['influence affiliate'].fillna('无显著变化')
-        
-        table2 = table2[
-            ['Offer ID', 'App ID', 'Status', 'GEO', 'Advertiser',
-             date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
-             '流水差（最新-次新）', '变化幅度(%)', '预算类型', 'influence affiliate']
-        ].copy()
-        
-        numeric_cols_table2 = [
-            date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
-            '流水差（最新-次新）', '变化幅度(%)'
-        ]
-        table2[numeric_cols_table2] = table2[numeric_cols_table2].round(2)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(job_id):
+    """只重新运行本片段轮询任务状态；任务结束后整页重新运行以显示结果"""
+    status = get_job_queue().status(job_id)
+    if status is None or status['status'] not in (QUEUED, RUNNING):
+        st.rerun()
+    if status['status'] == QUEUED:
+        st.info(f"⏳ 排队中，前面还有 {status['position']} 个任务")
+        if st.button("取消排队", key=f"cancel_{job_id}"):
+            get_job_queue().cancel(job_id)
+            st.rerun()
     else:
-        table2 = pd.DataFrame(columns=[
-            'Offer ID', 'App ID', 'Status', 'GEO', 'Advertiser',
-            date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
-            '流水差（最新-次新）', '变化幅度(%)', '预算类型', 'influence affiliate'
-        ])
-    
-     # ---------------------- 表格三：二级广告主综合报表（新增reject率） ----------------------
-    print("核心新增：表格三计算二级广告主reject率...")
-    table3 = pd.DataFrame()
-    table3['二级广告主'] = sheet1_all_data['二级广告主'].unique()
-    
-    # 填充收入/利润/转化数据
-    for date_type in ['newest', 'second']:
-        current_date = date_mapping[date_type]['date']
-        current_date_str = date_mapping[date_type]['str']
-        
-        temp = sheet1_all_data[sheet1_all_data['Date'] == current_date].groupby('二级广告主').agg({
-            'Total Revenue': 'sum',
-            'Total Profit': 'sum',
-            'Total Conversions': 'sum'
-        }).reset_index()
-        
-        table3[f"{current_date_str} Total Revenue"] = table3['二级广告主'].map(temp.set_index('二级广告主')['Total Revenue']).fillna(0)
-        table3[f"{current_date_str} Total Profit"] = table3['二级广告主'].map(temp.set_index('二级广告主')['Total Profit']).fillna(0)
-        table3[f"{current_date_str} Total Conversions"] = table3['二级广告主'].map(temp.set_index('二级广告主')['Total Conversions']).fillna(0)
-    
-    # 处理4--reject事件数据
-    sheet4_reject = pd.merge(
-        sheet4_reject, sheet3_advertiser[['Advertiser', '二级广告主']], 
-        on='Advertiser', how='left'
-    )
-    sheet4_reject['New Time'] = sheet4_reject['Time'].copy()
-    appnext_mask = sheet4_reject['Advertiser'].str.contains('appnext', case=False, na=False)
-    sheet4_reject.loc[appnext_mask, 'New Time'] = sheet4_reject.loc[appnext_mask, 'New Time'] - timedelta(days=1)
-    sheet4_reject['New Date'] = sheet4_reject['New Time'].dt.date
-    sheet4_reject = pd.merge(
-        sheet4_reject, sheet2_reject_rule[['Event', '是否为reject']], 
-        on='Event', how='left'
-    )
-    
-    # 填充Reject数据
-    reject_stats = sheet4_reject[sheet4_reject['New Date'].isin([newest_date, second_newest_date])].groupby(
-        ['New Date', '二级广告主']
-    ).agg({
-        '是否为reject': lambda x: (x == True).sum()
-    }).reset_index()
-    
-    for date_type in ['newest', 'second']:
-        current_date = date_mapping[date_type]['date']
-        current_date_str = date_mapping[date_type]['str']
-        
-        temp = reject_stats[reject_stats['New Date'] == current_date].set_index('二级广告主')
-        table3[f"{current_date_str} Total reject"] = table3['二级广告主'].map(temp['是否为reject']).fillna(0)
-    
-    # ========== 核心新增：计算二级广告主reject率 ==========
-    def calculate_reject_rate(row, date_str):
-        """
-        计算reject率：reject / (conversions + reject)
-        分母为0时返回0，避免除以0错误
-        """
-        conversions = row[f"{date_str} Total Conversions"]
-        reject = row[f"{date_str} Total reject"]
-        total = conversions + reject
-        if total == 0:
-            return 0.0
-        return (reject / total) * 100
-    
-    # 计算最新/次新一天的reject率
-    table3[date_mapping['newest']['reject_rate_col']] = table3.apply(
-        lambda x: calculate_reject_rate(x, newest_date_str), axis=1
-    ).round(2)
-    
-    table3[date_mapping['second']['reject_rate_col']] = table3.apply(
-        lambda x: calculate_reject_rate(x, second_newest_date_str), axis=1
-    ).round(2)
-    
-    # 调整列顺序并格式化
-    table3 = table3[
-        ['二级广告主', 
-         f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
-         f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
-         f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject", date_mapping['newest']['reject_rate_col'],
-         f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject", date_mapping['second']['reject_rate_col']]
-    ].copy()
-    
-    numeric_cols_table3 = [f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
-                          f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
-                          date_mapping['newest']['reject_rate_col'], date_mapping['second']['reject_rate_col']]
-    table3[numeric_cols_table3] = table3[numeric_cols_table3].round(2)
-    
-    int_cols_table3 = [f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject",
-                      f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject"]
-    table3[int_cols_table3] = table3[int_cols_table3].astype(int)
-    
-    # ---------------------- 表格四：Affiliate综合报表（新增reject率） ----------------------
-    print("核心新增：表格四计算Affiliate reject率...")
-    table4 = pd.DataFrame()
-    table4['Affiliate'] = sheet1_all_data['Affiliate'].unique()
-    
-    # 动态填充两天的收入/利润/转化数据
-    for date_type in ['newest', 'second']:
-        current_date = date_mapping[date_type]['date']
-        current_date_str = date_mapping[date_type]['str']
-        
-        daily_data = sheet1_all_data[sheet1_all_data['Date'] == current_date].groupby('Affiliate').agg({
-            'Total Revenue': 'sum',
-            'Total Profit': 'sum',
-            'Total Conversions': 'sum',
-            '二级广告主': lambda x: x.mode()[0] if not x.mode().empty else ''
-        }).reset_index()
-        
-        table4[f"{current_date_str} Total Revenue"] = table4['Affiliate'].map(daily_data.set_index('Affiliate')['Total Revenue']).fillna(0)
-        table4[f"{current_date_str} Total Profit"] = table4['Affiliate'].map(daily_data.set_index('Affiliate')['Total Profit']).fillna(0)
-        table4[f"{current_date_str} Total Conversions"] = table4['Affiliate'].map(daily_data.set_index('Affiliate')['Total Conversions']).fillna(0)
-        table4[f"{current_date_str} 二级广告主"] = table4['Affiliate'].map(daily_data.set_index('Affiliate')['二级广告主']).fillna('')
-    
-    # 合并二级广告主信息
-    def merge_advertisers(row):
-        adv1 = row[f"{second_newest_date_str} 二级广告主"]
-        adv2 = row[f"{newest_date_str} 二级广告主"]
-        advs = set()
-        if adv1 and adv1 != '0':
-            advs.add(str(adv1))
-        if adv2 and adv2 != '0':
-            advs.add(str(adv2))
-        return '; '.join(advs)
-    
-    table4['二级广告主'] = table4.apply(merge_advertisers, axis=1)
-    
-    # 填充Reject数据
-    reject_long = pd.melt(
-        table3[['二级广告主', f"{newest_date_str} Total reject", f"{second_newest_date_str} Total reject"]],
-        id_vars=['二级广告主'],
-        var_name='Date',
-        value_name='Total reject'
-    )
-    reject_long['Date'] = reject_long['Date'].str.extract(r'(\d{4}/\d{1,2}/\d{1,2})')
-    
-    def get_affiliate_reject(row, target_date_str):
-        if not row['二级广告主']:
-            return 0
-        total_reject = 0
-        for adv in row['二级广告主'].split('; '):
-            adv = adv.strip()
-            reject_val = reject_long[
-                (reject_long['二级广告主'] == adv) & 
-                (reject_long['Date'] == target_date_str)
-            ]['Total reject'].sum()
-            total_reject += reject_val
-        return total_reject
-    
-    # 添加reject列
-    table4[f"{newest_date_str} Total reject"] = table4.apply(
-        lambda x: get_affiliate_reject(x, newest_date_str), axis=1
-    ).astype(int)
-    
-    table4[f"{second_newest_date_str} Total reject"] = table4.apply(
-        lambda x: get_affiliate_reject(x, second_newest_date_str), axis=1
-    ).astype(int)
-    
-    # ========== 核心新增：计算Affiliate reject率 ==========
-    table4[date_mapping['newest']['reject_rate_col']] = table4.apply(
-        lambda x: calculate_reject_rate(x, newest_date_str), axis=1
-    ).round(2)
-    
-    table4[date_mapping['second']['reject_rate_col']] = table4.apply(
-        lambda x: calculate_reject_rate(x, second_newest_date_str), axis=1
-    ).round(2)
-    
-    # 调整列顺序并格式化
-    table4 = table4[
-        ['Affiliate', 
-         f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
-         f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
-         f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject", date_mapping['newest']['reject_rate_col'],
-         f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject", date_mapping['second']['reject_rate_col'],
-         '二级广告主']
-    ].copy()
-    
-    table4 = table4.fillna(0)
-    numeric_cols_table4 = [f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
-                          f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
-                          date_mapping['newest']['reject_rate_col'], date_mapping['second']['reject_rate_col']]
-    table4[numeric_cols_table4] = table4[numeric_cols_table4].round(2)
-    
-    int_cols_table4 = [f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject",
-                      f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject"]
-    table4[int_cols_table4] = table4[int_cols_table4].astype(int)
-    table4 = table4.sort_values('Affiliate').reset_index(drop=True)
+        st.progress(status['progress'])
+        st.text(status['message'])
 
 
-    
-    if progress_bar and status_text:
-        progress_bar.progress(90)
-        status_text.text("💾 准备下载文件...")
-    
-    # 返回所有结果
-    results = {
-        'table1': table1,
-        'table2': table2,
-        'table3': table3,
-        'table4': table4,
-        'newest_date_str': newest_date_str,
-        'newest_date_file_str': newest_date_file_str,
-        'stats': {
-            '高差异Offer数量': len(high_diff_offers),
-            '旧预算Offer数量': len(old_budget_offers),
-            '新预算Offer数量': len(all_offers - old_budget_offers)
-        }
-    }
-    
-    if progress_bar and status_text:
-        progress_bar.progress(100)
-        status_text.text("🎉 分析完成！")
-    
-    return results
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_report_excel_bytes(analysis_key, _results):
+    get_cache_stats().record_miss('download')
+    return build_report_excel_bytes(_results)
 
-# ==================== 文件下载功能 ====================
-def get_excel_download_link(results):
-    """生成Excel文件下载链接"""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        results['table1'].to_excel(writer, sheet_name='表格一_三级广告主日报表', index=False)
-        results['table2'].to_excel(writer, sheet_name='表格二_高差异Offer ID详情', index=False)
-        results['table3'].to_excel(writer, sheet_name='表格三_二级广告主综合报表', index=False)
-        results['table4'].to_excel(writer, sheet_name='表格四_Affiliate综合报表', index=False)
-    
-    output.seek(0)
-    b64 = base64.b64encode(output.read()).decode()
-    filename = f"{results['newest_date_file_str']}日报分析结论.xlsx"
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">📥 下载完整分析报告</a>'
-    return href
+
+def get_cached_report_excel_bytes(analysis_key, results):
+    """同一分析结果的Excel报告只生成一次"""
+    get_cache_stats().record_call('download')
+    return _cached_report_excel_bytes(analysis_key, results)
 
 
 # ==================== 模板下载功能 ====================
@@ -669,10 +347,25 @@ def main():
         """)
         
         st.header("⚙️ 分析规则")
-        st.info("""
-        - 高差异筛选：流水差绝对值≥10美金
-        - Affiliate分析：收入变化≥5美金
-        - 预算判断：过去6天收入>0=旧预算，否则新预算
+        with st.expander("调整阈值", expanded=False):
+            thresholds = {
+                'high_diff_threshold': st.number_input(
+                    "高差异流水差（美金）", min_value=0.0, value=float(HIGH_DIFF_THRESHOLD), step=1.0
+                ),
+                'affiliate_diff_threshold': st.number_input(
+                    "Affiliate收入变化（美金）", min_value=0.0, value=float(AFFILIATE_DIFF_THRESHOLD), step=1.0
+                ),
+                'budget_lookback_days': int(st.number_input(
+                    "预算判断回看天数", min_value=1, value=BUDGET_LOOKBACK_DAYS, step=1
+                )),
+                'history_days': int(st.number_input(
+                    "历史趋势天数", min_value=1, value=HISTORY_DAYS, step=1
+                )),
+            }
+        st.info(f"""
+        - 高差异筛选：流水差绝对值≥{thresholds['high_diff_threshold']:g}美金
+        - Affiliate分析：收入变化≥{thresholds['affiliate_diff_threshold']:g}美金
+        - 预算判断：过去{thresholds['budget_lookback_days']}天收入>0=旧预算，否则新预算
         """)
         
         st.header("📊 文件要求")
@@ -682,7 +375,43 @@ def main():
         - 3--匹配广告主  
         - 4--reject事件
         - 2-reject规则
+        
+        也可每个工作表上传一个CSV / CSV.gz / Parquet文件（文件名为工作表名），或打包为一个zip
         """)
+        
+        st.header("🚰 读取设置")
+        streaming_ingest = st.checkbox(
+            "大文件流式读取（低内存）",
+            value=False,
+            help="使用openpyxl只读模式逐行读取，适合百万行以上的1--all data（只对.xlsx生效）"
+        )
+        engine = st.selectbox(
+            "执行引擎",
+            ENGINES,
+            help="duckdb：汇总与筛选/关联/透视均为进程内DuckDB的SQL查询（需安装duckdb）；"
+                 "polars：汇总与筛选/关联/透视均为Polars LazyFrame查询（需安装polars）。结果按输出精度（两位小数）与pandas一致"
+        )
+        incremental_mode = st.checkbox(
+            "增量模式（本地聚合存储）",
+            value=False,
+            help="上传中的日期汇总后并入存储（已入库的日期整分区替换），报告由存储中最近的日汇总计算"
+        )
+        if st.button("🗑️ 清除解析缓存"):
+            get_parsed_upload_cache().clear()
+            st.success("✅ 已清除解析缓存")
+        
+        with st.expander("🧮 缓存统计", expanded=False):
+            cache_stats = get_cache_stats().snapshot()
+            if cache_stats:
+                st.dataframe(pd.DataFrame(cache_stats).T, use_container_width=True)
+            else:
+                st.caption("暂无缓存访问记录")
+        
+        job_stats = get_job_queue().stats()
+        st.caption(
+            f"🧵 分析任务：执行中 {job_stats['running']}/{job_stats['max_workers']}，"
+            f"排队 {job_stats['queued']}（上限 {job_stats['max_pending']}）"
+        )
     
     # 主内容区 - 文件上传
     get_github_template_download()
@@ -691,84 +420,149 @@ def main():
     st.markdown("### 📤 第二步：上传Excel文件")
 
     
-    uploaded_file = st.file_uploader(
-        "选择Excel文件（支持.xlsx格式）",
-        type=['xlsx'],
-        help="请上传包含Offer数据的完整Excel文件"
+    uploaded_files = st.file_uploader(
+        "选择Excel文件（支持.xlsx格式，或每个工作表一个CSV / CSV.gz / Parquet文件，也可打包为zip）",
+        type=['xlsx', 'zip', 'csv', 'gz', 'parquet'],
+        accept_multiple_files=True,
+        help="请上传包含Offer数据的完整Excel文件；大文件可按工作表导出为CSV/Parquet（文件名为工作表名，如 1--all data.csv）"
     )
     
-    if uploaded_file is not None:
+    if uploaded_files:
+        # 单个文件（xlsx / zip）直接读取，多个文件按工作表文件集合读取
+        uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else uploaded_files
         # 显示文件信息
-        file_details = {
-            "文件名": uploaded_file.name,
-            "文件类型": uploaded_file.type,
-            "文件大小": f"{uploaded_file.size / 1024:.2f} KB"
-        }
+        file_details = [
+            {
+                "文件名": f.name,
+                "文件类型": f.type,
+                "文件大小": f"{f.size / 1024:.2f} KB"
+            }
+            for f in uploaded_files
+        ]
+        if len(file_details) == 1:
+            file_details = file_details[0]
         
         col1, col2 = st.columns([2, 1])
         with col1:
             st.json(file_details)
         
+        # 先只读取工作表名与表头校验，缺少工作表或列时直接列出全部问题，不解析数据行
+        # 校验结果与文件哈希每次上传只计算一次
+        schema_problems, digest = get_session_upload_check(uploaded_files, uploaded_file)
+        if schema_problems:
+            st.error("❌ 文件不符合模板，请修改后重新上传：\n" + "\n".join(f"- {p}" for p in schema_problems))
+        
+        # 读取工作簿（预览与分析共用同一次解析结果，会话内按文件哈希复用）
+        workbook = None
+        load_error = None
+        if schema_problems:
+            load_error = ValueError("；".join(schema_problems))
+        else:
+            try:
+                workbook = get_session_workbook(uploaded_file, digest, streaming=streaming_ingest)
+            except Exception as e:
+                load_error = e
+        
         # 数据预览
         with st.expander("📖 数据预览（前5行）", expanded=False):
-            try:
-                df_preview = pd.read_excel(uploaded_file, sheet_name='1--all data')
+            if workbook is not None:
+                df_preview = workbook.sheet1_all_data
                 st.dataframe(df_preview.head(), use_container_width=True)
                 st.success(f"✅ 数据格式正确，共 {len(df_preview)} 行记录")
-            except Exception as e:
-                st.error(f"❌ 数据预览失败：{str(e)}")
+            else:
+                st.error(f"❌ 数据预览失败：{str(load_error)}")
         
-        # 开始分析按钮
+        # 同一文件+同一阈值的分析结果保存在session_state，按钮状态复位后仍然保留
+        analysis_key = (digest, tuple(sorted(thresholds.items())), incremental_mode, engine)
+        
+        # 开始分析按钮：只提交后台任务，分析在任务队列中执行，本会话不被阻塞
         if st.button("🚀 开始分析数据", type="primary", use_container_width=True):
-            # 创建进度条
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # 处理数据
-            with st.spinner("数据分析中，请稍候..."):
+            if workbook is None:
+                st.error(f"❌ 分析过程中出现错误：读取文件失败：{str(load_error)}")
+            else:
                 try:
-                    results = process_daily_report_web(uploaded_file, progress_bar, status_text)
-                    
-                    # 显示分析结果摘要
-                    st.markdown("### 📈 分析结果摘要")
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("高差异Offer数量", results['stats']['高差异Offer数量'])
-                    with col2:
-                        st.metric("旧预算Offer", results['stats']['旧预算Offer数量'])
-                    with col3:
-                        st.metric("新预算Offer", results['stats']['新预算Offer数量'])
-                    
-                    # 结果显示标签页
-                    tab1, tab2, tab3, tab4 = st.tabs([
-                        "📊 二级广告主报表", 
-                        "✅ 高差异Offer详情", 
-                        "👥 二级广告主报表", 
-                        "🔍 Affiliate报表"
-                    ])
-                    
-                    with tab1:
-                        st.dataframe(results['table1'], use_container_width=True)
-                    
-                    with tab2:
-                        st.dataframe(results['table2'], use_container_width=True)
-                    
-                    with tab3:
-                        st.dataframe(results['table3'], use_container_width=True)
-                    
-                    with tab4:
-                        st.dataframe(results['table4'], use_container_width=True)
-                    
-                    # 下载功能
-                    st.markdown("### 📥 下载分析报告")
-                    st.markdown(get_excel_download_link(results), unsafe_allow_html=True)
-                    
-                    st.success("🎉 分析完成！点击上方链接下载完整报告")
-                    
-                except Exception as e:
-                    st.error(f"❌ 分析过程中出现错误：{str(e)}")
-                    st.code(str(e))
+                    job_id = submit_report_job(
+                        analysis_key, digest, workbook, thresholds, engine=engine,
+                        incremental_mode=incremental_mode, name=', '.join(f.name for f in uploaded_files)
+                    )
+                    st.session_state['job'] = {'key': analysis_key, 'id': job_id}
+                    st.session_state.pop('analysis', None)
+                except RuntimeError as e:
+                    st.warning(f"⚠️ {str(e)}")
+        
+        # 轮询本会话提交的任务；结束后结果移入session_state['analysis']
+        job = st.session_state.get('job')
+        if job is not None and job['key'] == analysis_key:
+            status = get_job_queue().status(job['id'])
+            if status is not None and status['status'] in (QUEUED, RUNNING):
+                render_job_progress(job['id'])
+            else:
+                st.session_state.pop('job')
+                if status is None:
+                    st.error("❌ 分析任务的结果已释放，请重新分析")
+                elif status['status'] == DONE:
+                    st.session_state['analysis'] = {'key': analysis_key, 'results': get_job_queue().result(job['id'])}
+                elif status['status'] == FAILED:
+                    st.error(f"❌ 分析过程中出现错误：{status['error']}")
+                    st.code(status['error'])
+                elif status['status'] == CANCELLED:
+                    st.info("已取消排队中的分析任务")
+        
+        analysis = st.session_state.get('analysis')
+        if analysis is not None and analysis['key'] == analysis_key:
+            results = analysis['results']
+            
+            # 显示分析结果摘要
+            st.markdown("### 📈 分析结果摘要")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("高差异Offer数量", results['stats']['高差异Offer数量'])
+            with col2:
+                st.metric("旧预算Offer", results['stats']['旧预算Offer数量'])
+            with col3:
+                st.metric("新预算Offer", results['stats']['新预算Offer数量'])
+            
+            with st.expander("⏱️ 性能分析（各阶段耗时/CPU/内存/行数）", expanded=False):
+                st.caption(
+                    "wall_s：耗时；cpu_s：执行线程的CPU时间；peak_rss_delta_mb：峰值内存增长；"
+                    "start_s相同区间内的阶段为并行执行。结果来自缓存时为首次计算时的记录"
+                )
+                st.dataframe(
+                    pd.DataFrame.from_dict(results['profile'], orient='index').rename_axis('阶段'),
+                    use_container_width=True
+                )
+            
+            # 结果显示标签页
+            tab1, tab2, tab3, tab4, tab5 = st.tabs([
+                "📊 二级广告主报表", 
+                "✅ 高差异Offer详情", 
+                "👥 二级广告主报表", 
+                "🔍 Affiliate报表",
+                "📅 历史趋势"
+            ])
+            
+            with tab1:
+                st.dataframe(results['table1'], use_container_width=True)
+            
+            with tab2:
+                st.dataframe(results['table2'], use_container_width=True)
+            
+            with tab3:
+                st.dataframe(results['table3'], use_container_width=True)
+            
+            with tab4:
+                st.dataframe(results['table4'], use_container_width=True)
+            
+            with tab5:
+                st.caption(f"最近{thresholds['history_days']}天；7日均值为前7天（有数据的日期）的平均值，周环比为较7天前的差值")
+                st.dataframe(results['history'], use_container_width=True)
+            
+            # 下载功能
+            st.markdown("### 📥 下载分析报告")
+            render_excel_download_button(analysis_key, results)
+            
+            st.success("🎉 分析完成！点击上方按钮下载完整报告")
     
     else:
         # 欢迎界面
@@ -798,6 +592,7 @@ def main():
             - 表格二：高差异Offer ID详情  
             - 表格三：广告主综合报表
             - 表格四：流量综合报表
+            - 表格五：二级广告主历史趋势
             - 完整Excel报告一键下载
             """)
 
@@ -0,0 +1,177 @@
+"""
+性能基准：在合成工作簿上按数据规模记录各阶段耗时与峰值内存，并与基线比较
+
+    result = run_benchmark(sizes=(10_000, 100_000, 1_000_000), engine='pandas')
+    save_baseline(result, 'bench_baseline.json')
+    ...
+    regressions = compare_to_baseline(run_benchmark(), load_baseline('bench_baseline.json'))
+
+每个数据规模在独立的子进程中执行（spawn），峰值内存不受其它规模或父进程的影响；
+分析前重置进程峰值内存（Linux），peak_rss_mb只反映分析本身的峰值
+同一规模重复repeat次，耗时取各次的最小值以减少噪声，峰值内存取最大值
+load指定格式时，同一份合成数据按各格式（xlsx / csv / csv.gz / parquet / zip）写出后分别计时读取
+
+命令行入口见 adv_report_cli.py bench
+"""
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+BENCH_SIZES = (10_000, 100_000, 1_000_000)
+BENCH_BASELINE = 'bench_baseline.json'
+# 相对基线变慢/变大超过该比例视为退化
+REGRESSION_THRESHOLD = 0.2
+# 噪声下限：绝对差值低于该值的变化不视为退化（小规模下的毫秒级阶段波动很大）
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_MB = 20
+
+
+def _load_formats(load):
+    """load参数 → 格式列表：True为xlsx，False/None为不测试读取"""
+    if load is True:
+        return ['xlsx']
+    return list(load or [])
+
+
+def benchmark_size(rows, engine='pandas', repeat=3, max_workers=None, load=False, seed=0, **generator_options):
+    """
+    在当前进程中对一个数据规模执行基准测试，返回
+    {'rows', 'generate_s', 'load': {格式: 读取秒数}, 'total_s', 'peak_rss_mb', 'stages': {阶段名: 耗时秒数}}
+    load=True或格式列表时先写出文件再计时读取（写出100万行的xlsx需要数分钟），写出时间不计入
+    """
+    from adv_report_core import apply_compact_schema, load_report_workbook, process_daily_report_web
+    from adv_report_stages import StageProfiler, peak_rss_mb, reset_peak_rss
+    from adv_report_synthetic import generate_report_workbook, write_report_files
+
+    start = time.perf_counter()
+    raw = generate_report_workbook(rows=rows, seed=seed, **generator_options)
+    result = {'rows': rows, 'generate_s': round(time.perf_counter() - start, 4), 'load': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in _load_formats(load):
+            path = write_report_files(raw, os.path.join(tmp, f"synthetic.{fmt}"), fmt=fmt)
+            start = time.perf_counter()
+            load_report_workbook(path)
+            result['load'][fmt] = round(time.perf_counter() - start, 4)
+    workbook = apply_compact_schema(raw)
+    del raw
+
+    stages, totals, peaks = {}, [], []
+    for _ in range(max(1, repeat)):
+        reset_peak_rss()
+        profiler = StageProfiler()
+        start = time.perf_counter()
+        process_daily_report_web(None, workbook=workbook, engine=engine, max_workers=max_workers,
+                                 profiler=profiler)
+        totals.append(time.perf_counter() - start)
+        peaks.append(peak_rss_mb())
+        for name, record in profiler.to_dict().items():
+            stages[name] = min(stages.get(name, record['wall_s']), record['wall_s'])
+    result.update({
+        'total_s': round(min(totals), 4),
+        'peak_rss_mb': None if peaks[0] is None else round(max(peaks), 1),
+        'stages': stages,
+    })
+    return result
+
+
+def run_benchmark(sizes=BENCH_SIZES, engine='pandas', repeat=3, max_workers=None, load=False, seed=0,
+                  on_result=None, **generator_options):
+    """
+    依次在子进程中测试各数据规模，返回可直接保存为基线的字典
+    on_result(单个规模的结果)：每个规模完成后回调（用于逐行输出进度）
+    """
+    result = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'engine': engine,
+        'repeat': repeat,
+        'max_workers': max_workers,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sizes': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for rows in sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            size_result = executor.submit(
+                benchmark_size, rows, engine=engine, repeat=repeat, max_workers=max_workers,
+                load=load, seed=seed, **generator_options
+            ).result()
+        result['sizes'][str(rows)] = size_result
+        if on_result:
+            on_result(size_result)
+    return result
+
+
+def save_baseline(result, path=BENCH_BASELINE):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load_baseline(path=BENCH_BASELINE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_to_baseline(current, baseline, threshold=REGRESSION_THRESHOLD,
+                        min_seconds=MIN_REGRESSION_SECONDS, min_mb=MIN_REGRESSION_MB):
+    """
+    逐规模比较总耗时、峰值内存、各格式读取耗时与各阶段耗时，返回退化项列表：
+    [{'rows', 'metric', 'baseline', 'current', 'ratio'}]
+    只比较两边都有的规模与阶段；基线为0或缺失的指标跳过
+    """
+    regressions = []
+    for rows, size_result in current['sizes'].items():
+        base = baseline.get('sizes', {}).get(rows)
+        if base is None:
+            continue
+        metrics = [('total_s', size_result.get('total_s'), base.get('total_s'), min_seconds),
+                   ('peak_rss_mb', size_result.get('peak_rss_mb'), base.get('peak_rss_mb'), min_mb)]
+        metrics += [
+            (f"load:{fmt}", seconds, base.get('load', {}).get(fmt), min_seconds)
+            for fmt, seconds in size_result.get('load', {}).items()
+        ]
+        metrics += [
+            (f"stage:{name}", wall, base.get('stages', {}).get(name), min_seconds)
+            for name, wall in size_result.get('stages', {}).items()
+        ]
+        for metric, value, base_value, noise in metrics:
+            if value is None or not base_value:
+                continue
+            if value > base_value * (1 + threshold) and value - base_value > noise:
+                regressions.append({
+                    'rows': int(rows),
+                    'metric': metric,
+                    'baseline': base_value,
+                    'current': value,
+                    'ratio': round(value / base_value, 2),
+                })
+    return regressions
+
+
+def format_size_result(size_result):
+    """单个规模结果的一行摘要"""
+    stages = ', '.join(f"{name} {wall:.3f}s" for name, wall in size_result['stages'].items())
+    load = ''.join(f"读取{fmt} {seconds:.2f}s, " for fmt, seconds in size_result.get('load', {}).items())
+    peak = size_result.get('peak_rss_mb')
+    return (
+        f"{size_result['rows']:>9,} 行: {load}分析 {size_result['total_s']:.3f}s, "
+        f"峰值内存 {'-' if peak is None else f'{peak:.0f}MB'}\n           {stages}"
+    )
+
+
+def format_regression(regression):
+    unit = 'MB' if regression['metric'] == 'peak_rss_mb' else 's'
+    return (
+        f"{regression['rows']:>9,} 行 {regression['metric']}: "
+        f"{regression['baseline']}{unit} -> {regression['current']}{unit}（×{regression['ratio']}）"
+    )
@@ -0,0 +1,456 @@
+"""
+命令行批量运行日报分析（不导入Streamlit，适合cron定时任务）
+
+    python adv_report_cli.py run input.xlsx -o out.xlsx
+    python adv_report_cli.py run ./inputs/ -o ./outputs/ --jobs 4
+    python adv_report_cli.py run input.xlsx -o ./outputs/ --format xlsx --format parquet --format jsonl
+    python adv_report_cli.py run 20260127.zip ./20260128_csv/ -o ./outputs/   # 每个工作表一个CSV / Parquet文件
+
+增量模式（本地聚合存储，已入库的日期重新上传时整分区替换）：
+
+    python adv_report_cli.py ingest 20260127.xlsx --store ./adv_report_store
+    python adv_report_cli.py report --store ./adv_report_store -o ./outputs/
+
+只校验工作表名与表头（不解析数据行，毫秒级）：
+
+    python adv_report_cli.py check ./inputs/
+
+执行引擎一致性检查（各引擎输出的表格按输出精度应相同，见check_engine_parity）：
+
+    python adv_report_cli.py parity input.xlsx --engine pandas --engine duckdb --engine polars
+
+合成数据与性能基准（基线保存后，再次运行会标出超过阈值的退化，并以非零状态退出）：
+
+    python adv_report_cli.py generate synthetic.xlsx --rows 100000 --days 14 --appnext-fraction 0.1
+    python adv_report_cli.py generate ./synthetic_parquet/ --rows 100000 --format parquet
+    python adv_report_cli.py bench --save-baseline
+    python adv_report_cli.py bench --sizes 1000000 --load xlsx csv csv.gz parquet zip
+    python adv_report_cli.py bench --baseline bench_baseline.json --threshold 0.2
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from adv_report_core import (
+    HIGH_DIFF_THRESHOLD,
+    AFFILIATE_DIFF_THRESHOLD,
+    BUDGET_LOOKBACK_DAYS,
+    HISTORY_DAYS,
+    ENGINES,
+    check_engine_parity,
+    load_report_workbook,
+    load_report_workbook_cached,
+    process_daily_report_web,
+    report_filename,
+    validate_report_upload,
+)
+from adv_report_bench import (
+    BENCH_BASELINE,
+    BENCH_SIZES,
+    REGRESSION_THRESHOLD,
+    compare_to_baseline,
+    format_regression,
+    format_size_result,
+    load_baseline,
+    run_benchmark,
+    save_baseline,
+)
+from adv_report_export import REPORT_WRITERS, write_report_outputs
+from adv_report_store import STORE_DIR, DailyAggregateStore, required_days
+from adv_report_stages import STAGE_WORKERS, StageProfiler, write_profile_jsonl
+from adv_report_synthetic import REPORT_FILE_FORMATS, generate_report_workbook, write_report_files
+from adv_report_tables import match_sheet
+
+
+def collect_inputs(paths):
+    """
+    展开输入参数：目录下的全部.xlsx / .zip（跳过Excel锁文件~$*），按文件名排序
+    目录中含有按工作表命名的CSV / Parquet文件时，整个目录作为一个输入（见adv_report_tables）
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if not name.startswith(('.', '~$')))
+            if any(match_sheet(name) for name in names):
+                inputs.append(path)
+                continue
+            inputs.extend(
+                os.path.join(path, name) for name in names
+                if name.lower().endswith(('.xlsx', '.zip'))
+            )
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def _output_path(input_path, output, results, single):
+    """
+    单个输入且-o以.xlsx结尾时直接写到该文件；
+    否则写到输出目录（默认与输入同目录），文件名为 <输入文件名>_<日期>日报分析结论.xlsx
+    """
+    if single and output and output.lower().endswith('.xlsx'):
+        return output
+    output_dir = output or os.path.dirname(os.path.abspath(input_path))
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(os.path.normpath(input_path)))[0]
+    return os.path.join(output_dir, f"{stem}_{report_filename(results)}")
+
+
+def run_one(input_path, output, single=True, streaming=False, use_cache=False, thresholds=None,
+            formats=('xlsx',), engine='pandas', stage_workers=None, profile_log=None):
+    """
+    处理单个工作簿，返回各阶段耗时（秒）与输出路径；在进程池中执行
+    stage_workers为分析内部并行计算的阶段数（见process_daily_report_web的max_workers）
+    formats中的其它格式与xlsx报告写在同一目录、使用同一文件名前缀
+    profile_log指定时，读取/分析各阶段/写出的性能记录追加写入该JSON lines文件
+    """
+    timing = {'input': input_path}
+    profiler = StageProfiler()
+    try:
+        start = time.perf_counter()
+        with profiler.measure('load') as record:
+            if use_cache:
+                workbook = load_report_workbook_cached(input_path, streaming=streaming)
+            else:
+                workbook = load_report_workbook(input_path, streaming=streaming)
+            record['output_rows'] = len(workbook.sheet1_all_data)
+        loaded = time.perf_counter()
+        results = process_daily_report_web(
+            input_path, workbook=workbook, engine=engine, max_workers=stage_workers, profiler=profiler,
+            **(thresholds or {})
+        )
+        analysed = time.perf_counter()
+        output_path = _output_path(input_path, output, results, single)
+        with profiler.measure('write'):
+            write_report_outputs(
+                results, os.path.dirname(os.path.abspath(output_path)), formats=formats,
+                stem=os.path.splitext(os.path.basename(output_path))[0]
+            )
+        written = time.perf_counter()
+        timing.update({
+            'output': output_path,
+            'load': loaded - start,
+            'analysis': analysed - loaded,
+            'write': written - analysed,
+            'total': written - start,
+            'stages': profiler.to_dict(),
+        })
+        if profile_log:
+            write_profile_jsonl(timing['stages'], profile_log, input=input_path, engine=engine)
+    except Exception as e:
+        timing['error'] = str(e)
+    return timing
+
+
+def _format_timing(timing):
+    if 'error' in timing:
+        return f"❌ {timing['input']}: {timing['error']}"
+    stages = ', '.join(f"{name} {record['wall_s']:.2f}s" for name, record in timing['stages'].items())
+    return (
+        f"✅ {timing['input']}: 读取 {timing['load']:.2f}s, 分析 {timing['analysis']:.2f}s, "
+        f"写出 {timing['write']:.2f}s, 共 {timing['total']:.2f}s -> {timing['output']}\n"
+        f"   各阶段：{stages}"
+    )
+
+
+def _add_report_arguments(parser):
+    """run与report共用的导出格式、分析阈值与性能记录参数"""
+    parser.add_argument('--format', dest='formats', action='append', choices=list(REPORT_WRITERS),
+                        help='导出格式，可重复指定（默认xlsx）')
+    parser.add_argument('--high-diff-threshold', type=float, default=HIGH_DIFF_THRESHOLD,
+                        help='高差异Offer流水差阈值（美金）')
+    parser.add_argument('--affiliate-diff-threshold', type=float, default=AFFILIATE_DIFF_THRESHOLD,
+                        help='Affiliate收入变化阈值（美金）')
+    parser.add_argument('--budget-lookback-days', type=int, default=BUDGET_LOOKBACK_DAYS,
+                        help='预算判断回看天数')
+    parser.add_argument('--history-days', type=int, default=HISTORY_DAYS,
+                        help='二级广告主历史趋势天数')
+    parser.add_argument('--profile-log', help='把各阶段的耗时/CPU/内存/行数追加写入该JSON lines文件')
+
+
+def _thresholds(args):
+    return {
+        'high_diff_threshold': args.high_diff_threshold,
+        'affiliate_diff_threshold': args.affiliate_diff_threshold,
+        'budget_lookback_days': args.budget_lookback_days,
+        'history_days': args.history_days,
+    }
+
+
+INPUTS_HELP = '输入的.xlsx / .zip文件、包含它们的目录，或每个工作表一个CSV / Parquet文件的目录'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='adv-report', description='网盟日报分析（命令行版）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='分析一个或多个Excel工作簿')
+    run_parser.add_argument('inputs', nargs='+', help=INPUTS_HELP)
+    run_parser.add_argument('-o', '--output', help='输出文件（单个输入）或输出目录')
+    run_parser.add_argument('-j', '--jobs', type=int, default=1, help='并行进程数（默认1）')
+    run_parser.add_argument('--streaming', action='store_true', help='使用openpyxl只读流式读取')
+    run_parser.add_argument('--cache', action='store_true', help='使用Parquet解析缓存')
+    run_parser.add_argument('--engine', choices=ENGINES, default='pandas', help='执行引擎（duckdb/polars为可选依赖）')
+    run_parser.add_argument('--stage-workers', type=int, default=None,
+                            help=f'分析内部并行计算的阶段数（默认{STAGE_WORKERS}，1为依次执行）')
+    _add_report_arguments(run_parser)
+
+    ingest_parser = subparsers.add_parser('ingest', help='把工作簿中的日期并入本地聚合存储（已入库的日期整分区替换）')
+    ingest_parser.add_argument('inputs', nargs='+', help=f'{INPUTS_HELP}（按文件名顺序入库）')
+    ingest_parser.add_argument('--store', default=STORE_DIR, help=f'聚合存储目录（默认{STORE_DIR}）')
+    ingest_parser.add_argument('--keep-existing', action='store_true', help='已入库的日期保持不变，只写入新日期')
+    ingest_parser.add_argument('--streaming', action='store_true', help='使用openpyxl只读流式读取')
+
+    report_parser = subparsers.add_parser('report', help='由本地聚合存储生成报告')
+    report_parser.add_argument('--store', default=STORE_DIR, help=f'聚合存储目录（默认{STORE_DIR}）')
+    report_parser.add_argument('-o', '--output', default='.', help='输出目录（默认当前目录）')
+    report_parser.add_argument('--engine', choices=ENGINES, default='pandas',
+                               help='立方上筛选/关联/透视的执行引擎（polars为LazyFrame查询）')
+    _add_report_arguments(report_parser)
+
+    check_parser = subparsers.add_parser('check', help='只读取工作表名与表头，列出不符合模板的全部问题')
+    check_parser.add_argument('inputs', nargs='+', help=INPUTS_HELP)
+
+    parity_parser = subparsers.add_parser('parity', help='比较各执行引擎对同一工作簿的分析结果')
+    parity_parser.add_argument('inputs', nargs='+', help=INPUTS_HELP)
+    parity_parser.add_argument('--engine', dest='engines', action='append', choices=ENGINES,
+                               help='参与比较的引擎，第一个为基准（默认全部）')
+    parity_parser.add_argument('--streaming', action='store_true', help='使用openpyxl只读流式读取')
+
+    generate_parser = subparsers.add_parser('generate', help='生成四个工作表的合成工作簿')
+    generate_parser.add_argument('output', help='输出的.xlsx / .zip文件，CSV / Parquet格式时为输出目录')
+    generate_parser.add_argument('--format', choices=REPORT_FILE_FORMATS, default='xlsx',
+                                 help='输出格式（默认xlsx；csv / csv.gz / parquet为每个工作表一个文件）')
+    generate_parser.add_argument('--rows', type=int, default=100_000, help='1--all data行数（默认100000）')
+    _add_generator_arguments(generate_parser)
+
+    bench_parser = subparsers.add_parser('bench', help='在合成数据上测试各阶段耗时与峰值内存')
+    bench_parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCH_SIZES),
+                              help=f"数据规模（1--all data行数，默认{' '.join(map(str, BENCH_SIZES))}）")
+    bench_parser.add_argument('--engine', choices=ENGINES, default='pandas', help='执行引擎')
+    bench_parser.add_argument('--repeat', type=int, default=3, help='每个规模重复次数，耗时取最小值（默认3）')
+    bench_parser.add_argument('--stage-workers', type=int, default=None,
+                              help=f'分析内部并行计算的阶段数（默认{STAGE_WORKERS}）')
+    bench_parser.add_argument('--load', nargs='*', choices=REPORT_FILE_FORMATS, default=None, metavar='FORMAT',
+                              help=f"同时测试各格式的读取耗时（{' / '.join(REPORT_FILE_FORMATS)}，"
+                                   f"不指定格式时为xlsx；写出xlsx较慢）")
+    bench_parser.add_argument('--baseline', default=BENCH_BASELINE, help=f'基线文件（默认{BENCH_BASELINE}）')
+    bench_parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    bench_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                              help=f'退化阈值（相对基线的增长比例，默认{REGRESSION_THRESHOLD}）')
+    bench_parser.add_argument('-o', '--output', help='本次结果另存为JSON文件')
+    _add_generator_arguments(bench_parser)
+    return parser
+
+
+def _add_generator_arguments(parser):
+    """generate与bench共用的合成数据参数"""
+    parser.add_argument('--offers', type=int, default=2_000, help='Offer个数（默认2000）')
+    parser.add_argument('--affiliates', type=int, default=300, help='Affiliate个数（默认300）')
+    parser.add_argument('--advertisers', type=int, default=60, help='Advertiser个数（默认60）')
+    parser.add_argument('--days', type=int, default=14, help='覆盖天数（默认14）')
+    parser.add_argument('--appnext-fraction', type=float, default=0.1, help='appnext广告主的行所占比例（默认0.1）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+
+
+def _generator_options(args):
+    return {
+        'offers': args.offers,
+        'affiliates': args.affiliates,
+        'advertisers': args.advertisers,
+        'days': args.days,
+        'appnext_fraction': args.appnext_fraction,
+    }
+
+
+def run(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("未找到任何输入文件（.xlsx / .zip / 工作表CSV、Parquet目录）", file=sys.stderr)
+        return 1
+
+    options = {
+        'single': len(inputs) == 1,
+        'streaming': args.streaming,
+        'use_cache': args.cache,
+        'formats': args.formats or ['xlsx'],
+        'engine': args.engine,
+        'stage_workers': args.stage_workers,
+        'profile_log': args.profile_log,
+        'thresholds': _thresholds(args),
+    }
+
+    start = time.perf_counter()
+    timings = []
+    if args.jobs <= 1 or len(inputs) == 1:
+        for input_path in inputs:
+            timings.append(run_one(input_path, args.output, **options))
+            print(_format_timing(timings[-1]), flush=True)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(run_one, input_path, args.output, **options) for input_path in inputs]
+            for future in as_completed(futures):
+                timings.append(future.result())
+                print(_format_timing(timings[-1]), flush=True)
+
+    failed = sum('error' in timing for timing in timings)
+    print(f"完成 {len(timings) - failed}/{len(timings)} 个文件，总耗时 {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
+
+
+def ingest(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("未找到任何输入文件（.xlsx / .zip / 工作表CSV、Parquet目录）", file=sys.stderr)
+        return 1
+
+    store = DailyAggregateStore(args.store)
+    failed = 0
+    for input_path in inputs:
+        start = time.perf_counter()
+        try:
+            written = store.ingest(load_report_workbook(input_path, streaming=args.streaming),
+                                   overwrite=not args.keep_existing)
+        except Exception as e:
+            failed += 1
+            print(f"❌ {input_path}: {str(e)}", flush=True)
+            continue
+        days = ', '.join(day.isoformat() for day in written['cube']) or '无新日期'
+        print(f"✅ {input_path}: 入库 {days}，reject {len(written['reject'])} 天，"
+              f"耗时 {time.perf_counter() - start:.2f}s", flush=True)
+    return 1 if failed else 0
+
+
+def report(args):
+    start = time.perf_counter()
+    thresholds = _thresholds(args)
+    try:
+        aggregates = DailyAggregateStore(args.store).load(
+            days=required_days(thresholds['budget_lookback_days'], thresholds['history_days'])
+        )
+        results = process_daily_report_web(None, aggregates=aggregates, engine=args.engine, **thresholds)
+        paths = write_report_outputs(results, args.output, formats=args.formats or ['xlsx'])
+        if args.profile_log:
+            write_profile_jsonl(results['profile'], args.profile_log, input=args.store, engine=args.engine)
+    except Exception as e:
+        print(f"❌ {args.store}: {str(e)}", file=sys.stderr)
+        return 1
+    for fmt_paths in paths.values():
+        for path in fmt_paths:
+            print(path)
+    print(f"完成，共 {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def check(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("未找到任何输入文件（.xlsx / .zip / 工作表CSV、Parquet目录）", file=sys.stderr)
+        return 1
+
+    failed = 0
+    for input_path in inputs:
+        start = time.perf_counter()
+        problems = validate_report_upload(input_path)
+        elapsed = time.perf_counter() - start
+        if problems:
+            failed += 1
+            print(f"❌ {input_path}: {len(problems)}处问题（{elapsed * 1000:.0f}ms）", flush=True)
+            for problem in problems:
+                print(f"    - {problem}", flush=True)
+        else:
+            print(f"✅ {input_path}: 工作表与表头符合模板（{elapsed * 1000:.0f}ms）", flush=True)
+    return 1 if failed else 0
+
+
+def parity(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("未找到任何输入文件（.xlsx / .zip / 工作表CSV、Parquet目录）", file=sys.stderr)
+        return 1
+
+    engines = args.engines or list(ENGINES)
+    failed = 0
+    for input_path in inputs:
+        try:
+            problems = check_engine_parity(
+                load_report_workbook(input_path, streaming=args.streaming), engines=engines
+            )
+        except Exception as e:
+            problems = [str(e)]
+        if problems:
+            failed += 1
+            print(f"❌ {input_path}:", flush=True)
+            for problem in problems:
+                print(f"    {problem}", flush=True)
+        else:
+            print(f"✅ {input_path}: {' / '.join(engines)} 结果一致", flush=True)
+    return 1 if failed else 0
+
+
+def generate(args):
+    start = time.perf_counter()
+    try:
+        workbook = generate_report_workbook(rows=args.rows, seed=args.seed, **_generator_options(args))
+        write_report_files(workbook, args.output, fmt=args.format)
+    except Exception as e:
+        print(f"❌ {args.output}: {str(e)}", file=sys.stderr)
+        return 1
+    print(f"✅ {args.output}: {args.rows} 行，耗时 {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def bench(args):
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        baseline = load_baseline(args.baseline)
+        if baseline.get('engine') != args.engine:
+            print(f"⚠️ 基线引擎为{baseline.get('engine')}，本次为{args.engine}", flush=True)
+
+    result = run_benchmark(
+        sizes=args.sizes, engine=args.engine, repeat=args.repeat, max_workers=args.stage_workers,
+        load=['xlsx'] if args.load == [] else args.load, seed=args.seed,
+        on_result=lambda size: print(format_size_result(size), flush=True), **_generator_options(args)
+    )
+    if args.output:
+        save_baseline(result, args.output)
+    if args.save_baseline:
+        print(f"基线已保存：{save_baseline(result, args.baseline)}")
+        return 0
+    if baseline is None:
+        print(f"未找到基线 {args.baseline}，使用 --save-baseline 保存本次结果")
+        return 0
+
+    regressions = compare_to_baseline(result, baseline, threshold=args.threshold)
+    if not regressions:
+        print(f"✅ 与基线（{baseline.get('created')}）相比无超过{args.threshold:.0%}的退化")
+        return 0
+    print(f"❌ 与基线（{baseline.get('created')}）相比有{len(regressions)}项退化：")
+    for regression in regressions:
+        print(f"    {format_regression(regression)}")
+    return 1
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'run':
+        return run(args)
+    if args.command == 'ingest':
+        return ingest(args)
+    if args.command == 'report':
+        return report(args)
+    if args.command == 'check':
+        return check(args)
+    if args.command == 'parity':
+        return parity(args)
+    if args.command == 'generate':
+        return generate(args)
+    if args.command == 'bench':
+        return bench(args)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1812 @@
+"""
+网盟日报分析的计算部分（不依赖Streamlit，可在批处理/命令行中直接导入）
+"""
+import pandas as pd
+import numpy as np
+import difflib
+import os
+import re
+import hashlib
+import numbers
+import shutil
+import uuid
+from datetime import timedelta
+from io import BytesIO
+import tempfile
+from dataclasses import dataclass
+
+from adv_report_stages import Stage, StageProfiler, StageScheduler
+
+# ==================== 数据读取 ====================
+# 每个工作表只读取分析需要的列，并显式指定类型
+# 标识列保持object（保留原始单元格类型，如数值型Offer ID），指标列统一为float64
+# Time列由openpyxl直接解析为日期时间，读取后再统一转换
+SHEET_SCHEMAS = {
+    '1--all data': {
+        'Time': None,
+        'Offer ID': object,
+        'App ID': object,
+        'Advertiser': object,
+        'Affiliate': object,
+        'Status': object,
+        'GEO': object,
+        'Total Revenue': 'float64',
+        'Total Profit': 'float64',
+        'Total Clicks': 'float64',
+        'Total Conversions': 'float64',
+    },
+    '3--匹配广告主': {
+        'Advertiser': object,
+        '二级广告主': object,
+        '三级广告主': object,
+    },
+    '4--reject事件': {
+        'Time': None,
+        'Advertiser': object,
+        'Event': object,
+    },
+    '2-reject规则': {
+        'Event': object,
+        '是否为reject': object,
+    },
+}
+
+
+@dataclass
+class ReportWorkbook:
+    """一次读取得到的四个工作表"""
+    sheet1_all_data: pd.DataFrame
+    sheet3_advertiser: pd.DataFrame
+    sheet4_reject: pd.DataFrame
+    sheet2_reject_rule: pd.DataFrame
+
+
+# ReportWorkbook字段 → 工作表名
+WORKBOOK_SHEETS = {
+    'sheet1_all_data': '1--all data',
+    'sheet3_advertiser': '3--匹配广告主',
+    'sheet4_reject': '4--reject事件',
+    'sheet2_reject_rule': '2-reject规则',
+}
+
+
+def _parse_sheet(excel_file, sheet_name):
+    """按SHEET_SCHEMAS解析单个工作表"""
+    schema = SHEET_SCHEMAS[sheet_name]
+    df = excel_file.parse(
+        sheet_name=sheet_name,
+        usecols=list(schema),
+        dtype={col: dtype for col, dtype in schema.items() if dtype is not None}
+    )
+    if 'Time' in schema:
+        df['Time'] = pd.to_datetime(df['Time'])
+    return df
+
+
+# 流式读取模式：openpyxl只读逐行迭代，按块写入带类型的列缓冲区
+# 以下高基数标识列以分类编码(int32 codes + 共享字典)保存
+STREAMING_CATEGORICAL_COLUMNS = ['Offer ID', 'Affiliate', 'Advertiser']
+STREAMING_CHUNK_SIZE = 50000
+
+
+class _CategoricalBuffer:
+    """跨块共享字典的分类编码缓冲区"""
+    
+    def __init__(self):
+        self.lookup = {}
+        self.chunks = []
+    
+    def append(self, values):
+        local_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        remap = np.fromiter(
+            (self.lookup.setdefault(value, len(self.lookup)) for value in uniques),
+            dtype=np.int32, count=len(uniques)
+        )
+        codes = np.full(len(local_codes), -1, dtype=np.int32)
+        observed = local_codes >= 0
+        codes[observed] = remap[local_codes[observed]]
+        self.chunks.append(codes)
+    
+    def finish(self):
+        codes = np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=np.int32)
+        categories = list(self.lookup)
+        # 字典按值排序，使分类列的排序/合并顺序与普通object列一致
+        try:
+            order = np.argsort(np.asarray(categories, dtype=object), kind='stable')
+        except TypeError:
+            order = np.arange(len(categories))
+        rank = np.empty(len(categories), dtype=np.int32)
+        rank[order] = np.arange(len(categories), dtype=np.int32)
+        codes = np.where(codes >= 0, rank[codes], -1).astype(np.int32) if len(categories) else codes
+        return pd.Categorical.from_codes(
+            codes, categories=pd.Index([categories[i] for i in order], dtype=object)
+        )
+
+
+def _convert_column_chunk(values, dtype):
+    """把一个块的原始单元格值转换为对应类型的numpy数组"""
+    if dtype is None:
+        return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy()
+    if dtype == 'float64':
+        return np.array(values, dtype=np.float64)
+    array = np.array(values, dtype=object)
+    array[pd.isna(array)] = np.nan
+    return array
+
+
+def _stream_sheet(worksheet, sheet_name, categorical_columns=(), chunk_size=STREAMING_CHUNK_SIZE):
+    """
+    逐行迭代只读工作表，每chunk_size行转换一次列缓冲区
+    不保留openpyxl单元格对象，也不一次性构建整表的行列表
+    """
+    schema = SHEET_SCHEMAS[sheet_name]
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    positions = {name: idx for idx, name in enumerate(header) if name is not None}
+    missing = [col for col in schema if col not in positions]
+    if missing:
+        raise ValueError(f"工作表 {sheet_name} 缺少列：{', '.join(missing)}")
+    
+    columns = list(schema)
+    indexes = [positions[col] for col in columns]
+    buffers = {
+        col: _CategoricalBuffer() if col in categorical_columns else []
+        for col in columns
+    }
+    
+    def flush(chunk):
+        for col, values in zip(columns, zip(*chunk)):
+            if col in categorical_columns:
+                buffers[col].append(values)
+            else:
+                buffers[col].append(_convert_column_chunk(values, schema[col]))
+    
+    chunk = []
+    for row in rows:
+        # 与pd.read_excel一致：跳过整行为空的记录
+        if row.count(None) == len(row):
+            continue
+        chunk.append(tuple(row[idx] if idx < len(row) else None for idx in indexes))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    
+    data = {}
+    for col in columns:
+        if col in categorical_columns:
+            data[col] = buffers[col].finish()
+        elif buffers[col]:
+            data[col] = np.concatenate(buffers[col])
+        else:
+            data[col] = _convert_column_chunk([], schema[col])
+    return pd.DataFrame(data, columns=columns)
+
+
+def _load_report_workbook_streaming(uploaded_file, chunk_size=STREAMING_CHUNK_SIZE):
+    """流式读取模式：一次打开只读工作簿，逐行读取全部工作表"""
+    from openpyxl import load_workbook
+    
+    if hasattr(uploaded_file, 'seek'):
+        uploaded_file.seek(0)
+    excel_book = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        return ReportWorkbook(
+            sheet1_all_data=_stream_sheet(
+                excel_book['1--all data'], '1--all data',
+                categorical_columns=STREAMING_CATEGORICAL_COLUMNS, chunk_size=chunk_size
+            ),
+            sheet3_advertiser=_stream_sheet(excel_book['3--匹配广告主'], '3--匹配广告主', chunk_size=chunk_size),
+            sheet4_reject=_stream_sheet(excel_book['4--reject事件'], '4--reject事件', chunk_size=chunk_size),
+            sheet2_reject_rule=_stream_sheet(excel_book['2-reject规则'], '2-reject规则', chunk_size=chunk_size),
+        )
+    finally:
+        excel_book.close()
+
+
+# 除.xlsx外，也可以每个工作表一个CSV / CSV.gz / Parquet文件上传
+# （多个文件、所在目录或zip，见adv_report_tables）
+TABLE_FILE_SUFFIXES = ('.csv', '.csv.gz', '.parquet', '.zip')
+
+
+def upload_name(uploaded_file):
+    """上传文件（Streamlit UploadedFile / 文件对象 / 路径）的文件名，未知时为空字符串"""
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        return os.path.basename(os.path.normpath(os.fspath(uploaded_file)))
+    return os.path.basename(getattr(uploaded_file, 'name', None) or '')
+
+
+def upload_files(uploaded_file):
+    """上传内容展开为文件列表：列表原样返回，目录返回其中的文件（按文件名排序），其它为单个文件"""
+    if isinstance(uploaded_file, (list, tuple)):
+        return list(uploaded_file)
+    if isinstance(uploaded_file, (str, os.PathLike)) and os.path.isdir(uploaded_file):
+        return [
+            os.path.join(uploaded_file, name) for name in sorted(os.listdir(uploaded_file))
+            if not name.startswith(('.', '~$')) and os.path.isfile(os.path.join(uploaded_file, name))
+        ]
+    return [uploaded_file]
+
+
+def is_table_upload(uploaded_file):
+    """是否按表格文件读取（文件列表、目录、zip或单个CSV/Parquet），否则按xlsx读取"""
+    if isinstance(uploaded_file, (list, tuple)):
+        return True
+    if isinstance(uploaded_file, (str, os.PathLike)) and os.path.isdir(uploaded_file):
+        return True
+    return upload_name(uploaded_file).lower().endswith(TABLE_FILE_SUFFIXES)
+
+
+# ==================== 表头校验 ====================
+# 解析数据行之前，只读取工作表名与表头行，一次列出全部不符合SHEET_SCHEMAS的问题
+# （百万行的工作簿完整解析需要数十秒，缺列时原本要到分析中途才以KeyError报出）
+
+def _rewind(uploaded_file):
+    if hasattr(uploaded_file, 'seek'):
+        uploaded_file.seek(0)
+
+
+def read_workbook_headers(uploaded_file):
+    """
+    openpyxl只读模式打开xlsx，只读取各工作表的第一行
+    返回 ({模板工作表名: 表头列表}, 全部工作表名)
+    """
+    from openpyxl import load_workbook
+
+    _rewind(uploaded_file)
+    excel_book = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        headers = {
+            sheet_name: list(next(excel_book[sheet_name].iter_rows(min_row=1, max_row=1, values_only=True), ()))
+            for sheet_name in excel_book.sheetnames if sheet_name in SHEET_SCHEMAS
+        }
+        return headers, list(excel_book.sheetnames)
+    finally:
+        excel_book.close()
+        _rewind(uploaded_file)
+
+
+def read_upload_headers(uploaded_file):
+    """
+    上传内容 → ({模板工作表名: 表头列表}, 其它工作表名/文件名, 是否为工作表文件集合)
+    xlsx读取工作表第一行，CSV / Parquet只读取表头或元数据（见adv_report_tables.read_table_headers）
+    """
+    if is_table_upload(uploaded_file):
+        from adv_report_tables import read_table_headers
+        return read_table_headers(uploaded_file)
+    headers, sheet_names = read_workbook_headers(uploaded_file)
+    return headers, [name for name in sheet_names if name not in headers], False
+
+
+def _close_match(name, candidates):
+    """大小写/空格不同或拼写相近的候选名，用于提示"""
+    candidates = [str(c) for c in candidates if c is not None and str(c) != name]
+    normalized = name.strip().lower()
+    for candidate in candidates:
+        if candidate.strip().lower() == normalized:
+            return candidate
+    matches = difflib.get_close_matches(name, candidates, n=1, cutoff=0.75)
+    return matches[0] if matches else None
+
+
+def validate_report_upload(uploaded_file):
+    """
+    只读取工作表名与表头，按SHEET_SCHEMAS检查四个工作表，返回全部问题（空列表表示通过）
+    不解析数据行，百万行的工作簿也只需毫秒级
+    """
+    try:
+        headers, others, table_files = read_upload_headers(uploaded_file)
+    except Exception as e:
+        return [f"无法读取文件：{str(e)}"]
+
+    problems = []
+    for sheet_name, schema in SHEET_SCHEMAS.items():
+        if sheet_name not in headers:
+            match = _close_match(sheet_name, others)
+            if table_files:
+                hint = f"文件名应为工作表名，如 {sheet_name}.csv" + (f"；疑似：{match}" if match else '')
+                problems.append(f"缺少工作表文件：{sheet_name}（{hint}）")
+            else:
+                problems.append(f"缺少工作表：{sheet_name}" + (f"（疑似：{match}）" if match else ''))
+            continue
+        header = headers[sheet_name]
+        if all(cell is None for cell in header):
+            problems.append(f"工作表 {sheet_name} 没有表头行（第一行为空）")
+            continue
+        missing = []
+        for col in schema:
+            if col not in header:
+                match = _close_match(col, header)
+                missing.append(col + (f"（表头中为“{match}”）" if match else ''))
+        if missing:
+            problems.append(f"工作表 {sheet_name} 缺少列：{'、'.join(missing)}")
+    return problems
+
+
+def check_report_upload(uploaded_file):
+    """validate_report_upload有问题时抛出ValueError，消息中逐条列出"""
+    problems = validate_report_upload(uploaded_file)
+    if problems:
+        raise ValueError(
+            f"文件不符合模板（共{len(problems)}处问题）：\n" + '\n'.join(f"- {problem}" for problem in problems)
+        )
+
+
+def load_report_workbook(uploaded_file, streaming=False, compact=True, validate=True):
+    """
+    只打开一次Excel文件，读取分析所需的全部工作表
+    streaming=True时使用openpyxl只读流式读取，适合超大的1--all data
+    compact=True时标识列转为共享字典的分类类型，计数列无损压缩为int32
+    uploaded_file为CSV / Parquet文件集合、目录或zip时由pyarrow读取（见adv_report_tables）
+    validate=True时先只读取表头校验（check_report_upload），缺少工作表或列时不解析数据行
+    """
+    if validate:
+        check_report_upload(uploaded_file)
+    if is_table_upload(uploaded_file):
+        from adv_report_tables import load_report_tables
+        workbook = load_report_tables(uploaded_file)
+    elif streaming:
+        workbook = _load_report_workbook_streaming(uploaded_file)
+    else:
+        with pd.ExcelFile(uploaded_file, engine='openpyxl') as excel_file:
+            workbook = ReportWorkbook(
+                sheet1_all_data=_parse_sheet(excel_file, '1--all data'),
+                sheet3_advertiser=_parse_sheet(excel_file, '3--匹配广告主'),
+                sheet4_reject=_parse_sheet(excel_file, '4--reject事件'),
+                sheet2_reject_rule=_parse_sheet(excel_file, '2-reject规则'),
+            )
+    return apply_compact_schema(workbook) if compact else workbook
+
+
+# ==================== 紧凑类型 ====================
+# 同一业务含义的标识列在各工作表间共享同一个分类字典，
+# 使Advertiser / Event上的合并直接在整数编码上进行
+CATEGORICAL_DOMAINS = {
+    'Offer ID': [('sheet1_all_data', 'Offer ID')],
+    'App ID': [('sheet1_all_data', 'App ID')],
+    'Affiliate': [('sheet1_all_data', 'Affiliate')],
+    'Advertiser': [('sheet1_all_data', 'Advertiser'), ('sheet3_advertiser', 'Advertiser'),
+                   ('sheet4_reject', 'Advertiser')],
+    '二级广告主': [('sheet3_advertiser', '二级广告主')],
+    '三级广告主': [('sheet3_advertiser', '三级广告主')],
+    'GEO': [('sheet1_all_data', 'GEO')],
+    'Status': [('sheet1_all_data', 'Status')],
+    'Event': [('sheet4_reject', 'Event'), ('sheet2_reject_rule', 'Event')],
+}
+# 只压缩计数列；收入/利润为金额，float32求和会丢失精度，保持float64
+COUNT_COLUMNS = ['Total Clicks', 'Total Conversions']
+
+
+def _sorted_categories(values):
+    """分类字典按值排序（与object列的排序/合并顺序一致），无法排序时保持首次出现顺序"""
+    try:
+        return pd.Index(sorted(values), dtype=object)
+    except TypeError:
+        return pd.Index(values, dtype=object)
+
+
+def _downcast_counts(series):
+    """无缺失、均为整数且在int32范围内时转为int32，否则原样返回"""
+    values = series.to_numpy()
+    if values.dtype.kind not in 'fiu' or len(values) == 0 or np.isnan(values.astype(float)).any():
+        return series
+    info = np.iinfo(np.int32)
+    if (values % 1 != 0).any() or values.min() < info.min or values.max() > info.max:
+        return series
+    return series.astype(np.int32)
+
+
+def apply_compact_schema(workbook):
+    """
+    返回紧凑类型的新ReportWorkbook（不修改传入的数据）
+    - CATEGORICAL_DOMAINS中的标识列转为分类类型，同一domain共享字典
+    - COUNT_COLUMNS无损压缩为int32
+    """
+    frames = {field: getattr(workbook, field).copy(deep=False) for field in WORKBOOK_SHEETS}
+    for columns in CATEGORICAL_DOMAINS.values():
+        present = [(field, col) for field, col in columns if col in frames[field].columns]
+        if not present:
+            continue
+        uniques = pd.unique(pd.concat(
+            [pd.Series(frames[field][col].dropna().unique(), dtype=object) for field, col in present],
+            ignore_index=True
+        ))
+        categories = _sorted_categories(list(uniques))
+        for field, col in present:
+            frames[field][col] = pd.Categorical(frames[field][col], categories=categories)
+    for col in COUNT_COLUMNS:
+        if col in frames['sheet1_all_data'].columns:
+            frames['sheet1_all_data'][col] = _downcast_counts(frames['sheet1_all_data'][col])
+    return ReportWorkbook(**frames)
+
+
+def column_memory_usage(workbook):
+    """每个工作表每一列的内存占用（字节，含object字符串）"""
+    records = []
+    for field, sheet_name in WORKBOOK_SHEETS.items():
+        usage = getattr(workbook, field).memory_usage(index=False, deep=True)
+        records.extend({'工作表': sheet_name, '列': col, '字节': int(size)} for col, size in usage.items())
+    return pd.DataFrame(records)
+
+
+def compare_column_memory(before, after):
+    """对比两个ReportWorkbook的逐列内存占用"""
+    merged = pd.merge(
+        column_memory_usage(before), column_memory_usage(after),
+        on=['工作表', '列'], how='outer', suffixes=('_before', '_after')
+    )
+    return merged.rename(columns={'字节_before': '压缩前(字节)', '字节_after': '压缩后(字节)'})
+
+
+# ==================== 解析结果缓存 ====================
+# 以上传文件内容的哈希为键，把解析后的四个工作表保存为Parquet
+# 同一文件重复上传或重复点击分析时直接读取列式文件，跳过Excel解析
+PARSED_CACHE_DIR = os.environ.get(
+    'ADV_REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'adv_report_cache')
+)
+PARSED_CACHE_MAX_BYTES = int(os.environ.get('ADV_REPORT_CACHE_MAX_MB', '2048')) * 1024 * 1024
+# 读取逻辑或SHEET_SCHEMAS变化时递增，使旧缓存自动失效
+PARSED_CACHE_VERSION = 'v2'
+
+
+def read_upload_bytes(uploaded_file):
+    """读取上传文件（Streamlit UploadedFile / 文件对象 / 路径）的全部字节"""
+    if hasattr(uploaded_file, 'getvalue'):
+        return uploaded_file.getvalue()
+    if hasattr(uploaded_file, 'read'):
+        uploaded_file.seek(0)
+        data = uploaded_file.read()
+        uploaded_file.seek(0)
+        return data
+    with open(uploaded_file, 'rb') as f:
+        return f.read()
+
+
+def compute_upload_digest(uploaded_file):
+    """
+    上传文件内容的哈希值，作为缓存键
+    多个文件（或目录）时按文件名排序，文件名与内容一起计入哈希
+    """
+    if not (isinstance(uploaded_file, (list, tuple)) or
+            isinstance(uploaded_file, (str, os.PathLike)) and os.path.isdir(uploaded_file)):
+        return hashlib.blake2b(read_upload_bytes(uploaded_file), digest_size=20).hexdigest()
+    digest = hashlib.blake2b(digest_size=20)
+    for f in sorted(upload_files(uploaded_file), key=upload_name):
+        name = upload_name(f).encode('utf-8')
+        data = read_upload_bytes(f)
+        digest.update(len(name).to_bytes(8, 'little') + name + len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def restore_schema_dtypes(df, sheet_name):
+    """Parquet读回后恢复SHEET_SCHEMAS声明的列类型（缺失值统一为NaN）"""
+    for col, dtype in SHEET_SCHEMAS[sheet_name].items():
+        if col not in df.columns:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # 字典统一还原为object，保证各工作表共享字典的类型完全一致
+            categories = pd.Index(np.asarray(df[col].cat.categories, dtype=object), dtype=object)
+            df[col] = pd.Categorical.from_codes(df[col].cat.codes, categories=categories)
+        elif dtype is object:
+            values = df[col].astype(object)
+            df[col] = values.where(values.notna(), np.nan)
+        elif dtype == 'float64':
+            # 计数列可能已无损压缩为int32（见apply_compact_schema）
+            if df[col].dtype.kind in 'iu':
+                df[col] = df[col].astype(np.int32)
+            else:
+                df[col] = df[col].astype('float64')
+    return df
+
+
+# object列中混合了数字和文本（如部分Offer ID为数字）时Parquet无法按列带类型写出：
+# 该列统一写为文本，原为数字的值另存到<列名>__numeric，读取时由decode_mixed_columns还原
+# 解析结果缓存与本地聚合存储（adv_report_store）共用
+NUMERIC_SUFFIX = '__numeric'
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _is_mixed(values):
+    return pd.api.types.infer_dtype(values, skipna=True).startswith('mixed')
+
+
+def encode_mixed_columns(frame):
+    """
+    返回可写入Parquet的DataFrame（不修改传入的数据）
+    混合数字和文本的object列（或字典混合的分类列）写为文本列加<列名>__numeric
+    """
+    frame = frame.copy(deep=False)
+    for col in list(frame.columns):
+        values = frame[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if not _is_mixed(values.cat.categories):
+                continue
+            values = pd.Series(np.asarray(values, dtype=object), index=frame.index)
+        elif values.dtype != object or not _is_mixed(values):
+            continue
+        numeric = values.map(_is_number).to_numpy(dtype=bool)
+        if numeric.any():
+            frame[col + NUMERIC_SUFFIX] = pd.array(
+                [value if is_number else None for value, is_number in zip(values, numeric)]
+            )
+        frame[col] = values.where(values.isna() | numeric, values.astype(str)).where(~numeric, None)
+    return frame
+
+
+def decode_mixed_columns(frame):
+    """encode_mixed_columns的逆过程：原为数字的值从<列名>__numeric合并回该列（object列）"""
+    for numeric_col in [col for col in frame.columns if col.endswith(NUMERIC_SUFFIX)]:
+        col = numeric_col[:-len(NUMERIC_SUFFIX)]
+        numeric = frame[numeric_col].notna().to_numpy()
+        values = frame[col].astype(object).to_numpy(copy=True)
+        values[numeric] = frame[numeric_col].astype(object).to_numpy()[numeric]
+        frame[col] = values
+        del frame[numeric_col]
+    return frame
+
+
+class ParsedUploadCache:
+    """
+    解析结果的本地列式缓存
+    每个条目是一个目录（四个Parquet文件），按总大小做LRU淘汰
+    """
+
+    SHEET_FILES = WORKBOOK_SHEETS
+
+    def __init__(self, cache_dir=PARSED_CACHE_DIR, max_bytes=PARSED_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, f"{PARSED_CACHE_VERSION}-{digest}")
+
+    def get(self, digest):
+        """命中时返回ReportWorkbook并刷新访问时间，未命中返回None"""
+        entry_dir = self._entry_dir(digest)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            frames = {
+                field: pd.read_parquet(os.path.join(entry_dir, f"{field}.parquet"), dtype_backend='numpy_nullable')
+                for field in self.SHEET_FILES
+            }
+        except Exception:
+            # 条目损坏（如写入中断）时直接丢弃
+            self.invalidate(digest)
+            return None
+        os.utime(entry_dir)
+        mixed = any(col.endswith(NUMERIC_SUFFIX) for frame in frames.values() for col in frame.columns)
+        workbook = ReportWorkbook(**{
+            field: restore_schema_dtypes(decode_mixed_columns(frames[field]), sheet_name)
+            for field, sheet_name in self.SHEET_FILES.items()
+        })
+        if mixed and any(isinstance(dtype, pd.CategoricalDtype)
+                         for field in self.SHEET_FILES for dtype in getattr(workbook, field).dtypes):
+            # 混合列读回为object：按紧凑类型重新编码，与写入前的共享字典一致
+            workbook = apply_compact_schema(workbook)
+        return workbook
+
+    def put(self, digest, workbook):
+        """
+        写入缓存条目（先写临时目录再重命名，保证并发读取时条目完整）
+        混合数字和文本的列按encode_mixed_columns写出；
+        其余Arrow无法转换的数据或写入失败（如磁盘已满）时不缓存，返回False
+        """
+        import pyarrow as pa
+
+        entry_dir = self._entry_dir(digest)
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            for field in self.SHEET_FILES:
+                encode_mixed_columns(getattr(workbook, field)).to_parquet(
+                    os.path.join(tmp_dir, f"{field}.parquet"), index=False
+                )
+            if not os.path.isdir(entry_dir):
+                os.rename(tmp_dir, entry_dir)
+        except (pa.ArrowException, OSError):
+            return False
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+        return True
+
+    def invalidate(self, digest):
+        """删除指定文件的缓存条目"""
+        shutil.rmtree(self._entry_dir(digest), ignore_errors=True)
+
+    def clear(self):
+        """删除全部缓存条目"""
+        for name in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def entries(self):
+        """返回 [(条目目录, 字节数, 最近访问时间)]，按最近访问时间从旧到新排序"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.tmp-') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                result.append((entry_dir, size, os.stat(entry_dir).st_mtime))
+            except FileNotFoundError:
+                continue
+        return sorted(result, key=lambda item: item[2])
+
+    def evict(self):
+        """总大小超过上限时，从最久未访问的条目开始删除"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for entry_dir, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+_parsed_upload_cache = None
+
+
+def get_parsed_upload_cache():
+    """进程内共享的默认缓存实例"""
+    global _parsed_upload_cache
+    if _parsed_upload_cache is None:
+        _parsed_upload_cache = ParsedUploadCache()
+    return _parsed_upload_cache
+
+
+def load_report_workbook_cached(uploaded_file, streaming=False, cache=None, validate=True):
+    """
+    带缓存的读取：先按文件哈希查找Parquet缓存，未命中再解析Excel并写入缓存
+    调用方已经过validate_report_upload校验时传validate=False，不再重复读取表头
+    """
+    cache = cache or get_parsed_upload_cache()
+    digest = compute_upload_digest(uploaded_file)
+    workbook = cache.get(digest)
+    if workbook is None:
+        workbook = load_report_workbook(uploaded_file, streaming=streaming, validate=validate)
+        cache.put(digest, workbook)
+    return workbook
+
+
+# ==================== 核心处理函数 ====================
+def group_mode(df, by, column, weights=None):
+    """
+    每组内出现次数最多的值，等价于 groupby(by)[column].agg(lambda x: x.mode()[0])
+    - 次数并列时取排序后最小的值（与Series.mode一致）
+    - 忽略缺失值，全部缺失的分组不出现在结果中
+    - weights为行权重列名（如汇总数据的原始行数），默认每行计1次
+    基于因子化编码一次计数，不在Python中逐组调用Series.mode
+    返回以分组键为索引的Series
+    """
+    data = df[df[column].notna()]
+    grouped = data.groupby(by, sort=True, observed=True)
+    group_codes = grouped.ngroup().to_numpy()
+    group_index = grouped.size().index
+    value_codes, value_uniques = pd.factorize(data[column], sort=True)
+    
+    # 丢弃分组键缺失的行（ngroup为-1）
+    keep = group_codes >= 0
+    group_codes = group_codes[keep].astype(np.int64)
+    value_codes = value_codes[keep].astype(np.int64)
+    
+    n_values = max(len(value_uniques), 1)
+    if weights is None:
+        pair_codes, pair_counts = np.unique(group_codes * n_values + value_codes, return_counts=True)
+    else:
+        pair_codes, pair_inverse = np.unique(group_codes * n_values + value_codes, return_inverse=True)
+        pair_counts = np.bincount(
+            pair_inverse.ravel(), weights=data[weights].to_numpy(dtype=float)[keep], minlength=len(pair_codes)
+        )
+    pair_groups = pair_codes // n_values
+    pair_values = pair_codes % n_values
+    
+    # pair_codes已按(分组, 值)升序；稳定排序次数降序后，每组第一个即为众数
+    order = np.lexsort((-pair_counts, pair_groups))
+    pair_groups = pair_groups[order]
+    pair_values = pair_values[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_groups[1:] != pair_groups[:-1]
+    
+    return pd.Series(
+        np.asarray(value_uniques, dtype=object)[pair_values[first]],
+        index=group_index[pair_groups[first]],
+        name=column
+    )
+
+
+# 日数据立方：原始数据只做一次分组汇总，四个表格均由立方派生
+CUBE_KEYS = ['Date', 'Offer ID', 'Affiliate', 'Advertiser']
+CUBE_METRICS = ['Total Revenue', 'Total Profit', 'Total Clicks', 'Total Conversions']
+# 格内第一行的属性列（"首次出现"的Status/App ID/GEO）
+CUBE_ATTRIBUTES = ['Status', 'App ID', 'GEO']
+# reject事件按 (Date, Advertiser, Event) 计数，日期平移与reject规则在计数上进行（见reject_event_rows）
+REJECT_CUBE_KEYS = ['Date', 'Advertiser', 'Event']
+# 立方的Date列为日期键：截断到当天0点的datetime64[s]（pandas没有datetime64[D]），缺失为NaT
+# 分组、筛选、比较都在int64上进行；datetime.date / 日期字符串只在显示与文件名处产生
+DAY_DTYPE = 'datetime64[s]'
+
+
+def day_key(values):
+    """Time列 / 日期序列（datetime64、datetime.date或字符串） → 日期键数组"""
+    dtype = getattr(values, 'dtype', None)
+    if not (isinstance(dtype, np.dtype) and dtype.kind == 'M'):
+        # 已是datetime64的列直接截断，不再经过pd.to_datetime（千万行时约1.5秒）
+        values = pd.to_datetime(values)
+    days = np.asarray(values).astype('datetime64[D]')
+    return days.astype(DAY_DTYPE)
+
+
+def build_daily_cube(sheet1_all_data):
+    """
+    按 (Date, Offer ID, Affiliate, Advertiser) 对原始数据做一次汇总
+    - 指标列求和
+    - Max Revenue：格内单行最大收入（新旧预算按"存在收入>0的行"判断）
+    - Row Count：格内原始行数（按行计数的众数使用）
+    - First Row：格内第一行在原始数据中的位置，立方按此排序，保持原始出现顺序
+    - CUBE_ATTRIBUTES：格内第一行的属性值，之后不再需要原始数据
+    """
+    rows = sheet1_all_data[CUBE_KEYS + CUBE_METRICS].copy(deep=False)
+    rows['First Row'] = np.arange(len(rows))
+    aggregations = {metric: (metric, 'sum') for metric in CUBE_METRICS}
+    aggregations['Max Revenue'] = ('Total Revenue', 'max')
+    aggregations['Row Count'] = ('First Row', 'size')
+    aggregations['First Row'] = ('First Row', 'min')
+    cube = rows.groupby(CUBE_KEYS, sort=False, observed=True, dropna=False).agg(**aggregations)
+    cube = cube.reset_index().sort_values('First Row', kind='stable').reset_index(drop=True)
+    positions = cube['First Row'].to_numpy()
+    for col in CUBE_ATTRIBUTES:
+        cube[col] = sheet1_all_data[col].to_numpy()[positions]
+    return cube
+
+
+def build_reject_cube(sheet4_reject):
+    """reject事件按 (Date, Advertiser, Event) 计数（Event Count）"""
+    events = sheet4_reject[REJECT_CUBE_KEYS]
+    counts = events.groupby(REJECT_CUBE_KEYS, sort=False, observed=True, dropna=False).size()
+    return counts.rename('Event Count').reset_index()
+
+
+def _first_row_values(cube_rows, columns):
+    """立方行的首行属性值（分类编码还原为普通值，索引从0开始）"""
+    return pd.DataFrame(
+        {col: np.asarray(cube_rows[col], dtype=object) for col in columns}
+    )
+
+
+@dataclass
+class DailyAggregates:
+    """
+    分析所需的全部汇总数据：报告只依赖这些汇总，不再依赖原始行
+    可由一次上传的工作簿构建，也可从本地聚合存储（adv_report_store）读取
+    """
+    daily_cube: pd.DataFrame
+    reject_cube: pd.DataFrame
+    sheet3_advertiser: pd.DataFrame
+    sheet2_reject_rule: pd.DataFrame
+
+
+# 执行引擎：
+# - pandas（默认）
+# - duckdb：原始行汇总与立方上的筛选/关联/透视均为DuckDB SQL（可选依赖，见adv_report_duckdb）
+# - polars：原始行汇总与立方上的筛选/关联/透视均为Polars LazyFrame（可选依赖，见adv_report_polars）
+ENGINES = ('pandas', 'duckdb', 'polars')
+
+
+def _check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"不支持的执行引擎：{engine}（可选：{', '.join(ENGINES)}）")
+
+
+def build_daily_aggregates(workbook, engine='pandas'):
+    """由ReportWorkbook构建DailyAggregates（原始行只在这里分组一次）"""
+    _check_engine(engine)
+    if engine == 'duckdb':
+        from adv_report_duckdb import build_daily_aggregates_duckdb
+        return build_daily_aggregates_duckdb(workbook)
+    if engine == 'polars':
+        from adv_report_polars import build_daily_aggregates_polars
+        return build_daily_aggregates_polars(workbook)
+    sheet1_all_data = workbook.sheet1_all_data.copy(deep=False)
+    sheet4_reject = workbook.sheet4_reject.copy(deep=False)
+    sheet1_all_data['Date'] = day_key(sheet1_all_data['Time'])
+    sheet4_reject['Date'] = day_key(sheet4_reject['Time'])
+    return DailyAggregates(
+        daily_cube=build_daily_cube(sheet1_all_data),
+        reject_cube=build_reject_cube(sheet4_reject),
+        sheet3_advertiser=workbook.sheet3_advertiser,
+        sheet2_reject_rule=workbook.sheet2_reject_rule,
+    )
+
+
+# 关联3--匹配广告主后立方新增的列
+ADVERTISER_LEVELS = ['二级广告主', '三级广告主']
+
+
+# reject事件日期平移规则：Advertiser名称包含关键字（不区分大小写）时，事件计入的日期平移的天数
+# 按声明顺序匹配，先匹配的规则优先
+REJECT_DAY_SHIFTS = {'appnext': -1}
+
+
+def _per_value(series, func):
+    """
+    对series的每个不同取值计算一次func（分类列在字典上，其它列在因子化的唯一值上），再按编码展开到每行
+    func接收object数组（最后一项为缺失值），返回等长的numpy数组
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+    values = np.append(np.asarray(uniques, dtype=object), np.nan)
+    # 缺失值的编码为-1，正好取到最后一项
+    return np.asarray(func(values))[codes]
+
+
+def advertiser_day_shifts(advertisers):
+    """每个Advertiser的事件日期平移天数（REJECT_DAY_SHIFTS，无匹配或缺失为0）"""
+    names = pd.Series(advertisers, dtype=object)
+    shifts = np.zeros(len(names), dtype=np.int64)
+    matched = np.zeros(len(names), dtype=bool)
+    for keyword, days in REJECT_DAY_SHIFTS.items():
+        hit = names.str.contains(keyword, case=False, na=False, regex=False).to_numpy(dtype=bool) & ~matched
+        shifts[hit] = days
+        matched |= hit
+    return shifts
+
+
+def reject_rule_weights(events, sheet2_reject_rule):
+    """
+    每个Event计入reject的倍数：2-reject规则中该Event且是否为reject为True的行数
+    （通常为0或1；规则表中同一Event重复时与逐行关联后计数的结果一致，缺失的Event也按关联规则匹配）
+    """
+    rule_events = np.asarray(sheet2_reject_rule['Event'], dtype=object)
+    is_reject = (sheet2_reject_rule['是否为reject'] == True).to_numpy(dtype=float)
+    inverse, keys = pd.factorize(rule_events, use_na_sentinel=False)
+    counts = np.bincount(inverse, weights=is_reject, minlength=len(keys)).astype(np.int64)
+    positions = pd.Index(keys, dtype=object).get_indexer(np.asarray(events, dtype=object))
+    return np.where(positions >= 0, counts[positions], 0)
+
+
+def reject_event_rows(reject_cube, sheet2_reject_rule):
+    """
+    reject计数行 → (Advertiser, New Date, Reject Count)
+    - New Date：Date按所属Advertiser的平移规则调整，每个Advertiser只判断一次
+    - Reject Count：Event Count × 该Event的reject倍数，每个Event只查一次规则
+    """
+    shifts = _per_value(reject_cube['Advertiser'], advertiser_day_shifts)
+    weights = _per_value(reject_cube['Event'], lambda events: reject_rule_weights(events, sheet2_reject_rule))
+    return pd.DataFrame({
+        'Advertiser': reject_cube['Advertiser'].to_numpy(),
+        'New Date': reject_cube['Date'].to_numpy(dtype=DAY_DTYPE) + shifts.astype('timedelta64[D]'),
+        'Reject Count': reject_cube['Event Count'].to_numpy() * weights,
+    })
+
+
+class CodeLabels:
+    """
+    标识列的编码与还原（非pandas引擎以int32编码关联和分组，结果再还原）
+    source为调用方的原始列（分类或object），compact为共享字典的分类列，两者行数一致
+    """
+
+    def __init__(self, source, compact):
+        self.dtype = source.dtype if isinstance(source.dtype, pd.CategoricalDtype) else None
+        self.compact_dtype = compact.dtype
+        self.categories = np.asarray(compact.cat.categories, dtype=object)
+
+    def encode(self, values):
+        """原始值 → 编码（不在字典中的值为-1）"""
+        return pd.Categorical(values, dtype=self.compact_dtype).codes
+
+    def decode(self, codes):
+        """编码（-1为缺失）→ 与原始列相同类型的值"""
+        codes = np.asarray(codes, dtype=np.int32)
+        if self.dtype is not None:
+            return pd.Categorical.from_codes(codes, dtype=self.dtype)
+        values = np.full(len(codes), np.nan, dtype=object)
+        observed = codes >= 0
+        values[observed] = self.categories[codes[observed]]
+        return values
+
+
+def compact_aggregates(aggregates):
+    """
+    返回共享字典的紧凑汇总（Advertiser / Event在各表间编码一致，关联直接在编码上进行）
+    已是紧凑类型时原样返回
+    """
+    frames = {
+        'sheet1_all_data': aggregates.daily_cube,
+        'sheet4_reject': aggregates.reject_cube,
+        'sheet3_advertiser': aggregates.sheet3_advertiser,
+        'sheet2_reject_rule': aggregates.sheet2_reject_rule,
+    }
+    shared = [
+        [('sheet1_all_data', 'Advertiser'), ('sheet3_advertiser', 'Advertiser'), ('sheet4_reject', 'Advertiser')],
+        [('sheet4_reject', 'Event'), ('sheet2_reject_rule', 'Event')],
+    ]
+    single = [('sheet1_all_data', 'Offer ID'), ('sheet1_all_data', 'Affiliate'),
+              ('sheet3_advertiser', '二级广告主'), ('sheet3_advertiser', '三级广告主')]
+    columns = single + [column for group in shared for column in group]
+    dtype = lambda column: frames[column[0]][column[1]].dtype
+    is_compact = (
+        all(isinstance(dtype(column), pd.CategoricalDtype) for column in columns)
+        and all(dtype(column) == dtype(group[0]) for group in shared for column in group)
+    )
+    if is_compact:
+        return frames
+    compact = apply_compact_schema(ReportWorkbook(**frames))
+    return {field: getattr(compact, field) for field in frames}
+
+
+class PandasReportFrames:
+    """
+    日数据立方上的筛选、分组、关联与透视（pandas实现）
+    process_daily_report_web只通过这些方法访问汇总数据；
+    其它引擎（adv_report_polars.PolarsReportFrames、adv_report_duckdb.DuckDBReportFrames）
+    提供同名方法并返回相同结构的pandas结果；用完后调用close()释放引擎资源
+    """
+    
+    def __init__(self, aggregates):
+        self.daily_cube = aggregates.daily_cube
+        self.reject_cube = aggregates.reject_cube
+        self.sheet3_advertiser = aggregates.sheet3_advertiser
+        self.sheet2_reject_rule = aggregates.sheet2_reject_rule
+        self.advertiser_cube = None
+    
+    def close(self):
+        """pandas实现没有需要释放的资源"""
+    
+    def join_advertisers(self):
+        """立方关联二级/三级广告主（映射重复时立方行随之重复，与逐行关联一致）"""
+        if self.advertiser_cube is None:
+            self.advertiser_cube = pd.merge(
+                self.daily_cube,
+                self.sheet3_advertiser[['Advertiser'] + ADVERTISER_LEVELS],
+                on='Advertiser',
+                how='left'
+            )
+        return self.advertiser_cube
+    
+    def _cube(self, advertisers):
+        return self.join_advertisers() if advertisers else self.daily_cube
+    
+    def dates(self):
+        """全部日期（pd.Timestamp），从新到旧"""
+        days = pd.DatetimeIndex(self.daily_cube['Date'].dropna().unique())
+        return list(days.sort_values(ascending=False))
+    
+    def unique(self, column, advertisers=False):
+        """列的唯一值（按立方中的首次出现顺序，含缺失值，普通值）"""
+        return np.asarray(self._cube(advertisers)[column].unique(), dtype=object)
+    
+    def first_rows(self, key, columns, date=None):
+        """每个key首次出现的立方行的columns（date指定时只看当天）"""
+        cube = self.daily_cube
+        if date is not None:
+            cube = cube[cube['Date'] == date]
+        return _first_row_values(cube.drop_duplicates(subset=[key]), columns)
+    
+    def pivot(self, keys, aggregations, dates, advertisers=False):
+        """pivot_by_date；advertisers=True时在关联广告主后的立方上计算"""
+        return pivot_by_date(self._cube(advertisers), keys, aggregations, dates)
+    
+    def affiliate_metrics(self, offers, dates):
+        """指定Offer在dates中按 (Offer ID, Affiliate, Date) 汇总收入/点击/转化"""
+        cube = self.join_advertisers()
+        return cube[cube['Offer ID'].isin(offers) & cube['Date'].isin(dates)].groupby(
+            ['Offer ID', 'Affiliate', 'Date'], observed=True
+        ).agg({
+            'Total Revenue': 'sum',
+            'Total Clicks': 'sum',
+            'Total Conversions': 'sum'
+        }).reset_index()
+    
+    def main_advertiser(self, date):
+        """当天每个Affiliate出现最多（按原始行数）的二级广告主"""
+        cube = self.join_advertisers()
+        return group_mode(cube[cube['Date'] == date], 'Affiliate', '二级广告主', weights='Row Count')
+    
+    def reject_pivot(self, dates):
+        """
+        二级广告主 × New Date 的reject数
+        事件日期按REJECT_DAY_SHIFTS平移（appnext减一天）；是否为reject按2-reject规则判断
+        先按 (Advertiser, New Date) 求和再关联二级广告主，关联的行数只与广告主和日期个数有关
+        """
+        events = reject_event_rows(self.reject_cube, self.sheet2_reject_rule)
+        events = events[events['New Date'].isin(dates)]
+        per_advertiser = events.groupby(
+            ['Advertiser', 'New Date'], sort=False, observed=True, dropna=False
+        )['Reject Count'].sum().reset_index()
+        reject_events = pd.merge(
+            per_advertiser, self.sheet3_advertiser[['Advertiser', '二级广告主']],
+            on='Advertiser', how='left'
+        )
+        return pivot_by_date(
+            reject_events, ['二级广告主'], {'Total reject': ('Reject Count', 'sum')},
+            dates, date_col='New Date'
+        )
+
+
+def make_report_frames(aggregates, engine='pandas'):
+    """按执行引擎创建立方访问对象（用完后调用close()）"""
+    _check_engine(engine)
+    if engine == 'duckdb':
+        from adv_report_duckdb import DuckDBReportFrames
+        return DuckDBReportFrames(aggregates)
+    if engine == 'polars':
+        from adv_report_polars import PolarsReportFrames
+        return PolarsReportFrames(aggregates)
+    return PandasReportFrames(aggregates)
+
+
+def pivot_by_date(frame, keys, aggregations, dates, date_col='Date'):
+    """
+    按 keys × 日期 一次分组并展开为宽表（不按日期逐个筛选/分组）
+    aggregations: {输出名: (列名, 聚合函数)}
+    返回列为 MultiIndex (输出名, 日期) 的DataFrame，无数据的日期填0
+    """
+    dates = list(dates)
+    rows = frame[frame[date_col].isin(dates)]
+    daily = rows.groupby(keys + [date_col], observed=True).agg(**aggregations)
+    wide = daily.unstack(date_col, fill_value=0)
+    return wide.reindex(columns=pd.MultiIndex.from_product([list(aggregations), dates]), fill_value=0)
+
+
+# 历史趋势：滚动基线与周环比均按7天计算
+WEEK_DAYS = 7
+
+
+def build_rolling_history(daily, key_name, window_dates, history_days, first_date):
+    """
+    由pivot_by_date得到的宽表生成最近history_days天的历史趋势（长表，每个键每天一行）
+    - window_dates：按天连续升序的日期，比历史天数多出WEEK_DAYS天用于回看
+    - first_date：数据中最早的日期，更早的日期视为无数据（NaN），不计入基线
+    - 每个指标输出当天值、"7日均值"（前7天中有数据日期的均值）与"周环比"（较7天前的差值）
+    全部指标在 (键, 指标, 日期) 三维数组上一次计算
+    """
+    metrics = list(daily.columns.get_level_values(0).unique())
+    n_keys, n_metrics, n_window = len(daily), len(metrics), len(window_dates)
+    values = daily.reindex(
+        columns=pd.MultiIndex.from_product([metrics, window_dates]), fill_value=0
+    ).to_numpy(dtype=float).reshape(n_keys, n_metrics, n_window)
+
+    observed = np.array([day >= first_date for day in window_dates], dtype=bool)
+    values[:, :, ~observed] = np.nan
+
+    # 前缀和：sums[..., j] / counts[j] 为第j天之前（不含当天）的累计值与有数据的天数
+    sums = np.zeros((n_keys, n_metrics, n_window + 1))
+    sums[:, :, 1:] = np.cumsum(np.where(observed, values, 0.0), axis=2)
+    counts = np.concatenate([[0], np.cumsum(observed)])
+
+    positions = np.arange(n_window - history_days, n_window)
+    positions = positions[observed[positions]]
+    lagged = positions - WEEK_DAYS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        baseline = (sums[:, :, positions] - sums[:, :, lagged]) / (counts[positions] - counts[lagged])
+    week_delta = values[:, :, positions] - values[:, :, lagged]
+    current = values[:, :, positions]
+
+    history = pd.DataFrame({
+        key_name: np.repeat(np.asarray(daily.index, dtype=object), len(positions)),
+        'Date': np.tile(np.asarray(window_dates, dtype=DAY_DTYPE)[positions], n_keys),
+    })
+    for idx, metric in enumerate(metrics):
+        history[metric] = current[:, idx, :].ravel().round(2)
+        history[f"{metric} 7日均值"] = baseline[:, idx, :].ravel().round(2)
+        history[f"{metric} 周环比"] = week_delta[:, idx, :].ravel().round(2)
+    return history
+
+
+def _format_numbers(values, digits):
+    """批量格式化为定点小数字符串，结果与f"{x:.{digits}f}"一致"""
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return np.empty(0, dtype=object)
+    return np.char.mod(f"%.{digits}f", values).astype(object)
+
+
+def _join_text_by_group(df, key, column, sep='\n'):
+    """
+    按key分组、组内保持原行序用sep拼接column的文本，结果与
+    df.groupby(key, observed=True)[column].apply(sep.join).reset_index()一致（key为NaN的行丢弃）
+    一次稳定排序后用np.add.reduceat完成全部分组的拼接，不逐组调用Python函数
+    """
+    codes, _ = pd.factorize(df[key], sort=True)
+    rows = np.flatnonzero(codes >= 0)
+    order = rows[np.argsort(codes[rows], kind='stable')]
+    if order.size == 0:
+        return pd.DataFrame({key: df[key].iloc[:0].reset_index(drop=True), column: np.empty(0, dtype=object)})
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    is_last = np.r_[sorted_codes[1:] != sorted_codes[:-1], True]
+    texts = df[column].to_numpy(dtype=object)[order]
+    parts = np.where(is_last, texts, texts + sep)
+    keys = df[key].iloc[order[starts]].reset_index(drop=True)
+    if not isinstance(keys.dtype, pd.CategoricalDtype):
+        # 与groupby一致：非分类的分组键按取值重新推断类型
+        keys = pd.Series(keys.tolist(), name=key)
+    return pd.DataFrame({key: keys, column: np.add.reduceat(parts, starts)})
+
+
+# 默认分析阈值
+HIGH_DIFF_THRESHOLD = 10        # 高差异Offer：流水差绝对值（美金）
+AFFILIATE_DIFF_THRESHOLD = 5    # Affiliate分析：收入变化绝对值（美金）
+BUDGET_LOOKBACK_DAYS = 6        # 预算判断：回看天数
+HISTORY_DAYS = 7                # 历史趋势：输出最近N天
+
+
+def _reject_rate(df, date_str):
+    """
+    计算reject率：reject / (conversions + reject)
+    分母为0时返回0，避免除以0错误
+    """
+    conversions = df[f"{date_str} Total Conversions"].to_numpy(dtype=float)
+    reject = df[f"{date_str} Total reject"].to_numpy(dtype=float)
+    total = conversions + reject
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.Series(np.where(total == 0, 0.0, (reject / total) * 100), index=df.index)
+
+
+def process_daily_report_web(uploaded_file, progress_bar=None, status_text=None, workbook=None,
+                             high_diff_threshold=HIGH_DIFF_THRESHOLD,
+                             affiliate_diff_threshold=AFFILIATE_DIFF_THRESHOLD,
+                             budget_lookback_days=BUDGET_LOOKBACK_DAYS,
+                             history_days=HISTORY_DAYS, aggregates=None, engine='pandas',
+                             max_workers=None, profiler=None):
+    """
+    网页版处理日报Excel数据的主函数
+    已通过load_report_workbook读取的数据可经workbook参数传入，避免重复解析
+    已汇总的数据（如增量模式的本地聚合存储）可经aggregates参数传入，此时不读取文件
+    history_days：二级广告主历史趋势表（results['history']）覆盖的天数
+    engine：执行引擎，见ENGINES（决定原始行汇总，以及立方上的筛选/关联/透视由哪个实现执行）
+    max_workers：并行计算的阶段数（默认STAGE_WORKERS，1为依次执行）
+    profiler：StageProfiler（默认新建），调用方可先用它记录函数之外的步骤；
+    各阶段的耗时/CPU/内存/行数见results['profile']
+    """
+    profiler = profiler or StageProfiler()
+    
+    # 更新进度
+    if progress_bar and status_text:
+        progress_bar.progress(5)
+        status_text.text("📁 正在读取Excel文件...")
+    
+    # ====================== 1、导入Excel数据 ======================
+    if aggregates is None:
+        try:
+            if workbook is None:
+                with profiler.measure('load') as record:
+                    workbook = load_report_workbook_cached(uploaded_file)
+                    record['output_rows'] = len(workbook.sheet1_all_data)
+            
+            if progress_bar and status_text:
+                progress_bar.progress(15)
+                status_text.text("✅ 成功读取Excel文件，开始数据处理...")
+                
+        except Exception as e:
+            raise Exception(f"读取文件失败：{str(e)}")
+    
+    # ====================== 关键优化：自动识别最新两天日期 ======================
+    if progress_bar and status_text:
+        progress_bar.progress(20)
+        status_text.text("📅 自动识别最新两天日期...")
+    
+    # 原始数据唯一一次分组汇总，后续全部基于日数据立方
+    if aggregates is None:
+        raw_rows = len(workbook.sheet1_all_data) + len(workbook.sheet4_reject)
+        with profiler.measure('aggregate', raw_rows) as record:
+            aggregates = build_daily_aggregates(workbook, engine=engine)
+            record['output_rows'] = len(aggregates.daily_cube) + len(aggregates.reject_cube)
+    cube_rows = len(aggregates.daily_cube)
+    
+    # 立方访问对象可能持有引擎资源（如DuckDB连接），各阶段完成或出错后释放
+    frames = None
+    try:
+        # 获取所有唯一日期并排序
+        with profiler.measure('dates', cube_rows) as record:
+            frames = make_report_frames(aggregates, engine=engine)
+            all_dates = frames.dates()
+            record['output_rows'] = len(all_dates)
+    
+        if len(all_dates) < 2:
+            raise Exception(f"错误：数据中仅包含 {len(all_dates)} 天数据，至少需要2天！")
+    
+        # 定义最新两天（核心日期变量）
+        newest_date = all_dates[0]       # 最新一天
+        second_newest_date = all_dates[1] # 次新一天
+    
+        # 生成日期显示名称
+        newest_date_str = f"{newest_date.year}/{newest_date.month}/{newest_date.day}"
+        second_newest_date_str = f"{second_newest_date.year}/{second_newest_date.month}/{second_newest_date.day}"
+        newest_date_file_str = f"{newest_date.year}{newest_date.month:02d}{newest_date.day:02d}"
+    
+        date_mapping = {
+            'newest': {
+                'date': newest_date,
+                'str': newest_date_str,
+                'file_str': newest_date_file_str,
+                'col_name': f"{newest_date_str} Total Revenue",
+                'reject_rate_col': f"{newest_date_str} reject率(%)"
+            },
+            'second': {
+                'date': second_newest_date,
+                'str': second_newest_date_str,
+                'col_name': f"{second_newest_date_str} Total Revenue",
+                'reject_rate_col': f"{second_newest_date_str} reject率(%)"
+            }
+        }
+    
+        # ====================== 2、基础数据预处理：新旧预算 ======================
+        def judge_budget(_advertiser_cube):
+            # Offer × 日期一次透视：最新/次新收入与预算回看共用
+            # 与逐行计算一致，Offer收入在关联广告主之后求和（映射重复的Advertiser其行随之重复计入）；
+            # 关联只会复制行，不影响回看期内的Max Revenue
+            six_days_ago = newest_date - timedelta(days=budget_lookback_days)
+            lookback_dates = [day for day in all_dates if day != newest_date and day >= six_days_ago]
+            offer_daily = frames.pivot(
+                ['Offer ID'],
+                {'Total Revenue': ('Total Revenue', 'sum'), 'Max Revenue': ('Max Revenue', 'max')},
+                sorted(set(lookback_dates) | {newest_date, second_newest_date}),
+                advertisers=True
+            )
+        
+            # 精准判断新旧预算：回看期内存在收入>0的行即为旧预算
+            past_max_revenue = offer_daily['Max Revenue'][lookback_dates]
+            old_budget_offers = set(past_max_revenue.index[(past_max_revenue > 0).any(axis=1)])
+            all_offers = set(frames.unique('Offer ID'))
+            return offer_daily, old_budget_offers, all_offers
+    
+        # ====================== 3、匹配广告主信息 ======================
+        def join_advertisers():
+            # 立方关联二级/三级广告主（之后advertisers=True的透视/分组都在关联后的立方上计算）
+            return frames.join_advertisers()
+    
+        # ====================== 4、核心计算：Offer级别的基础数据 ======================
+        def build_offer_base(budget):
+            offer_daily, old_budget_offers, _ = budget
+        
+            # 提取每个Offer ID的最新Status（最新一天首次出现的行）
+            offer_status_mapping = frames.first_rows('Offer ID', ['Offer ID', 'Status'], date=newest_date).fillna('Unknown')
+        
+            # 提取App ID映射（每个Offer首次出现的行，表格二的GEO/Advertiser也取自这里）
+            offer_first_rows = frames.first_rows('Offer ID', ['Offer ID', 'App ID', 'GEO', 'Advertiser'])
+            offer_app_mapping = offer_first_rows[['Offer ID', 'App ID']].fillna('')
+        
+            # 每个Offer ID在最新/次新一天的总收入
+            offer_revenue = offer_daily['Total Revenue']
+            offer_newest_revenue = pd.DataFrame({
+                'Offer ID': np.asarray(offer_revenue.index, dtype=object),
+                date_mapping['newest']['col_name']: offer_revenue[newest_date].to_numpy(),
+            })
+            offer_second_revenue = pd.DataFrame({
+                'Offer ID': np.asarray(offer_revenue.index, dtype=object),
+                date_mapping['second']['col_name']: offer_revenue[second_newest_date].to_numpy(),
+            })
+        
+            # 合并Offer基础数据
+            offer_base_data = offer_app_mapping.copy()
+            offer_base_data = pd.merge(offer_base_data, offer_status_mapping, on='Offer ID', how='left')
+            offer_base_data = pd.merge(offer_base_data, offer_newest_revenue, on='Offer ID', how='left').fillna(0)
+            offer_base_data = pd.merge(offer_base_data, offer_second_revenue, on='Offer ID', how='left').fillna(0)
+        
+            # 计算Offer级流水差
+            offer_base_data['流水差（最新-次新）'] = (
+                offer_base_data[date_mapping['newest']['col_name']] - 
+                offer_base_data[date_mapping['second']['col_name']]
+            )
+        
+            def calculate_offer_change_pct(df):
+                prev_revenue = df[date_mapping['second']['col_name']].to_numpy(dtype=float)
+                curr_revenue = df[date_mapping['newest']['col_name']].to_numpy(dtype=float)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    change_pct = ((curr_revenue - prev_revenue) / np.abs(prev_revenue)) * 100
+                return np.where(
+                    prev_revenue == 0,
+                    np.where(curr_revenue > 0, 1000.0, 0.0),
+                    change_pct
+                )
+        
+            offer_base_data['变化幅度(%)'] = calculate_offer_change_pct(offer_base_data)
+            offer_base_data['预算类型'] = np.where(
+                offer_base_data['Offer ID'].isin(list(old_budget_offers)), '旧预算', '新预算'
+            )
+        
+            # 高差异Offer筛选：金额按输出精度（两位小数）与阈值比较，恰好等于阈值的差额不受浮点求和误差影响
+            high_diff_mask = (offer_base_data['流水差（最新-次新）'].round(2).abs() >= high_diff_threshold)
+            high_diff_offers = offer_base_data[high_diff_mask]['Offer ID'].tolist()
+            return offer_base_data, offer_first_rows, high_diff_offers
+    
+        # ====================== 5、Affiliate维度精准分析 ======================
+        def analyze_affiliates(offer_base, _advertiser_cube):
+            _, _, high_diff_offers = offer_base
+            offer_influence = pd.DataFrame(columns=['Offer ID', 'influence affiliate'])
+            if not high_diff_offers:
+                return offer_influence
+        
+            # 按Offer ID + Affiliate + Date分组计算
+            affiliate_daily_metrics = frames.affiliate_metrics(high_diff_offers, [newest_date, second_newest_date])
+        
+            # 分别提取最新/次新一天数据
+            aff_newest = affiliate_daily_metrics[affiliate_daily_metrics['Date'] == newest_date].copy()
+            aff_newest.columns = ['Offer ID', 'Affiliate', 'Date', 'Revenue_newest', 'Clicks_newest', 'Conversions_newest']
+        
+            aff_second = affiliate_daily_metrics[affiliate_daily_metrics['Date'] == second_newest_date].copy()
+            aff_second.columns = ['Offer ID', 'Affiliate', 'Date', 'Revenue_second', 'Clicks_second', 'Conversions_second']
+        
+            # 合并两天数据
+            aff_merged = pd.merge(
+                aff_newest, aff_second, 
+                on=['Offer ID', 'Affiliate'], 
+                how='outer'
+            ).fillna(0)
+        
+            # 计算差异指标
+            aff_merged['Revenue_Diff'] = aff_merged['Revenue_newest'] - aff_merged['Revenue_second']
+            aff_merged['Clicks_Diff'] = aff_merged['Clicks_newest'] - aff_merged['Clicks_second']
+            aff_merged['Clicks_Change_Pct'] = np.where(
+                aff_merged['Clicks_second'] > 0,
+                (aff_merged['Clicks_Diff'] / aff_merged['Clicks_second']) * 100,
+                np.where(aff_merged['Clicks_newest'] > 0, 1000.0, 0.0)
+            )
+        
+            # CR计算
+            aff_merged['CR_newest'] = np.where(
+                aff_merged['Clicks_newest'] > 0,
+                (aff_merged['Conversions_newest'] / aff_merged['Clicks_newest']) * 100,
+                0.0
+            )
+            aff_merged['CR_second'] = np.where(
+                aff_merged['Clicks_second'] > 0,
+                (aff_merged['Conversions_second'] / aff_merged['Clicks_second']) * 100,
+                0.0
+            )
+            aff_merged['CR_Change_Abs'] = aff_merged['CR_newest'] - aff_merged['CR_second']
+        
+            # 筛选有显著收入变化的Affiliate（同样按两位小数与阈值比较）
+            significant_aff = aff_merged[aff_merged['Revenue_Diff'].round(2).abs() >= affiliate_diff_threshold].copy()
+            significant_aff = significant_aff.sort_values(by='Revenue_Diff', ascending=False)
+        
+            def generate_influence_text(df):
+                affiliate = df['Affiliate'].astype(str).to_numpy(dtype=object)
+                revenue_newest = df['Revenue_newest'].to_numpy(dtype=float)
+                revenue_second = df['Revenue_second'].to_numpy(dtype=float)
+                revenue_diff = df['Revenue_Diff'].to_numpy(dtype=float)
+                clicks_change = df['Clicks_Change_Pct'].to_numpy(dtype=float)
+                cr_change = df['CR_Change_Abs'].to_numpy(dtype=float)
+            
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    revenue_change_pct = np.where(
+                        revenue_second != 0,
+                        (revenue_diff / np.abs(revenue_second)) * 100,
+                        np.where(revenue_diff > 0, 1000.0, -1000.0)
+                    )
+            
+                new_text = affiliate + ' 新增产生流水 ' + _format_numbers(revenue_newest, 2) + ' 美金'
+                stopped_text = affiliate + ' 停止产生流水，减少 ' + _format_numbers(revenue_second, 2) + ' 美金'
+                change_text = (
+                    affiliate + np.where(revenue_diff > 0, ' 增加 ', ' 减少 ')
+                    + _format_numbers(np.abs(revenue_diff), 2) + ' 美金/'
+                    + _format_numbers(np.abs(revenue_change_pct), 1) + '%'
+                    + '，对应Total Clicks' + np.where(clicks_change > 0, '增加', '减少')
+                    + _format_numbers(np.abs(clicks_change), 1) + '%'
+                    + ', CR' + np.where(cr_change > 0, '增加', '减少')
+                    + _format_numbers(np.abs(cr_change), 1) + '%'
+                )
+            
+                return np.select(
+                    [
+                        (revenue_newest > 0) & (revenue_second == 0),
+                        (revenue_newest == 0) & (revenue_second > 0),
+                    ],
+                    [new_text, stopped_text],
+                    default=change_text
+                )
+        
+            significant_aff['influence_text'] = generate_influence_text(significant_aff)
+            offer_influence = _join_text_by_group(significant_aff, 'Offer ID', 'influence_text')
+            offer_influence.columns = ['Offer ID', 'influence affiliate']
+            return offer_influence
+    
+        # ====================== 6、生成四个核心表格 ======================
+        # 表格一：三级广告主日报表
+        def build_table1(_advertiser_cube):
+            table1_data = frames.pivot(['三级广告主'], {
+                'Total Revenue': ('Total Revenue', 'sum'),
+                'Total Profit': ('Total Profit', 'sum'),
+            }, [newest_date, second_newest_date], advertisers=True)
+        
+            table1 = pd.DataFrame()
+            table1['三级广告主'] = np.asarray(table1_data.index, dtype=object)
+        
+            for date_type in ['newest', 'second']:
+                current_date = date_mapping[date_type]['date']
+                current_date_str = date_mapping[date_type]['str']
+                table1[f"{current_date_str} Total Revenue"] = table1_data[('Total Revenue', current_date)].to_numpy()
+                table1[f"{current_date_str} Total Profit"] = table1_data[('Total Profit', current_date)].to_numpy()
+        
+            return table1[
+                ['三级广告主', 
+                 f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
+                 f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit"]
+            ].copy().round(2)
+    
+        # 表格二：高差异Offer ID详情
+        def build_table2(offer_base, offer_influence):
+            offer_base_data, offer_first_rows, high_diff_offers = offer_base
+            if not high_diff_offers:
+                return pd.DataFrame(columns=[
+                    'Offer ID', 'App ID', 'Status', 'GEO', 'Advertiser',
+                    date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
+                    '流水差（最新-次新）', '变化幅度(%)', '预算类型', 'influence affiliate'
+                ])
+        
+            offer_details = offer_first_rows.loc[
+                offer_first_rows['Offer ID'].isin(high_diff_offers), ['Offer ID', 'GEO', 'Advertiser']
+            ].reset_index(drop=True)
+        
+            table2 = pd.merge(offer_details, offer_base_data[
+                ['Offer ID', 'App ID', 'Status', date_mapping['newest']['col_name'], 
+                 date_mapping['second']['col_name'], '流水差（最新-次新）', '变化幅度(%)', '预算类型']
+            ], on='Offer ID', how='left')
+        
+            table2 = pd.merge(table2, offer_influence, on='Offer ID', how='left')
+            table2['influence affiliate'] = table2['influence affiliate'].fillna('无显著变化')
+        
+            table2 = table2[
+                ['Offer ID', 'App ID', 'Status', 'GEO', 'Advertiser',
+                 date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
+                 '流水差（最新-次新）', '变化幅度(%)', '预算类型', 'influence affiliate']
+            ].copy()
+        
+            numeric_cols_table2 = [
+                date_mapping['newest']['col_name'], date_mapping['second']['col_name'],
+                '流水差（最新-次新）', '变化幅度(%)'
+            ]
+            table2[numeric_cols_table2] = table2[numeric_cols_table2].round(2)
+            return table2
+    
+        # ---------------------- 表格三：二级广告主综合报表（新增reject率）及历史趋势 ----------------------
+        def build_table3(_advertiser_cube):
+            table3 = pd.DataFrame()
+            table3['二级广告主'] = frames.unique('二级广告主', advertisers=True)
+        
+            # 历史趋势窗口：最近history_days天，再向前多取WEEK_DAYS天用于7日均值与周环比
+            window_dates = [newest_date - timedelta(days=offset)
+                            for offset in range(history_days + WEEK_DAYS - 1, -1, -1)]
+            advertiser_dates = sorted(set(window_dates) | {second_newest_date})
+        
+            # 二级广告主 × 日期一次透视，表格三与历史趋势共用
+            advertiser_daily = frames.pivot(['二级广告主'], {
+                'Total Revenue': ('Total Revenue', 'sum'),
+                'Total Profit': ('Total Profit', 'sum'),
+                'Total Conversions': ('Total Conversions', 'sum'),
+            }, advertiser_dates, advertisers=True)
+        
+            # 处理4--reject事件数据（已按 (Date, Advertiser, Event) 计数）
+            reject_daily = frames.reject_pivot(advertiser_dates)
+            # 只保留出现在1--all data中的二级广告主（与表格三一致）
+            advertiser_daily = advertiser_daily.join(reject_daily, how='left').fillna(0)
+        
+            # 填充收入/利润/转化/Reject数据
+            for date_type in ['newest', 'second']:
+                current_date = date_mapping[date_type]['date']
+                current_date_str = date_mapping[date_type]['str']
+                for metric in ['Total Revenue', 'Total Profit', 'Total Conversions', 'Total reject']:
+                    table3[f"{current_date_str} {metric}"] = (
+                        advertiser_daily[(metric, current_date)].reindex(table3['二级广告主'].to_numpy()).fillna(0).to_numpy()
+                    )
+        
+            # 二级广告主历史趋势（按表格三的出现顺序）
+            history_keys = table3['二级广告主'][table3['二级广告主'].notna()].to_numpy()
+            history = build_rolling_history(
+                advertiser_daily.reindex(history_keys).fillna(0), '二级广告主',
+                window_dates, history_days, first_date=all_dates[-1]
+            )
+        
+            # ========== 核心新增：计算二级广告主reject率 ==========
+            table3[date_mapping['newest']['reject_rate_col']] = _reject_rate(table3, newest_date_str).round(2)
+        
+            table3[date_mapping['second']['reject_rate_col']] = _reject_rate(table3, second_newest_date_str).round(2)
+        
+            # 调整列顺序并格式化
+            table3 = table3[
+                ['二级广告主', 
+                 f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
+                 f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
+                 f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject", date_mapping['newest']['reject_rate_col'],
+                 f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject", date_mapping['second']['reject_rate_col']]
+            ].copy()
+        
+            numeric_cols_table3 = [f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
+                                  f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
+                                  date_mapping['newest']['reject_rate_col'], date_mapping['second']['reject_rate_col']]
+            table3[numeric_cols_table3] = table3[numeric_cols_table3].round(2)
+        
+            int_cols_table3 = [f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject",
+                              f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject"]
+            table3[int_cols_table3] = table3[int_cols_table3].astype(int)
+            return table3, history
+    
+        # ---------------------- 表格四：Affiliate综合报表（新增reject率，依赖表格三的reject列） ----------------------
+        def build_table4(_advertiser_cube, table3_outputs):
+            table3, _ = table3_outputs
+            table4 = pd.DataFrame()
+            # 分类编码列还原为普通值输出
+            table4['Affiliate'] = frames.unique('Affiliate', advertisers=True)
+        
+            # Affiliate × 最新/次新一天一次透视
+            affiliate_daily = frames.pivot(['Affiliate'], {
+                'Total Revenue': ('Total Revenue', 'sum'),
+                'Total Profit': ('Total Profit', 'sum'),
+                'Total Conversions': ('Total Conversions', 'sum'),
+            }, [newest_date, second_newest_date], advertisers=True)
+        
+            # 动态填充两天的收入/利润/转化数据
+            for date_type in ['newest', 'second']:
+                current_date = date_mapping[date_type]['date']
+                current_date_str = date_mapping[date_type]['str']
+            
+                for metric in ['Total Revenue', 'Total Profit', 'Total Conversions']:
+                    table4[f"{current_date_str} {metric}"] = (
+                        affiliate_daily[(metric, current_date)].reindex(table4['Affiliate'].to_numpy()).fillna(0).to_numpy()
+                    )
+                # 每个Affiliate当天出现最多的二级广告主
+                daily_main_advertiser = frames.main_advertiser(current_date)
+                table4[f"{current_date_str} 二级广告主"] = table4['Affiliate'].map(daily_main_advertiser).fillna('')
+        
+            # 合并二级广告主信息
+            # 次新一天在前、最新一天在后，相同时只保留一个；空值和'0'忽略
+            def merge_advertisers(df):
+                adv1 = df[f"{second_newest_date_str} 二级广告主"].astype(str).to_numpy(dtype=object)
+                adv2 = df[f"{newest_date_str} 二级广告主"].astype(str).to_numpy(dtype=object)
+                valid1 = (adv1 != '') & (adv1 != '0')
+                valid2 = (adv2 != '') & (adv2 != '0') & (adv2 != adv1)
+                return np.select(
+                    [valid1 & valid2, valid1, valid2],
+                    [adv1 + '; ' + adv2, adv1, adv2],
+                    default=''
+                )
+        
+            table4['二级广告主'] = merge_advertisers(table4)
+        
+            # 填充Reject数据：Affiliate→二级广告主展开为一一对应，与二级广告主reject表一次性关联后按Affiliate汇总
+            reject_cols = [f"{newest_date_str} Total reject", f"{second_newest_date_str} Total reject"]
+            reject_by_advertiser = table3.groupby('二级广告主')[reject_cols].sum()
+        
+            affiliate_advertisers = table4['二级广告主'].str.split('; ').explode().str.strip()
+            affiliate_advertisers = affiliate_advertisers[affiliate_advertisers.notna() & (affiliate_advertisers != '')]
+        
+            affiliate_reject = reject_by_advertiser.reindex(affiliate_advertisers.to_numpy()).fillna(0)
+            affiliate_reject.index = affiliate_advertisers.index
+            affiliate_reject = affiliate_reject.groupby(level=0).sum().reindex(table4.index, fill_value=0)
+        
+            # 添加reject列
+            for reject_col in reject_cols:
+                table4[reject_col] = affiliate_reject[reject_col].astype(int)
+        
+            # ========== 核心新增：计算Affiliate reject率 ==========
+            table4[date_mapping['newest']['reject_rate_col']] = _reject_rate(table4, newest_date_str).round(2)
+        
+            table4[date_mapping['second']['reject_rate_col']] = _reject_rate(table4, second_newest_date_str).round(2)
+        
+            # 调整列顺序并格式化
+            table4 = table4[
+                ['Affiliate', 
+                 f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
+                 f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
+                 f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject", date_mapping['newest']['reject_rate_col'],
+                 f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject", date_mapping['second']['reject_rate_col'],
+                 '二级广告主']
+            ].copy()
+        
+            table4 = table4.fillna(0)
+            numeric_cols_table4 = [f"{newest_date_str} Total Revenue", f"{newest_date_str} Total Profit",
+                                  f"{second_newest_date_str} Total Revenue", f"{second_newest_date_str} Total Profit",
+                                  date_mapping['newest']['reject_rate_col'], date_mapping['second']['reject_rate_col']]
+            table4[numeric_cols_table4] = table4[numeric_cols_table4].round(2)
+        
+            int_cols_table4 = [f"{newest_date_str} Total Conversions", f"{newest_date_str} Total reject",
+                              f"{second_newest_date_str} Total Conversions", f"{second_newest_date_str} Total reject"]
+            table4[int_cols_table4] = table4[int_cols_table4].astype(int)
+            return table4.sort_values('Affiliate').reset_index(drop=True)
+    
+        # ====================== 按依赖图执行：表格一/二/三并行，表格四等待表格三 ======================
+        def report_progress(done, total, stage):
+            # 读取与汇总占前25%，各阶段按完成数推进到95%
+            if progress_bar and status_text:
+                progress_bar.progress(25 + int(70 * done / total))
+                status_text.text(f"✅ {stage.label}（{done}/{total}）")
+    
+        # 直接读取立方的阶段以立方行数为输入行数，其它阶段为依赖阶段的输出行数之和
+        scheduler = StageScheduler(max_workers=max_workers, on_progress=report_progress, profiler=profiler)
+        outputs = scheduler.run([
+            Stage('advertiser_join', join_advertisers, label='匹配广告主信息', input_rows=cube_rows),
+            Stage('budget', judge_budget, deps=('advertiser_join',), label='新旧预算判断'),
+            Stage('offer_base', build_offer_base, deps=('budget',), label='Offer级别数据'),
+            Stage('affiliate', analyze_affiliates, deps=('offer_base', 'advertiser_join'),
+                  label='Affiliate维度分析', input_rows=cube_rows),
+            Stage('table1', build_table1, deps=('advertiser_join',), label='表格一：三级广告主', input_rows=cube_rows),
+            Stage('table2', build_table2, deps=('offer_base', 'affiliate'), label='表格二：高差异Offer'),
+            Stage('table3', build_table3, deps=('advertiser_join',), label='表格三：二级广告主', input_rows=cube_rows),
+            Stage('table4', build_table4, deps=('advertiser_join', 'table3'), label='表格四：Affiliate',
+                  input_rows=cube_rows),
+        ])
+    finally:
+        if frames is not None:
+            frames.close()
+    _, old_budget_offers, all_offers = outputs['budget']
+    _, _, high_diff_offers = outputs['offer_base']
+    table3, history = outputs['table3']
+    
+    if progress_bar and status_text:
+        progress_bar.progress(95)
+        status_text.text("💾 准备下载文件...")
+    
+    # 返回所有结果
+    results = {
+        'table1': outputs['table1'],
+        'table2': outputs['table2'],
+        'table3': table3,
+        'table4': outputs['table4'],
+        'history': history,
+        'newest_date_str': newest_date_str,
+        'newest_date_file_str': newest_date_file_str,
+        'stats': {
+            '高差异Offer数量': len(high_diff_offers),
+            '旧预算Offer数量': len(old_budget_offers),
+            '新预算Offer数量': len(all_offers - old_budget_offers)
+        },
+        'profile': profiler.to_dict(),
+    }
+    
+    if progress_bar and status_text:
+        progress_bar.progress(100)
+        status_text.text("🎉 分析完成！")
+    
+    return results
+
+
+# 引擎一致性按输出精度比较：各引擎浮点求和的累加顺序不同，结果可能在舍入边界上相差一个最小单位
+# - 浮点列：表格金额与比率保留两位小数，允许相差PARITY_TOLERANCE
+# - 多行文本（如influence affiliate）：各行作为集合比较（金额在显示精度上相同的行顺序可能不同），
+#   行内的小数按各自显示的位数允许相差一个最小单位；整数与其它文本逐字比较
+PARITY_TOLERANCE = 0.01
+_DECIMAL_PATTERN = re.compile(r'\d+\.(\d+)')
+
+
+def _text_close(expected, actual):
+    """文本在显示精度上一致：小数以外的部分相同，小数相差不超过其末位的一个单位"""
+    if not (isinstance(expected, str) and isinstance(actual, str)):
+        return expected == actual or (pd.isna(expected) and pd.isna(actual))
+    if expected == actual:
+        return True
+    expected_lines, actual_lines = sorted(expected.split('\n')), sorted(actual.split('\n'))
+    if len(expected_lines) != len(actual_lines):
+        return False
+    for expected_line, actual_line in zip(expected_lines, actual_lines):
+        expected_numbers = list(_DECIMAL_PATTERN.finditer(expected_line))
+        actual_numbers = list(_DECIMAL_PATTERN.finditer(actual_line))
+        if (_DECIMAL_PATTERN.sub('#', expected_line) != _DECIMAL_PATTERN.sub('#', actual_line)
+                or len(expected_numbers) != len(actual_numbers)):
+            return False
+        for e, a in zip(expected_numbers, actual_numbers):
+            unit = 10.0 ** -max(len(e.group(1)), len(a.group(1)))
+            if abs(float(e.group(0)) - float(a.group(0))) > unit * (1 + 1e-9):
+                return False
+    return True
+
+
+def compare_report_frames(expected, actual, tolerance=PARITY_TOLERANCE):
+    """两张报告表格按输出精度比较，返回差异说明（一致时为None）"""
+    if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+        return f"列或行数不同：{list(expected.columns)} × {len(expected)} != {list(actual.columns)} × {len(actual)}"
+    for col in expected.columns:
+        left, right = expected[col], actual[col]
+        if pd.api.types.is_numeric_dtype(left) and pd.api.types.is_numeric_dtype(right):
+            left, right = left.to_numpy(dtype=float), right.to_numpy(dtype=float)
+            close = np.isclose(left, right, rtol=0, atol=tolerance * (1 + 1e-9), equal_nan=True)
+            if pd.api.types.is_integer_dtype(expected[col]) and pd.api.types.is_integer_dtype(actual[col]):
+                close = left == right
+        else:
+            close = np.array([_text_close(e, a) for e, a in zip(left.astype(object), right.astype(object))], dtype=bool)
+        if not close.all():
+            row = int(np.flatnonzero(~close)[0])
+            return f"列 {col} 有 {int((~close).sum())} 行不同，如第{row}行：{left[row]!r} != {right[row]!r}"
+    return None
+
+
+def compare_report_results(expected, actual, tolerance=PARITY_TOLERANCE):
+    """两次分析的结果（表格、统计数据、最新日期）按输出精度比较，返回差异说明列表"""
+    problems = []
+    for key in list(REPORT_SHEETS) + ['stats', 'newest_date_str']:
+        if isinstance(expected[key], pd.DataFrame):
+            problem = compare_report_frames(expected[key], actual[key], tolerance)
+        else:
+            problem = None if expected[key] == actual[key] else f"{expected[key]!r} != {actual[key]!r}"
+        if problem:
+            problems.append(f"{key}: {problem}")
+    return problems
+
+
+def check_engine_parity(workbook, engines=ENGINES, **options):
+    """
+    用各执行引擎分别分析同一工作簿，与第一个引擎的结果按输出精度逐表比较（见compare_report_results）
+    options为process_daily_report_web的其它参数（如阈值）
+    返回差异说明列表，为空表示全部一致
+    """
+    baseline_engine, *other_engines = engines
+    baseline = process_daily_report_web(None, workbook=workbook, engine=baseline_engine, **options)
+    problems = []
+    for engine in other_engines:
+        results = process_daily_report_web(None, workbook=workbook, engine=engine, **options)
+        problems += [f"[{engine}] {problem}" for problem in compare_report_results(baseline, results)]
+    return problems
+
+
+# ==================== 报告导出 ====================
+REPORT_SHEETS = {
+    'table1': '表格一_三级广告主日报表',
+    'table2': '表格二_高差异Offer ID详情',
+    'table3': '表格三_二级广告主综合报表',
+    'table4': '表格四_Affiliate综合报表',
+    'history': '表格五_二级广告主历史趋势',
+}
+
+
+def report_filename(results):
+    """分析报告的默认文件名"""
+    return f"{results['newest_date_file_str']}日报分析结论.xlsx"
+
+
+# 逐块转换为Python值写入，避免一次性复制整张表
+EXPORT_CHUNK_ROWS = 20000
+
+
+def _header_cell(worksheet, value):
+    """表头单元格：与pandas.to_excel默认表头样式一致（加粗、细边框、居中）"""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    cell = WriteOnlyCell(worksheet, value=value)
+    side = Side(style='thin')
+    cell.font = Font(bold=True)
+    cell.border = Border(left=side, right=side, top=side, bottom=side)
+    cell.alignment = Alignment(horizontal='center', vertical='top')
+    return cell
+
+
+def _iter_excel_rows(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """按块把DataFrame转换为Excel行（缺失值写为空单元格）"""
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def write_report_excel(results, target):
+    """
+    把REPORT_SHEETS中的表格写入Excel（target为文件路径或可写的文件对象）
+    使用openpyxl只写模式逐行输出，不在内存中构建单元格对象
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for key, sheet_name in REPORT_SHEETS.items():
+        worksheet = workbook.create_sheet(title=sheet_name)
+        table = results[key]
+        worksheet.append([_header_cell(worksheet, str(col)) for col in table.columns])
+        for row in _iter_excel_rows(table):
+            worksheet.append(row)
+    workbook.save(target)
+
+
+def build_report_excel_bytes(results):
+    """生成Excel报告的字节内容"""
+    output = BytesIO()
+    write_report_excel(results, output)
+    return output.getvalue()
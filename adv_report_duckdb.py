@@ -0,0 +1,381 @@
+"""
+DuckDB执行引擎（可选依赖：pip install duckdb）
+
+process_daily_report_web(..., engine='duckdb') 时：
+- 原始行上的两次汇总（日数据立方与reject事件计数）为SQL分组
+- 立方上的筛选、关联二级/三级广告主、透视、Affiliate分析与reject表格
+  也都是SQL查询，在进程内DuckDB中多线程、列式执行
+结果仍以pandas DataFrame返回，表格组装与pandas引擎共用
+标识列以int32编码（缺失为NULL）、日期以自1970-01-01起的天数参与关联和分组，
+这些键列是新建的编码数组，指标列原样传入；结果再按原字典还原，保持与pandas引擎相同的类型和值
+浮点指标用fsum求和，累加顺序与pandas不同，个别金额可能在两位小数的舍入边界上相差0.01
+（check_engine_parity按输出精度比较）
+
+连接由本模块新建时用完即关闭：汇总在函数返回前关闭，DuckDBReportFrames在close()时关闭
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from adv_report_core import (
+    ADVERTISER_LEVELS,
+    CUBE_ATTRIBUTES,
+    CUBE_KEYS,
+    CUBE_METRICS,
+    REJECT_CUBE_KEYS,
+    CodeLabels,
+    DailyAggregates,
+    compact_aggregates,
+    day_key,
+    reject_event_rows,
+)
+
+
+def connect(threads=None):
+    """新建进程内DuckDB连接（threads默认使用全部CPU）；调用方负责关闭"""
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("DuckDB引擎需要安装duckdb：pip install duckdb")
+    connection = duckdb.connect(database=':memory:')
+    if threads:
+        connection.execute(f"SET threads TO {int(threads)}")
+    return connection
+
+
+def _encode(series):
+    """标识列 → (int32编码, 还原函数)；缺失值编码为-1，分类列沿用原字典"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        dtype = series.dtype
+        return (series.cat.codes.to_numpy(dtype=np.int32),
+                lambda codes: pd.Categorical.from_codes(codes, dtype=dtype))
+    codes, uniques = pd.factorize(series)
+    uniques = np.asarray(uniques, dtype=object)
+
+    def decode(codes):
+        values = np.full(len(codes), np.nan, dtype=object)
+        observed = codes >= 0
+        values[observed] = uniques[codes[observed]]
+        return values
+    return codes.astype(np.int32), decode
+
+
+def _day_numbers(times):
+    """Time列 → 自1970-01-01起的天数（缺失为NaN），SQL中按整数分组"""
+    days = times.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    numbers = days.astype(np.int64).astype(float)
+    numbers[np.isnat(days)] = np.nan
+    return numbers
+
+
+def _decode_days(numbers):
+    """天数 → 日期键（adv_report_core.day_key，缺失为NaT）"""
+    return day_key(pd.to_datetime(pd.Series(numbers, dtype=float), unit='D'))
+
+
+def _sum_expression(column, dtype):
+    """浮点列用fsum（补偿求和，与pandas分组求和一致），整数列保持BIGINT"""
+    if dtype.kind in 'iu':
+        return f'CAST(SUM("{column}") AS BIGINT)'
+    return f'COALESCE(fsum("{column}"), 0)'
+
+
+def _build_daily_cube(connection, sheet1_all_data):
+    keys = CUBE_KEYS[1:]
+    encoded = {key: _encode(sheet1_all_data[key]) for key in keys}
+    rows = pd.DataFrame({key: codes for key, (codes, _) in encoded.items()})
+    rows['Day'] = _day_numbers(sheet1_all_data['Time'])
+    for metric in CUBE_METRICS:
+        rows[metric] = sheet1_all_data[metric].to_numpy()
+    rows['Row'] = np.arange(len(rows), dtype=np.int64)
+    connection.register('cube_rows', rows)
+
+    group_columns = ', '.join(f'"{col}"' for col in ['Day'] + keys)
+    metric_columns = ', '.join(
+        f'{_sum_expression(metric, rows[metric].dtype)} AS "{metric}"' for metric in CUBE_METRICS
+    )
+    cube = connection.execute(f"""
+        SELECT {group_columns}, {metric_columns},
+               MAX("Total Revenue") AS "Max Revenue",
+               COUNT(*) AS "Row Count",
+               MIN("Row") AS "First Row"
+        FROM cube_rows
+        GROUP BY {group_columns}
+        ORDER BY "First Row"
+    """).df()
+    connection.unregister('cube_rows')
+
+    result = pd.DataFrame({'Date': _decode_days(cube['Day'].to_numpy(dtype=float))})
+    for key, (_, decode) in encoded.items():
+        result[key] = decode(cube[key].to_numpy(dtype=np.int32))
+    for col in CUBE_METRICS + ['Max Revenue', 'Row Count', 'First Row']:
+        result[col] = cube[col].to_numpy()
+    positions = result['First Row'].to_numpy()
+    for col in CUBE_ATTRIBUTES:
+        result[col] = sheet1_all_data[col].to_numpy()[positions]
+    return result
+
+
+def _build_reject_cube(connection, sheet4_reject):
+    keys = REJECT_CUBE_KEYS[1:]
+    encoded = {key: _encode(sheet4_reject[key]) for key in keys}
+    rows = pd.DataFrame({key: codes for key, (codes, _) in encoded.items()})
+    rows['Day'] = _day_numbers(sheet4_reject['Time'])
+    connection.register('reject_rows', rows)
+
+    group_columns = ', '.join(f'"{col}"' for col in ['Day'] + keys)
+    counts = connection.execute(f"""
+        SELECT {group_columns}, COUNT(*) AS "Event Count"
+        FROM reject_rows
+        GROUP BY {group_columns}
+    """).df()
+    connection.unregister('reject_rows')
+
+    result = pd.DataFrame({'Date': _decode_days(counts['Day'].to_numpy(dtype=float))})
+    for key, (_, decode) in encoded.items():
+        result[key] = decode(counts[key].to_numpy(dtype=np.int32))
+    result['Event Count'] = counts['Event Count'].to_numpy(dtype=np.int64)
+    return result
+
+
+def build_daily_aggregates_duckdb(workbook, connection=None):
+    """
+    与adv_report_core.build_daily_aggregates相同的结果，汇总在DuckDB中执行
+    未传入connection时新建连接，返回前关闭
+    """
+    if connection is None:
+        with connect() as connection:
+            return build_daily_aggregates_duckdb(workbook, connection)
+    return DailyAggregates(
+        daily_cube=_build_daily_cube(connection, workbook.sheet1_all_data),
+        reject_cube=_build_reject_cube(connection, workbook.sheet4_reject),
+        sheet3_advertiser=workbook.sheet3_advertiser,
+        sheet2_reject_rule=workbook.sheet2_reject_rule,
+    )
+
+
+def _code_array(codes):
+    """int32编码 → Arrow列（-1为NULL）"""
+    codes = np.asarray(codes, dtype=np.int32)
+    return pa.array(codes, mask=codes < 0)
+
+
+def _day_array(values):
+    """日期列 → 天数的Arrow列（缺失为NULL）"""
+    return pa.array(_day_numbers(pd.Series(values)), from_pandas=True).cast(pa.int32())
+
+
+def _day_values(days):
+    """日期键（pd.Timestamp）→ SQL中比较的天数"""
+    return [int(day) for day in pd.DatetimeIndex(days).values.astype('datetime64[D]').astype(np.int64)]
+
+
+def _in(column, values):
+    """column IN (values)；values为空时为FALSE（值均为整数编码或天数）"""
+    values = [int(value) for value in values]
+    if not values:
+        return 'FALSE'
+    return f'"{column}" IN ({", ".join(map(str, values))})'
+
+
+def _not_null(columns):
+    return ' AND '.join(f'"{col}" IS NOT NULL' for col in columns)
+
+
+def _select_codes(columns):
+    """输出列：标识编码的NULL转为-1，供CodeLabels.decode还原"""
+    return ', '.join(f'COALESCE("{col}", -1) AS "{col}"' for col in columns)
+
+
+# 关联二级/三级广告主，与pd.merge(how='left')一致：缺失值可匹配，多条匹配依次展开；
+# 展开顺序（立方行、映射行）只在需要首次出现顺序时（unique）排序
+_ADVERTISER_CUBE = """
+    SELECT cube.*, advertiser_map."二级广告主", advertiser_map."三级广告主", advertiser_map."Position"
+    FROM cube LEFT JOIN advertiser_map
+      ON cube."Advertiser" IS NOT DISTINCT FROM advertiser_map."Advertiser"
+"""
+
+
+class DuckDBReportFrames:
+    """
+    与adv_report_core.PandasReportFrames方法一致，查询为DuckDB SQL
+    立方（已汇总，行数远小于原始行）、广告主映射与reject事件各建一张内存表；
+    各阶段可并行调用，每次查询使用独立的游标；用完后调用close()
+    """
+
+    def __init__(self, aggregates, connection=None):
+        self.daily_cube = aggregates.daily_cube
+        compact = compact_aggregates(aggregates)
+        cube = compact['sheet1_all_data']
+        reject = compact['sheet4_reject']
+        advertiser = compact['sheet3_advertiser']
+        rule = compact['sheet2_reject_rule']
+
+        self.labels = {
+            'Offer ID': CodeLabels(self.daily_cube['Offer ID'], cube['Offer ID']),
+            'Affiliate': CodeLabels(self.daily_cube['Affiliate'], cube['Affiliate']),
+        }
+        for level in ADVERTISER_LEVELS:
+            self.labels[level] = CodeLabels(aggregates.sheet3_advertiser[level], advertiser[level])
+        self.integer_columns = {
+            col for col in CUBE_METRICS + ['Row Count'] if cube[col].dtype.kind in 'iu'
+        } | {'Reject Count'}
+
+        # 日期平移与reject倍数每个Advertiser / Event只判断一次（见reject_event_rows）
+        events = reject_event_rows(reject, rule)
+        tables = {
+            'cube': pa.table({
+                'Row': pa.array(np.arange(len(cube), dtype=np.int64)),
+                'Date': _day_array(cube['Date']),
+                **{key: _code_array(cube[key].cat.codes) for key in CUBE_KEYS[1:]},
+                **{col: pa.array(cube[col].to_numpy(), from_pandas=True)
+                   for col in CUBE_METRICS + ['Max Revenue', 'Row Count']},
+            }),
+            'advertiser_map': pa.table({
+                'Position': pa.array(np.arange(len(advertiser), dtype=np.int64)),
+                **{col: _code_array(advertiser[col].cat.codes) for col in ['Advertiser'] + ADVERTISER_LEVELS},
+            }),
+            'reject_events': pa.table({
+                'Advertiser': _code_array(reject['Advertiser'].cat.codes),
+                'New Date': _day_array(events['New Date']),
+                'Reject Count': pa.array(events['Reject Count'].to_numpy(dtype=np.int64)),
+            }),
+        }
+
+        self.owns_connection = connection is None
+        self.connection = connect() if connection is None else connection
+        try:
+            for name, table in tables.items():
+                # 注册的Arrow视图只对当前连接可见，建成表后各游标共用
+                self.connection.register(f'{name}_arrow', table)
+                self.connection.execute(f'CREATE TABLE {name} AS SELECT * FROM {name}_arrow')
+                self.connection.unregister(f'{name}_arrow')
+            self.connection.execute(f'CREATE VIEW advertiser_cube AS {_ADVERTISER_CUBE}')
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """关闭本对象新建的连接（传入的连接由调用方关闭）"""
+        if self.owns_connection:
+            self.connection.close()
+
+    def _query(self, sql):
+        with self.connection.cursor() as cursor:
+            return cursor.execute(sql).df()
+
+    def join_advertisers(self):
+        """立方关联二级/三级广告主（视图，在各查询中执行）"""
+        return 'advertiser_cube'
+
+    def _cube(self, advertisers):
+        return self.join_advertisers() if advertisers else 'cube'
+
+    def _decode(self, frame, columns):
+        """查询结果 → pandas列（标识列还原，Date为日期键）"""
+        result = pd.DataFrame(index=pd.RangeIndex(len(frame)))
+        for col in columns:
+            if col in self.labels:
+                result[col] = self.labels[col].decode(frame[col].to_numpy())
+            elif col in ('Date', 'New Date'):
+                result[col] = _decode_days(frame[col].to_numpy(dtype=float))
+            else:
+                result[col] = frame[col].to_numpy()
+        return result
+
+    def _aggregate(self, name, col, func):
+        if func == 'max':
+            return f'MAX("{col}") AS "{name}"'
+        if col in self.integer_columns:
+            return f'CAST(COALESCE(SUM("{col}"), 0) AS BIGINT) AS "{name}"'
+        return f'COALESCE(fsum("{col}"), 0) AS "{name}"'
+
+    def dates(self):
+        """全部日期（pd.Timestamp），从新到旧"""
+        days = self._query('SELECT DISTINCT "Date" FROM cube WHERE "Date" IS NOT NULL')
+        return list(pd.DatetimeIndex(_decode_days(days['Date'].to_numpy(dtype=float))).sort_values(ascending=False))
+
+    def unique(self, column, advertisers=False):
+        """列的唯一值（按立方中的首次出现顺序，含缺失值，普通值）"""
+        order = '"Row", "Position"' if advertisers else '"Row"'
+        codes = self._query(f"""
+            SELECT {_select_codes([column])}
+            FROM (SELECT "{column}", row_number() OVER (ORDER BY {order}) AS "Seq" FROM {self._cube(advertisers)})
+            GROUP BY "{column}"
+            ORDER BY MIN("Seq")
+        """)
+        return np.asarray(self.labels[column].decode(codes[column].to_numpy()), dtype=object)
+
+    def first_rows(self, key, columns, date=None):
+        """每个key首次出现的立方行的columns（date指定时只看当天）"""
+        where = f'WHERE {_in("Date", _day_values([date]))}' if date is not None else ''
+        rows = self._query(f'SELECT MIN("Row") AS "Row" FROM cube {where} GROUP BY "{key}" ORDER BY 1')
+        first = self.daily_cube.iloc[rows['Row'].to_numpy()]
+        return pd.DataFrame({col: np.asarray(first[col], dtype=object) for col in columns})
+
+    def _pivot(self, source, keys, aggregations, dates, date_col):
+        """source中按 keys × 日期 分组，展开为与pivot_by_date相同的宽表"""
+        dates = list(dates)
+        columns = ', '.join(self._aggregate(name, col, func) for name, (col, func) in aggregations.items())
+        group_columns = ', '.join(f'"{col}"' for col in keys + [date_col])
+        daily = self._query(f"""
+            SELECT {group_columns}, {columns}
+            FROM {source}
+            WHERE {_in(date_col, _day_values(dates))} AND {_not_null(keys)}
+            GROUP BY {group_columns}
+        """)
+        daily = self._decode(daily, keys + [date_col] + list(aggregations))
+        wide = daily.set_index(keys + [date_col]).unstack(date_col, fill_value=0)
+        return wide.reindex(columns=pd.MultiIndex.from_product([list(aggregations), dates]), fill_value=0)
+
+    def pivot(self, keys, aggregations, dates, advertisers=False):
+        """pivot_by_date；advertisers=True时在关联广告主后的立方上计算"""
+        return self._pivot(self._cube(advertisers), keys, aggregations, dates, 'Date')
+
+    def affiliate_metrics(self, offers, dates):
+        """指定Offer在dates中按 (Offer ID, Affiliate, Date) 汇总收入/点击/转化"""
+        keys = ['Offer ID', 'Affiliate', 'Date']
+        columns = ['Total Revenue', 'Total Clicks', 'Total Conversions']
+        offer_codes = self.labels['Offer ID'].encode(offers)
+        group_columns = ', '.join(f'"{col}"' for col in keys)
+        metrics = self._query(f"""
+            SELECT {group_columns}, {', '.join(self._aggregate(col, col, 'sum') for col in columns)}
+            FROM advertiser_cube
+            WHERE {_in('Offer ID', offer_codes[offer_codes >= 0])} AND {_in('Date', _day_values(dates))}
+              AND {_not_null(keys)}
+            GROUP BY {group_columns}
+            ORDER BY {group_columns}
+        """)
+        return self._decode(metrics, keys + columns)
+
+    def main_advertiser(self, date):
+        """当天每个Affiliate出现最多（按原始行数）的二级广告主，并列时取最小值"""
+        modes = self._query(f"""
+            SELECT "Affiliate", "二级广告主"
+            FROM (
+                SELECT "Affiliate", "二级广告主", SUM("Row Count") AS "Rows"
+                FROM advertiser_cube
+                WHERE {_in('Date', _day_values([date]))} AND {_not_null(['Affiliate', '二级广告主'])}
+                GROUP BY "Affiliate", "二级广告主"
+            )
+            QUALIFY row_number() OVER (PARTITION BY "Affiliate" ORDER BY "Rows" DESC, "二级广告主") = 1
+            ORDER BY "Affiliate"
+        """)
+        modes = self._decode(modes, ['Affiliate', '二级广告主'])
+        return pd.Series(
+            np.asarray(modes['二级广告主'], dtype=object),
+            index=pd.Index(modes['Affiliate'], name='Affiliate'),
+            name='二级广告主'
+        )
+
+    def reject_pivot(self, dates):
+        """
+        二级广告主 × New Date 的reject数
+        事件日期按REJECT_DAY_SHIFTS平移（appnext减一天）；是否为reject按2-reject规则判断
+        """
+        events = """(
+            SELECT advertiser_map."二级广告主", reject_events."New Date", reject_events."Reject Count"
+            FROM reject_events LEFT JOIN advertiser_map
+              ON reject_events."Advertiser" IS NOT DISTINCT FROM advertiser_map."Advertiser"
+        )"""
+        return self._pivot(events, ['二级广告主'], {'Total reject': ('Reject Count', 'sum')}, dates, 'New Date')
@@ -0,0 +1,144 @@
+"""
+分析结果的多格式导出（Parquet / gzip CSV / NDJSON / xlsx）
+
+下游BI任务直接读取带类型的Parquet或逐行JSON，不再解析xlsx报告
+每种格式是一个ReportWriter，注册在REPORT_WRITERS中；
+write_report_outputs一次写出多种格式，各格式在线程池中并行执行
+
+    paths = write_report_outputs(results, './outputs', formats=['parquet', 'csv.gz', 'jsonl'])
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from adv_report_core import REPORT_SHEETS, report_filename, write_report_excel
+
+# 除REPORT_SHEETS中的表格（table1~table4、history）外，stats字典也作为一张单行表导出
+STATS_TABLE = 'stats'
+
+
+def report_stem(results):
+    """导出文件名前缀，如 20260127日报分析结论"""
+    return os.path.splitext(report_filename(results))[0]
+
+
+def stats_frame(results):
+    """stats字典转为单行表，附带最新日期便于下游按日期分区"""
+    row = {'newest_date': results['newest_date_str']}
+    row.update(results['stats'])
+    return pd.DataFrame([row])
+
+
+def iter_report_tables(results):
+    """依次返回 (表名, DataFrame)：REPORT_SHEETS中的表格和stats"""
+    for key in REPORT_SHEETS:
+        yield key, results[key]
+    yield STATS_TABLE, stats_frame(results)
+
+
+class ReportWriter:
+    """
+    导出格式的基类
+    子类设置format/extension，并实现write_table（每张表一个文件）
+    或直接覆盖write（如xlsx把所有表写进同一个文件）
+    """
+
+    format = None
+    extension = None
+
+    def table_path(self, output_dir, stem, table_name):
+        return os.path.join(output_dir, f"{stem}_{table_name}{self.extension}")
+
+    def write_table(self, df, path):
+        raise NotImplementedError
+
+    def write(self, results, output_dir, stem):
+        """写出全部表格，返回写出的文件路径列表"""
+        paths = []
+        for table_name, df in iter_report_tables(results):
+            path = self.table_path(output_dir, stem, table_name)
+            self.write_table(df, path)
+            paths.append(path)
+        return paths
+
+
+def _arrow_compatible(df):
+    """
+    object列中混合了数字和文本（如部分Offer ID为数字）时统一转为文本，
+    数值列保持原类型，保证Parquet按列带类型写出
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+class ParquetReportWriter(ReportWriter):
+    format = 'parquet'
+    extension = '.parquet'
+
+    def write_table(self, df, path):
+        _arrow_compatible(df).to_parquet(path, index=False)
+
+
+class CsvGzipReportWriter(ReportWriter):
+    format = 'csv.gz'
+    extension = '.csv.gz'
+
+    def write_table(self, df, path):
+        df.to_csv(path, index=False, encoding='utf-8', compression='gzip')
+
+
+class JsonLinesReportWriter(ReportWriter):
+    format = 'jsonl'
+    extension = '.jsonl'
+
+    def write_table(self, df, path):
+        df.to_json(path, orient='records', lines=True, force_ascii=False, date_format='iso')
+
+
+class ExcelReportWriter(ReportWriter):
+    """与网页下载相同的xlsx报告（每张表一个工作表）"""
+
+    format = 'xlsx'
+    extension = '.xlsx'
+
+    def write(self, results, output_dir, stem):
+        path = os.path.join(output_dir, f"{stem}{self.extension}")
+        write_report_excel(results, path)
+        return [path]
+
+
+REPORT_WRITERS = {}
+
+
+def register_report_writer(writer):
+    """注册导出格式（writer为ReportWriter实例），同名格式会被覆盖"""
+    REPORT_WRITERS[writer.format] = writer
+    return writer
+
+
+for _writer in (ExcelReportWriter(), ParquetReportWriter(), CsvGzipReportWriter(), JsonLinesReportWriter()):
+    register_report_writer(_writer)
+
+
+def write_report_outputs(results, output_dir, formats=None, stem=None, max_workers=None):
+    """
+    一次写出多种格式，返回 {格式: [文件路径]}
+    formats默认为全部已注册格式；各格式在线程池中并行写出
+    """
+    formats = list(formats or REPORT_WRITERS)
+    unknown = [fmt for fmt in formats if fmt not in REPORT_WRITERS]
+    if unknown:
+        raise ValueError(f"不支持的导出格式：{', '.join(unknown)}（可选：{', '.join(REPORT_WRITERS)}）")
+    os.makedirs(output_dir, exist_ok=True)
+    stem = stem or report_stem(results)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(formats)) as executor:
+        futures = {
+            fmt: executor.submit(REPORT_WRITERS[fmt].write, results, output_dir, stem)
+            for fmt in formats
+        }
+        return {fmt: future.result() for fmt, future in futures.items()}
@@ -0,0 +1,216 @@
+"""
+后台分析任务队列：分析不在Streamlit脚本线程中同步执行，页面轮询任务状态
+
+    queue = JobQueue(max_workers=2, max_pending=8)
+    job_id = queue.submit(run_report, workbook, key=(digest, engine), name='20260127.xlsx')
+    queue.status(job_id)   # {'id', 'status', 'progress', 'message', 'position', ...}
+    queue.result(job_id)   # 完成后取回结果
+
+- 进程内队列，不需要外部消息中间件；同一服务进程的所有会话共享一个队列（见adv_data_report.get_job_queue）
+- 最多max_workers个任务同时执行，其余按提交顺序排队；排队+执行中的任务超过max_pending时拒绝提交（准入控制）
+- 任务函数的第一个参数为JobProgress，与st.progress / st.empty接口相同（progress(0~100) / text(消息)），
+  可直接作为process_daily_report_web的progress_bar与status_text
+- 相同key的任务在排队、执行中或结果仍保留时不重复提交，直接返回已有任务id
+- 已结束的任务最多保留max_finished个（按结束时间淘汰最早的），结果随任务一起释放
+"""
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 同时执行的分析任务数（每个任务内部另有STAGE_WORKERS个阶段线程）
+JOB_WORKERS = int(os.environ.get('ADV_REPORT_JOB_WORKERS', '2'))
+# 排队+执行中的任务上限，超过时拒绝提交
+JOB_MAX_PENDING = int(os.environ.get('ADV_REPORT_JOB_MAX_PENDING', '8'))
+# 保留结果的已结束任务数
+JOB_MAX_FINISHED = 32
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobProgress:
+    """任务进度：接口同st.progress(value) / st.empty().text(message)，在工作线程中更新任务状态"""
+
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self._job_id = job_id
+
+    def progress(self, value):
+        self._queue._update(self._job_id, progress=max(0, min(100, int(value))))
+
+    def text(self, message):
+        self._queue._update(self._job_id, message=str(message))
+
+
+class JobQueue:
+    """进程内的有界任务队列；各方法线程安全，可在多个Streamlit会话中同时调用"""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, max_finished=JOB_MAX_FINISHED):
+        if max_workers < 1 or max_pending < max_workers:
+            raise ValueError("max_workers至少为1，max_pending不能小于max_workers")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='adv-report-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._futures = {}
+        self._keys = {}
+
+    def submit(self, func, *args, key=None, name='', **kwargs):
+        """
+        提交任务func(JobProgress, *args, **kwargs)，返回任务id
+        相同key的任务未失败且仍保留时返回已有任务id；队列已满时抛出RuntimeError
+        """
+        with self._lock:
+            existing = self._find(key)
+            if existing is not None:
+                return existing
+            pending = sum(job['status'] in (QUEUED, RUNNING) for job in self._jobs.values())
+            if pending >= self.max_pending:
+                raise RuntimeError(f"分析任务已满（{pending}个排队或执行中），请稍后再试")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'name': name,
+                'key': key,
+                'status': QUEUED,
+                'progress': 0,
+                'message': '排队中',
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+                'result': None,
+            }
+            if key is not None:
+                self._keys[key] = job_id
+            self._futures[job_id] = self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _find(self, key):
+        """调用方持有锁"""
+        job = self._jobs.get(self._keys.get(key)) if key is not None else None
+        if job is None or job['status'] in (FAILED, CANCELLED):
+            return None
+        return job['id']
+
+    def find(self, key):
+        """排队、执行中或已完成且结果仍保留的相同key的任务id，没有时为None"""
+        with self._lock:
+            return self._find(key)
+
+    def _run(self, job_id, func, args, kwargs):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return
+            job.update(status=RUNNING, started_at=time.time(), message='开始执行')
+        try:
+            result = func(JobProgress(self, job_id), *args, **kwargs)
+        except Exception as e:
+            self._finish(job_id, FAILED, error=str(e) or type(e).__name__, traceback=traceback.format_exc())
+        else:
+            self._finish(job_id, DONE, result=result, progress=100, message='完成')
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] == RUNNING:
+                job.update(fields)
+
+    def _finish(self, job_id, status, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields, status=status, finished_at=time.time())
+            self._futures.pop(job_id, None)
+            self._evict()
+
+    def _evict(self):
+        """只保留最近结束的max_finished个任务（调用方持有锁）"""
+        finished = sorted(
+            (job for job in self._jobs.values() if job['status'] in FINISHED_STATES),
+            key=lambda job: job['finished_at']
+        )
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job['id']]
+            if self._keys.get(job['key']) == job['id']:
+                del self._keys[job['key']]
+
+    def status(self, job_id):
+        """
+        任务状态（不含结果），任务不存在或已被淘汰时为None
+        position：排队中的任务前面还有几个排队任务（执行中的不计）
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {k: v for k, v in job.items() if k != 'result'}
+            snapshot['position'] = None
+            if job['status'] == QUEUED:
+                snapshot['position'] = sum(
+                    other['status'] == QUEUED and other['submitted_at'] < job['submitted_at']
+                    for other in self._jobs.values()
+                )
+            return snapshot
+
+    def result(self, job_id):
+        """已完成任务的结果；失败时抛出RuntimeError，未完成或不存在时抛出ValueError"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise ValueError(f"任务不存在或结果已释放：{job_id}")
+            if job['status'] == FAILED:
+                raise RuntimeError(job['error'])
+            if job['status'] != DONE:
+                raise ValueError(f"任务尚未完成（{job['status']}）：{job_id}")
+            return job['result']
+
+    def wait(self, job_id, timeout=None):
+        """阻塞等待任务结束（命令行与调试用），返回最终状态"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self.status(job_id)
+
+    def cancel(self, job_id):
+        """取消排队中的任务；已开始执行的任务不能取消，返回是否已取消"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return False
+            future = self._futures.pop(job_id, None)
+            if future is not None:
+                future.cancel()
+            job.update(status=CANCELLED, finished_at=time.time(), message='已取消')
+            self._evict()
+            return True
+
+    def stats(self):
+        """{'queued', 'running', 'finished', 'max_workers', 'max_pending'}"""
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {
+            'queued': statuses.count(QUEUED),
+            'running': statuses.count(RUNNING),
+            'finished': sum(status in FINISHED_STATES for status in statuses),
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,291 @@
+"""
+Polars执行引擎（可选依赖：pip install polars）
+
+process_daily_report_web(..., engine='polars') 时：
+- 原始行上的两次汇总（日数据立方与reject事件计数）为Polars LazyFrame分组
+- 立方上的筛选、关联二级/三级广告主、透视、Affiliate分析与reject表格
+  都是LazyFrame查询：Date / Offer ID等筛选写在关联之前，由优化器下推到扫描，
+  只在collect()时执行一次
+结果仍以pandas DataFrame返回，表格组装与pandas引擎共用
+浮点指标在Polars中并行求和，累加顺序与pandas（按行顺序补偿求和）不同，
+个别金额可能在两位小数的舍入边界上相差0.01（check_engine_parity按输出精度比较）
+
+标识列以int32编码（缺失为null）参与关联和分组，结果再按原字典还原，
+保持与pandas引擎相同的类型和值
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from adv_report_core import (
+    ADVERTISER_LEVELS,
+    CUBE_ATTRIBUTES,
+    CUBE_KEYS,
+    CUBE_METRICS,
+    DAY_DTYPE,
+    REJECT_CUBE_KEYS,
+    CodeLabels,
+    DailyAggregates,
+    compact_aggregates,
+    reject_event_rows,
+)
+
+
+def _polars():
+    try:
+        import polars as pl
+    except ImportError:
+        raise ImportError("Polars引擎需要安装polars：pip install polars")
+    return pl
+
+
+def _code_series(pl, name, codes):
+    """int32编码 → Polars列（-1为null）"""
+    codes = np.asarray(codes, dtype=np.int32)
+    return pl.Series(name, pa.array(codes, mask=codes < 0))
+
+
+def _day_series(pl, name, values):
+    """Time / Date列 → Polars Date列（缺失为null）；已是datetime64时直接截断到日，不再经过pd.to_datetime"""
+    values = np.asarray(values)
+    if values.dtype.kind != 'M':
+        values = np.asarray(pd.to_datetime(values), dtype='datetime64[ns]')
+    days = values.astype('datetime64[D]')
+    return pl.Series(name, days)
+
+
+def _metric_series(pl, name, values):
+    """指标列：浮点NaN转为null，求和时与pandas一样跳过缺失值"""
+    return pl.Series(name, np.asarray(values), nan_to_null=True)
+
+
+def _codes(series):
+    """Polars编码列 → int32编码（null为-1），供CodeLabels.decode还原"""
+    return series.fill_null(-1).to_numpy().astype(np.int32)
+
+
+def _decode_days(series):
+    """Polars Date列 → 日期键（adv_report_core.day_key，null为NaT）"""
+    return series.to_numpy().astype(DAY_DTYPE)
+
+
+def _day_literals(days):
+    """日期键（pd.Timestamp）→ Polars Date列可比较的datetime.date"""
+    return [pd.Timestamp(day).date() for day in days]
+
+
+class PolarsReportFrames:
+    """与adv_report_core.PandasReportFrames方法一致，查询在Polars LazyFrame上执行"""
+
+    def __init__(self, aggregates):
+        pl = self.pl = _polars()
+        self.daily_cube = aggregates.daily_cube
+        self.sheet3_advertiser = aggregates.sheet3_advertiser
+        compact = compact_aggregates(aggregates)
+        cube = compact['sheet1_all_data']
+        reject = compact['sheet4_reject']
+        advertiser = compact['sheet3_advertiser']
+        rule = compact['sheet2_reject_rule']
+
+        self.labels = {
+            'Offer ID': CodeLabels(self.daily_cube['Offer ID'], cube['Offer ID']),
+            'Affiliate': CodeLabels(self.daily_cube['Affiliate'], cube['Affiliate']),
+        }
+        for level in ADVERTISER_LEVELS:
+            self.labels[level] = CodeLabels(self.sheet3_advertiser[level], advertiser[level])
+
+        self.cube = pl.LazyFrame([
+            pl.Series('Row', np.arange(len(cube), dtype=np.int64)),
+            _day_series(pl, 'Date', cube['Date']),
+            *[_code_series(pl, key, cube[key].cat.codes) for key in CUBE_KEYS[1:]],
+            *[_metric_series(pl, col, cube[col]) for col in CUBE_METRICS + ['Max Revenue', 'Row Count']],
+        ])
+        self.advertiser_map = pl.LazyFrame([
+            _code_series(pl, col, advertiser[col].cat.codes) for col in ['Advertiser'] + ADVERTISER_LEVELS
+        ])
+
+        # 日期平移与reject倍数每个Advertiser / Event只判断一次（见reject_event_rows）
+        events = reject_event_rows(reject, rule)
+        self.reject = pl.LazyFrame([
+            _code_series(pl, 'Advertiser', reject['Advertiser'].cat.codes),
+            _day_series(pl, 'New Date', events['New Date']),
+            pl.Series('Reject Count', events['Reject Count'].to_numpy(dtype=np.int64)),
+        ])
+        self.advertiser_cube = None
+
+    def close(self):
+        """LazyFrame不持有外部资源"""
+
+    def _join(self, left, right, on):
+        """与pd.merge(how='left')一致：缺失值可匹配，保持左表顺序，多条匹配依次展开"""
+        return left.join(right, on=on, how='left', nulls_equal=True, maintain_order='left_right')
+
+    def join_advertisers(self):
+        """立方关联二级/三级广告主（惰性，只在查询collect时执行）"""
+        if self.advertiser_cube is None:
+            self.advertiser_cube = self._join(self.cube, self.advertiser_map, 'Advertiser')
+        return self.advertiser_cube
+
+    def _cube(self, advertisers):
+        return self.join_advertisers() if advertisers else self.cube
+
+    def _decode(self, frame, columns):
+        """collect后的Polars结果 → pandas列（标识列还原，Date为日期键）"""
+        result = pd.DataFrame(index=pd.RangeIndex(frame.height))
+        for col in columns:
+            if col in self.labels:
+                result[col] = self.labels[col].decode(_codes(frame[col]))
+            elif col in ('Date', 'New Date'):
+                result[col] = _decode_days(frame[col])
+            else:
+                result[col] = frame[col].to_numpy()
+        return result
+
+    def dates(self):
+        """全部日期（pd.Timestamp），从新到旧"""
+        dates = self.cube.select(self.pl.col('Date').unique().drop_nulls()).collect()['Date']
+        return list(pd.DatetimeIndex(_decode_days(dates)).sort_values(ascending=False))
+
+    def unique(self, column, advertisers=False):
+        """列的唯一值（按立方中的首次出现顺序，含缺失值，普通值）"""
+        codes = self._cube(advertisers).select(
+            self.pl.col(column).unique(maintain_order=True)
+        ).collect()[column]
+        return np.asarray(self.labels[column].decode(_codes(codes)), dtype=object)
+
+    def first_rows(self, key, columns, date=None):
+        """每个key首次出现的立方行的columns（date指定时只看当天）"""
+        pl = self.pl
+        cube = self.cube
+        if date is not None:
+            cube = cube.filter(pl.col('Date') == _day_literals([date])[0])
+        rows = cube.unique(subset=[key], keep='first', maintain_order=True).select('Row').collect()
+        first = self.daily_cube.iloc[rows['Row'].to_numpy()]
+        return pd.DataFrame({col: np.asarray(first[col], dtype=object) for col in columns})
+
+    def _pivot(self, query, keys, aggregations, dates, date_col):
+        """query中按 keys × 日期 分组，展开为与pivot_by_date相同的宽表"""
+        pl = self.pl
+        dates = list(dates)
+        agg_functions = {'sum': lambda col: pl.col(col).sum(), 'max': lambda col: pl.col(col).max()}
+        daily = query.filter(
+            pl.col(date_col).is_in(_day_literals(dates)) & pl.all_horizontal([pl.col(key).is_not_null() for key in keys])
+        ).group_by(keys + [date_col]).agg(
+            agg_functions[func](col).alias(name) for name, (col, func) in aggregations.items()
+        ).collect()
+        daily = self._decode(daily, keys + [date_col] + list(aggregations))
+        wide = daily.set_index(keys + [date_col]).unstack(date_col, fill_value=0)
+        return wide.reindex(columns=pd.MultiIndex.from_product([list(aggregations), dates]), fill_value=0)
+
+    def pivot(self, keys, aggregations, dates, advertisers=False):
+        """pivot_by_date；advertisers=True时在关联广告主后的立方上计算"""
+        return self._pivot(self._cube(advertisers), keys, aggregations, dates, 'Date')
+
+    def affiliate_metrics(self, offers, dates):
+        """指定Offer在dates中按 (Offer ID, Affiliate, Date) 汇总收入/点击/转化"""
+        pl = self.pl
+        keys = ['Offer ID', 'Affiliate', 'Date']
+        offer_codes = self.labels['Offer ID'].encode(offers)
+        # Offer / Date筛选在关联之前，只关联高差异Offer在两天内的立方行
+        query = self.cube.filter(
+            pl.col('Offer ID').is_in(offer_codes[offer_codes >= 0].tolist()) & pl.col('Date').is_in(_day_literals(dates))
+        )
+        columns = ['Total Revenue', 'Total Clicks', 'Total Conversions']
+        metrics = self._join(query, self.advertiser_map, 'Advertiser').filter(
+            pl.all_horizontal([pl.col(key).is_not_null() for key in keys])
+        ).group_by(keys).agg(pl.col(col).sum() for col in columns).sort(keys).collect()
+        return self._decode(metrics, keys + columns)
+
+    def main_advertiser(self, date):
+        """当天每个Affiliate出现最多（按原始行数）的二级广告主，并列时取最小值"""
+        pl = self.pl
+        counts = self.join_advertisers().filter(
+            (pl.col('Date') == _day_literals([date])[0]) & pl.col('Affiliate').is_not_null() & pl.col('二级广告主').is_not_null()
+        ).group_by(['Affiliate', '二级广告主']).agg(
+            pl.col('Row Count').sum()
+        ).sort(
+            ['Affiliate', 'Row Count', '二级广告主'], descending=[False, True, False]
+        ).unique(subset=['Affiliate'], keep='first', maintain_order=True).collect()
+        modes = self._decode(counts, ['Affiliate', '二级广告主'])
+        return pd.Series(
+            np.asarray(modes['二级广告主'], dtype=object),
+            index=pd.Index(modes['Affiliate'], name='Affiliate'),
+            name='二级广告主'
+        )
+
+    def reject_pivot(self, dates):
+        """
+        二级广告主 × New Date 的reject数
+        事件日期按REJECT_DAY_SHIFTS平移（appnext减一天）；是否为reject按2-reject规则判断
+        """
+        events = self._join(self.reject, self.advertiser_map.select(['Advertiser', '二级广告主']), 'Advertiser')
+        return self._pivot(
+            events, ['二级广告主'], {'Total reject': ('Reject Count', 'sum')}, dates, 'New Date'
+        )
+
+
+def build_daily_aggregates_polars(workbook):
+    """与adv_report_core.build_daily_aggregates相同的结果，汇总为Polars LazyFrame分组"""
+    pl = _polars()
+    sheet1_all_data = workbook.sheet1_all_data
+    sheet4_reject = workbook.sheet4_reject
+
+    def encode(series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.cat.codes.to_numpy(), series.dtype
+        codes, uniques = pd.factorize(series)
+        return codes, pd.Index(uniques, dtype=object)
+
+    def decode(codes, dictionary):
+        codes = codes.fill_null(-1).to_numpy().astype(np.int32)
+        if isinstance(dictionary, pd.CategoricalDtype):
+            return pd.Categorical.from_codes(codes, dtype=dictionary)
+        values = np.full(len(codes), np.nan, dtype=object)
+        values[codes >= 0] = np.asarray(dictionary, dtype=object)[codes[codes >= 0]]
+        return values
+
+    # 日数据立方：分组按首次出现顺序（maintain_order），即按First Row排列
+    cube_keys = {key: encode(sheet1_all_data[key]) for key in CUBE_KEYS[1:]}
+    rows = pl.LazyFrame([
+        _day_series(pl, 'Date', sheet1_all_data['Time']),
+        *[_code_series(pl, key, codes) for key, (codes, _) in cube_keys.items()],
+        *[_metric_series(pl, metric, sheet1_all_data[metric]) for metric in CUBE_METRICS],
+        pl.Series('Row', np.arange(len(sheet1_all_data), dtype=np.int64)),
+    ])
+    cube = rows.group_by(CUBE_KEYS, maintain_order=True).agg(
+        *[pl.col(metric).sum() for metric in CUBE_METRICS],
+        pl.col('Total Revenue').max().alias('Max Revenue'),
+        pl.len().alias('Row Count'),
+        pl.col('Row').min().alias('First Row'),
+    ).collect()
+
+    daily_cube = pd.DataFrame({'Date': _decode_days(cube['Date'])})
+    for key, (_, dictionary) in cube_keys.items():
+        daily_cube[key] = decode(cube[key], dictionary)
+    for metric in CUBE_METRICS:
+        daily_cube[metric] = cube[metric].to_numpy()
+    daily_cube['Max Revenue'] = cube['Max Revenue'].to_numpy().astype(float)
+    daily_cube['Row Count'] = cube['Row Count'].to_numpy().astype(np.int64)
+    daily_cube['First Row'] = cube['First Row'].to_numpy()
+    positions = daily_cube['First Row'].to_numpy()
+    for col in CUBE_ATTRIBUTES:
+        daily_cube[col] = sheet1_all_data[col].to_numpy()[positions]
+
+    # reject事件计数
+    reject_keys = {key: encode(sheet4_reject[key]) for key in REJECT_CUBE_KEYS[1:]}
+    counts = pl.LazyFrame([
+        _day_series(pl, 'Date', sheet4_reject['Time']),
+        *[_code_series(pl, key, codes) for key, (codes, _) in reject_keys.items()],
+    ]).group_by(REJECT_CUBE_KEYS, maintain_order=True).agg(pl.len().alias('Event Count')).collect()
+
+    reject_cube = pd.DataFrame({'Date': _decode_days(counts['Date'])})
+    for key, (_, dictionary) in reject_keys.items():
+        reject_cube[key] = decode(counts[key], dictionary)
+    reject_cube['Event Count'] = counts['Event Count'].to_numpy().astype(np.int64)
+
+    return DailyAggregates(
+        daily_cube=daily_cube,
+        reject_cube=reject_cube,
+        sheet3_advertiser=workbook.sheet3_advertiser,
+        sheet2_reject_rule=workbook.sheet2_reject_rule,
+    )
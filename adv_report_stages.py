@@ -0,0 +1,239 @@
+"""
+报告计算阶段的依赖调度
+
+process_daily_report_web把预处理与四个表格拆成有依赖关系的阶段（Stage），
+StageScheduler按依赖图把已就绪的阶段提交到线程池并行执行：
+表格一/二/三互不依赖，表格四只等待表格三的reject列
+
+    scheduler = StageScheduler(on_progress=lambda done, total, stage: print(done, total, stage.name))
+    outputs = scheduler.run([
+        Stage('table3', build_table3),
+        Stage('table4', build_table4, deps=('table3',)),
+    ])
+    scheduler.timings  # {'table3': 0.12, 'table4': 0.05}
+
+使用线程池而不是进程池：各阶段共享同一份立方数据，不需要序列化；
+pandas / numpy / Polars的分组与排序在C代码中释放GIL
+进度回调只在调用run的线程中执行（Streamlit的进度条不能在工作线程中更新）
+
+StageProfiler记录每个阶段的墙钟时间、CPU时间、峰值内存增量与输入/输出行数，
+可传给StageScheduler，也可用measure()包裹调度之外的步骤（如读取文件）
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，峰值内存记为None
+    resource = None
+
+# 默认并行阶段数：可并行的表格不超过4个
+STAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+@dataclass
+class Stage:
+    """
+    一个计算阶段
+    - func(*依赖阶段的结果)，参数顺序与deps一致
+    - label：进度提示中显示的名称
+    """
+    name: str
+    func: object
+    deps: tuple = ()
+    label: str = ''
+    # 输入行数；None时为各依赖阶段输出行数之和
+    input_rows: int = None
+
+
+def count_rows(value):
+    """
+    阶段结果的行数：DataFrame/数组取行数，元组取第一个元素，列表/集合/字典取长度
+    无法得知时（如尚未执行的Polars LazyFrame）为None
+    """
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    shape = getattr(value, 'shape', None)
+    if isinstance(shape, tuple) and shape:
+        return int(shape[0])
+    if isinstance(value, (list, set, frozenset, dict)):
+        return len(value)
+    return None
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）；Linux的ru_maxrss单位为KB，macOS为字节"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def reset_peak_rss():
+    """
+    把进程峰值常驻内存重置为当前值（仅Linux：写/proc/self/clear_refs），
+    使之后的peak_rss_mb只反映重置后的峰值；不支持时返回False
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+class StageProfiler:
+    """
+    按阶段记录性能数据，records为 {阶段名: 记录}，按阶段开始的先后排列：
+    - start_s：相对profiler创建时的开始时间（可看出哪些阶段并行）
+    - wall_s：墙钟时间
+    - cpu_s：执行阶段的线程的CPU时间（Polars/DuckDB内部线程池的CPU时间不计入）
+    - peak_rss_delta_mb：阶段内进程峰值内存的增长；并行阶段共享同一进程，增长记在各自名下
+    - input_rows / output_rows：输入与输出行数（未知时为None）
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name, input_rows=None):
+        """
+        with profiler.measure('load') as record:
+            ...
+            record['output_rows'] = len(df)
+        """
+        record = {'input_rows': input_rows, 'output_rows': None}
+        with self._lock:
+            self.records[name] = record
+        rss_before = peak_rss_mb()
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter()
+            rss_after = peak_rss_mb()
+            record.update({
+                'start_s': round(start - self._origin, 4),
+                'wall_s': round(end - start, 4),
+                'cpu_s': round(time.thread_time() - cpu_start, 4),
+                'peak_rss_delta_mb': None if rss_before is None else round(rss_after - rss_before, 1),
+            })
+
+    def to_dict(self):
+        """{阶段名: 记录}的副本，字段顺序固定"""
+        fields = ['start_s', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'input_rows', 'output_rows']
+        return {name: {field: record.get(field) for field in fields} for name, record in self.records.items()}
+
+
+def write_profile_jsonl(profile, path, **context):
+    """
+    把一次分析的阶段记录追加写入JSON lines文件（每个阶段一行），供监控系统采集
+    context为附加在每行上的字段（如输入文件、执行引擎）
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    with open(path, 'a', encoding='utf-8') as f:
+        for stage, record in profile.items():
+            row = {'timestamp': timestamp, **context, 'stage': stage, **record}
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+
+
+def topological_order(stages):
+    """按依赖排序的阶段列表（同层保持声明顺序）；阶段名重复、依赖不存在或有环时抛出ValueError"""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"阶段名重复：{stage.name}")
+        by_name[stage.name] = stage
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"阶段{stage.name}依赖的阶段不存在：{', '.join(missing)}")
+
+    ordered, done = [], set()
+    pending = list(stages)
+    while pending:
+        ready = [stage for stage in pending if all(dep in done for dep in stage.deps)]
+        if not ready:
+            raise ValueError(f"阶段依赖存在环：{', '.join(stage.name for stage in pending)}")
+        ordered.extend(ready)
+        done.update(stage.name for stage in ready)
+        pending = [stage for stage in pending if stage.name not in done]
+    return ordered
+
+
+class StageScheduler:
+    """
+    按依赖图执行阶段
+    - max_workers：并行阶段数，1表示在调用线程中依次执行
+    - on_progress(已完成数, 总数, 刚完成的Stage)：每个阶段完成后在调用线程中回调
+    - profiler：StageProfiler，记录每个阶段的性能数据（默认新建）
+    - timings：{阶段名: 耗时秒数}，多次run累积
+    """
+
+    def __init__(self, max_workers=None, on_progress=None, profiler=None):
+        self.max_workers = STAGE_WORKERS if max_workers is None else max(1, max_workers)
+        self.on_progress = on_progress
+        self.profiler = profiler or StageProfiler()
+        self.timings = {}
+
+    def _execute(self, stage, outputs):
+        args = [outputs[dep] for dep in stage.deps]
+        input_rows = stage.input_rows
+        if input_rows is None:
+            known = [rows for rows in map(count_rows, args) if rows is not None]
+            input_rows = sum(known) if known else None
+        with self.profiler.measure(stage.name, input_rows) as record:
+            result = stage.func(*args)
+            record['output_rows'] = count_rows(result)
+        return result, record['wall_s']
+
+    def _finish(self, stage, result, elapsed, outputs, total):
+        outputs[stage.name] = result
+        self.timings[stage.name] = elapsed
+        if self.on_progress:
+            self.on_progress(len(outputs), total, stage)
+
+    def run(self, stages):
+        """
+        执行全部阶段，返回 {阶段名: 结果}
+        任一阶段出错时不再提交新阶段，等待已提交的阶段结束后抛出该异常
+        """
+        ordered = topological_order(stages)
+        outputs = {}
+        if self.max_workers == 1:
+            for stage in ordered:
+                result, elapsed = self._execute(stage, outputs)
+                self._finish(stage, result, elapsed, outputs, len(ordered))
+            return outputs
+
+        pending = list(ordered)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [stage for stage in pending if all(dep in outputs for dep in stage.deps)]
+                for stage in ready:
+                    pending.remove(stage)
+                    running[executor.submit(self._execute, stage, dict(outputs))] = stage
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        pending.clear()
+                        wait(running)
+                        raise error
+                    result, elapsed = future.result()
+                    self._finish(stage, result, elapsed, outputs, len(ordered))
+        return outputs
@@ -0,0 +1,201 @@
+"""
+增量模式：按日期分区的本地聚合存储（Parquet）
+
+每天上传的工作簿只覆盖最近若干天的'1--all data'；增量模式把上传中的日期汇总为
+按日期分区的日数据立方与reject计数，报告直接由存储中的汇总计算（更早的日期不需要再次上传）：
+
+    store = DailyAggregateStore('./adv_report_store')
+    store.ingest(load_report_workbook('20260127.xlsx'))
+    results = process_daily_report_web(None, aggregates=store.load(days=required_days()))
+
+已入库的日期重新上传时整分区替换（默认），先入库的不完整导出会被完整数据更新，重复执行结果相同；
+overwrite=False时只写入存储中还没有的日期
+一次ingest的全部分区与匹配表一起提交：任一文件写入失败时整次ingest回滚，存储保持原样
+"""
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from adv_report_core import (
+    BUDGET_LOOKBACK_DAYS,
+    HISTORY_DAYS,
+    WEEK_DAYS,
+    DailyAggregates,
+    ReportWorkbook,
+    apply_compact_schema,
+    build_daily_cube,
+    build_reject_cube,
+    day_key,
+    decode_mixed_columns,
+    encode_mixed_columns,
+)
+
+STORE_DIR = os.environ.get(
+    'ADV_REPORT_STORE_DIR', os.path.join(os.path.expanduser('~'), '.adv_report_store')
+)
+
+
+def required_days(budget_lookback_days=BUDGET_LOOKBACK_DAYS, history_days=HISTORY_DAYS):
+    """报告需要读取的最近日期分区数：预算回看与历史趋势（含7日回看）取较大者"""
+    return max(budget_lookback_days + 1, history_days + WEEK_DAYS, 2)
+
+
+def _plain_columns(frame):
+    """
+    分类列还原为普通值再写入：各分区字典不同，读取时统一重新编码
+    混合数字和文本的列按encode_mixed_columns写出，读取时由decode_mixed_columns还原
+    """
+    frame = frame.copy(deep=False)
+    for col in list(frame.columns):
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = np.asarray(frame[col], dtype=object)
+    return encode_mixed_columns(frame)
+
+
+class DailyAggregateStore:
+    """
+    本地聚合存储
+    - cube/date=YYYY-MM-DD.parquet：该日的日数据立方（build_daily_cube）
+    - reject/date=YYYY-MM-DD.parquet：该日reject事件计数（build_reject_cube）
+    - mapping/*.parquet：最近一次上传的3--匹配广告主与2-reject规则
+    """
+
+    TABLES = ('cube', 'reject')
+    MAPPINGS = {'sheet3_advertiser': 'advertiser', 'sheet2_reject_rule': 'reject_rule'}
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        for name in self.TABLES + ('mapping',):
+            os.makedirs(os.path.join(self.store_dir, name), exist_ok=True)
+
+    def _partition_path(self, table, day):
+        return os.path.join(self.store_dir, table, f"date={pd.Timestamp(day).strftime('%Y-%m-%d')}.parquet")
+
+    def _mapping_path(self, name):
+        return os.path.join(self.store_dir, 'mapping', f"{name}.parquet")
+
+    def _write_all(self, files):
+        """
+        提交一次ingest的全部文件 [(frame, path)]
+        - 先全部写为临时文件，任一写入失败时删除临时文件，存储不变
+        - 再逐个替换目标文件，被替换的旧文件先改名备份；替换中途失败时恢复备份，
+          删除本次新增的分区，读取方不会看到只写了一部分日期的存储
+        """
+        staged = []
+        try:
+            for frame, path in files:
+                tmp_path = os.path.join(os.path.dirname(path), f".tmp-{uuid.uuid4().hex}.parquet")
+                staged.append((tmp_path, path))
+                _plain_columns(frame).to_parquet(tmp_path, index=False)
+        except Exception as e:
+            self._discard(tmp_path for tmp_path, _ in staged)
+            raise ValueError(f"写入聚合存储失败（{os.path.basename(path)}）：{str(e)}")
+
+        replaced = []
+        try:
+            for tmp_path, path in staged:
+                backup_path = None
+                if os.path.exists(path):
+                    backup_path = os.path.join(os.path.dirname(path), f".bak-{uuid.uuid4().hex}.parquet")
+                    os.replace(path, backup_path)
+                replaced.append((path, backup_path))
+                os.replace(tmp_path, path)
+        except Exception as e:
+            for path, backup_path in reversed(replaced):
+                if backup_path is not None:
+                    os.replace(backup_path, path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            self._discard(tmp_path for tmp_path, _ in staged)
+            raise ValueError(f"写入聚合存储失败（{os.path.basename(path)}），本次写入已回滚：{str(e)}")
+        self._discard(backup_path for _, backup_path in replaced if backup_path is not None)
+
+    @staticmethod
+    def _discard(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def dates(self, table='cube'):
+        """存储中已有的日期（升序）"""
+        days = []
+        for name in os.listdir(os.path.join(self.store_dir, table)):
+            if name.startswith('date=') and name.endswith('.parquet'):
+                days.append(pd.Timestamp(name[len('date='):-len('.parquet')]).date())
+        return sorted(days)
+
+    def _table_partitions(self, table, rows, build, overwrite):
+        """汇总需要入库的日期，返回 {日期: 分区}（尚未写入）"""
+        rows = rows.copy(deep=False)
+        rows['Date'] = day_key(rows['Time'])
+        uploaded = {day.date() for day in pd.DatetimeIndex(rows['Date'].dropna().unique())}
+        days = uploaded if overwrite else uploaded - set(self.dates(table))
+        if not days:
+            return {}
+        # 只汇总需要入库的日期，历史日期不再重复分组
+        aggregated = build(rows[rows['Date'].isin(day_key(sorted(days)))].reset_index(drop=True))
+        return {pd.Timestamp(day).date(): partition for day, partition in aggregated.groupby('Date', sort=True)}
+
+    def ingest(self, workbook, overwrite=True):
+        """
+        把一次上传的ReportWorkbook并入存储，返回 {'cube': [日期], 'reject': [日期]}
+        - 默认上传中的每个日期整分区替换（更新先前入库的不完整数据）；overwrite=False时只写入存储中还没有的日期
+        - 匹配广告主与reject规则每次都替换为本次上传的版本
+        - 全部分区与匹配表一起提交，失败时整次回滚（见_write_all）
+        """
+        partitions = {
+            'cube': self._table_partitions('cube', workbook.sheet1_all_data, build_daily_cube, overwrite),
+            'reject': self._table_partitions('reject', workbook.sheet4_reject, build_reject_cube, overwrite),
+        }
+        files = [
+            (partition, self._partition_path(table, day))
+            for table, by_day in partitions.items()
+            for day, partition in by_day.items()
+        ]
+        files += [(getattr(workbook, field), self._mapping_path(name)) for field, name in self.MAPPINGS.items()]
+        self._write_all(files)
+        return {table: sorted(by_day) for table, by_day in partitions.items()}
+
+    def _read(self, path):
+        return decode_mixed_columns(pd.read_parquet(path))
+
+    def _read_partitions(self, table, days):
+        frames = [self._read(self._partition_path(table, day)) for day in days]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def load(self, days=None):
+        """
+        读取最近days个日期（默认全部）的汇总，返回DailyAggregates
+        立方按日期、再按当日上传中的出现顺序排列（First Row重新编号）
+        """
+        cube_dates = self.dates('cube')
+        if not cube_dates:
+            raise ValueError(f"聚合存储为空：{self.store_dir}")
+        if days is not None:
+            cube_dates = cube_dates[-days:]
+        daily_cube = self._read_partitions('cube', cube_dates)
+        daily_cube['First Row'] = np.arange(len(daily_cube))
+        # 早期分区的Date为datetime.date，统一为日期键
+        daily_cube['Date'] = day_key(daily_cube['Date'])
+
+        # appnext的reject事件会平移到前一天，因此读取起始日期之后的全部reject分区
+        reject_dates = [day for day in self.dates('reject') if day >= cube_dates[0]]
+        reject_cube = self._read_partitions('reject', reject_dates)
+        if reject_cube is None:
+            reject_cube = pd.DataFrame({'Date': [], 'Advertiser': [], 'Event': [], 'Event Count': []})
+        reject_cube['Date'] = day_key(reject_cube['Date'])
+
+        mappings = {field: self._read(self._mapping_path(name)) for field, name in self.MAPPINGS.items()}
+
+        # 立方与原始数据列名一致，直接复用工作簿的紧凑类型规则（共享Advertiser/Event字典）
+        compact = apply_compact_schema(ReportWorkbook(
+            sheet1_all_data=daily_cube, sheet4_reject=reject_cube, **mappings
+        ))
+        return DailyAggregates(
+            daily_cube=compact.sheet1_all_data,
+            reject_cube=compact.sheet4_reject,
+            sheet3_advertiser=compact.sheet3_advertiser,
+            sheet2_reject_rule=compact.sheet2_reject_rule,
+        )
@@ -0,0 +1,201 @@
+"""
+合成测试数据：按模板生成四个工作表的日报工作簿
+
+用于基准测试（adv_report_bench）与本地调试，不含任何真实数据：
+
+    workbook = generate_report_workbook(rows=100_000, days=14, appnext_fraction=0.1)
+    write_report_workbook(workbook, 'synthetic.xlsx')
+    write_report_tables(workbook, './synthetic_csv', fmt='csv.gz')  # 每个工作表一个文件（见adv_report_tables）
+
+数据分布尽量贴近实际上传：
+- Offer与Affiliate的流量呈长尾分布（少数Offer/Affiliate贡献大部分行）
+- 每个Offer固定属于一个Advertiser，App ID / GEO随Offer固定，Status在最新一天有少量暂停
+- 部分Offer只在最近几天出现（新预算），约三成行无收入
+- appnext广告主的行占appnext_fraction（reject事件日期会平移一天，需要覆盖）
+"""
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from adv_report_core import SHEET_SCHEMAS, WORKBOOK_SHEETS, ReportWorkbook
+
+# 4--reject事件中的事件名 → 2-reject规则中的是否为reject
+REJECT_EVENTS = {
+    'install': False,
+    'purchase': False,
+    'registration': False,
+    'fraud_install': True,
+    'fraud_click_spam': True,
+    'rejected_purchase': True,
+}
+GEOS = ['US', 'IN', 'BR', 'ID', 'DE', 'JP', 'MX', 'TR', 'GB', 'FR']
+# 新预算Offer（只在最近几天出现）的比例
+NEW_OFFER_FRACTION = 0.1
+
+
+def _long_tail_weights(rng, n, exponent=1.1):
+    """长尾分布的抽样权重（按随机顺序排列，避免编号小的总是大户）"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def _advertiser_names(advertisers, appnext_fraction):
+    """广告主名称；appnext_fraction > 0时至少有一个名称包含appnext"""
+    n_appnext = 0 if appnext_fraction <= 0 else max(1, round(advertisers * appnext_fraction))
+    n_appnext = min(n_appnext, advertisers - 1) if appnext_fraction < 1 else advertisers
+    names = [f"Appnext_{i + 1:02d}" for i in range(n_appnext)]
+    names += [f"Advertiser_{i + 1:03d}" for i in range(advertisers - n_appnext)]
+    return np.array(names, dtype=object), np.arange(advertisers) < n_appnext
+
+
+def _sample_offers(rng, n, offer_weights, offer_is_appnext, appnext_fraction):
+    """按长尾权重抽取Offer，并使appnext广告主的行约占appnext_fraction"""
+    pools = [np.flatnonzero(~offer_is_appnext), np.flatnonzero(offer_is_appnext)]
+    use_appnext = rng.random(n) < appnext_fraction
+    if len(pools[1]) == 0:
+        use_appnext[:] = False
+    if len(pools[0]) == 0:
+        use_appnext[:] = True
+    result = np.empty(n, dtype=np.int64)
+    for flag, pool in enumerate(pools):
+        mask = use_appnext == bool(flag)
+        if mask.any():
+            weights = offer_weights[pool] / offer_weights[pool].sum()
+            result[mask] = rng.choice(pool, size=mask.sum(), p=weights)
+    return result
+
+
+def _as_schema(df, sheet_name):
+    """按SHEET_SCHEMAS固定列类型（字符串列保持object，与读取Excel的结果一致）"""
+    dtypes = {col: dtype for col, dtype in SHEET_SCHEMAS[sheet_name].items() if dtype is not None}
+    return df.astype(dtypes)
+
+
+def generate_report_workbook(rows=100_000, offers=2_000, affiliates=300, advertisers=60, days=14,
+                             appnext_fraction=0.1, reject_rows=None, end_date='2026-01-27', seed=0):
+    """
+    生成ReportWorkbook（列与类型同load_report_workbook(compact=False)的结果）
+    - rows：1--all data行数；reject_rows：4--reject事件行数（默认rows的十分之一）
+    - offers / affiliates / advertisers：各标识的个数；days：覆盖的天数（截至end_date）
+    - appnext_fraction：appnext广告主的行所占比例
+    """
+    if days < 2:
+        raise ValueError("days至少为2（报告需要最新两天数据）")
+    if advertisers < 1 or offers < 1 or affiliates < 1:
+        raise ValueError("offers / affiliates / advertisers 必须为正数")
+    rng = np.random.default_rng(seed)
+    reject_rows = rows // 10 if reject_rows is None else reject_rows
+    first_day = pd.Timestamp(end_date).normalize() - pd.Timedelta(days=days - 1)
+
+    # 维度：Offer → Advertiser / App ID / GEO；新预算Offer只在最近3天出现
+    advertiser_names, advertiser_is_appnext = _advertiser_names(advertisers, appnext_fraction)
+    offer_ids = 100_000 + rng.choice(900_000, size=offers, replace=False)
+    offer_advertiser = rng.integers(0, advertisers, offers)
+    offer_is_appnext = advertiser_is_appnext[offer_advertiser]
+    offer_app = np.array([f"com.app{i:05d}" for i in rng.integers(0, max(offers // 2, 1), offers)], dtype=object)
+    offer_geo = rng.choice(np.array(GEOS, dtype=object), offers)
+    offer_first_day = np.where(rng.random(offers) < NEW_OFFER_FRACTION, max(days - 3, 0), 0)
+    offer_weights = _long_tail_weights(rng, offers)
+    affiliate_names = np.array([f"aff_{i + 1:04d}" for i in range(affiliates)], dtype=object)
+
+    # 1--all data
+    offer = _sample_offers(rng, rows, offer_weights, offer_is_appnext, appnext_fraction)
+    day = offer_first_day[offer] + (rng.random(rows) * (days - offer_first_day[offer])).astype(np.int64)
+    seconds = rng.integers(0, 86_400, rows)
+    clicks = rng.negative_binomial(2, 0.02, rows).astype(float)
+    conversions = rng.binomial(clicks.astype(np.int64), rng.uniform(0.001, 0.05, rows)).astype(float)
+    payout = rng.lognormal(0.0, 0.8, rows)
+    revenue = np.round(conversions * payout * (rng.random(rows) > 0.3), 2)
+    profit = np.round(revenue * rng.uniform(0.05, 0.4, rows), 2)
+    newest_day = days - 1
+    status = np.where((day == newest_day) & (rng.random(rows) < 0.05), 'Paused', 'Active').astype(object)
+    sheet1 = pd.DataFrame({
+        'Time': first_day + pd.to_timedelta(day, unit='D') + pd.to_timedelta(seconds, unit='s'),
+        'Offer ID': offer_ids[offer].astype(object),
+        'App ID': offer_app[offer],
+        'Advertiser': advertiser_names[offer_advertiser[offer]],
+        'Affiliate': affiliate_names[rng.choice(affiliates, size=rows, p=_long_tail_weights(rng, affiliates))],
+        'Status': status,
+        'GEO': offer_geo[offer],
+        'Total Revenue': revenue,
+        'Total Profit': profit,
+        'Total Clicks': clicks,
+        'Total Conversions': conversions,
+    }).sort_values('Time', kind='stable').reset_index(drop=True)
+
+    # 3--匹配广告主：约每3个Advertiser一个二级广告主，约每3个二级广告主一个三级广告主
+    level2 = np.arange(advertisers) // 3
+    sheet3 = pd.DataFrame({
+        'Advertiser': advertiser_names,
+        '二级广告主': np.array([f"二级_{i + 1:02d}" for i in level2], dtype=object),
+        '三级广告主': np.array([f"三级_{i // 3 + 1:02d}" for i in level2], dtype=object),
+    })
+
+    # 4--reject事件：按行数较多的Offer对应的Advertiser抽样
+    reject_offer = _sample_offers(rng, reject_rows, offer_weights, offer_is_appnext, appnext_fraction)
+    events = np.array(list(REJECT_EVENTS), dtype=object)
+    reject_day = rng.integers(0, days, reject_rows)
+    sheet4 = pd.DataFrame({
+        'Time': first_day + pd.to_timedelta(reject_day, unit='D')
+                + pd.to_timedelta(rng.integers(0, 86_400, reject_rows), unit='s'),
+        'Advertiser': advertiser_names[offer_advertiser[reject_offer]],
+        'Event': events[rng.choice(len(events), size=reject_rows, p=[0.4, 0.1, 0.1, 0.2, 0.15, 0.05])],
+    }).sort_values('Time', kind='stable').reset_index(drop=True)
+
+    sheet2 = pd.DataFrame({
+        'Event': np.array(list(REJECT_EVENTS), dtype=object),
+        '是否为reject': np.array(list(REJECT_EVENTS.values()), dtype=object),
+    })
+    return ReportWorkbook(
+        sheet1_all_data=_as_schema(sheet1, '1--all data'),
+        sheet3_advertiser=_as_schema(sheet3, '3--匹配广告主'),
+        sheet4_reject=_as_schema(sheet4, '4--reject事件'),
+        sheet2_reject_rule=_as_schema(sheet2, '2-reject规则'),
+    )
+
+
+def write_report_workbook(workbook, path):
+    """按模板的工作表名写出xlsx（可直接上传到网页或交给命令行分析）"""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for field, sheet_name in WORKBOOK_SHEETS.items():
+            getattr(workbook, field).to_excel(writer, sheet_name=sheet_name, index=False)
+    return path
+
+
+# write_report_tables支持的格式；write_report_files另支持xlsx
+TABLE_WRITE_FORMATS = ('csv', 'csv.gz', 'parquet', 'zip')
+REPORT_FILE_FORMATS = ('xlsx',) + TABLE_WRITE_FORMATS
+
+
+def write_report_tables(workbook, path, fmt='csv'):
+    """
+    每个工作表写为一个文件（文件名为工作表名），可由load_report_workbook直接读取
+    - csv / csv.gz / parquet：path为输出目录
+    - zip：path为zip文件，内含四个CSV
+    """
+    if fmt not in TABLE_WRITE_FORMATS:
+        raise ValueError(f"不支持的格式：{fmt}（可选：{', '.join(TABLE_WRITE_FORMATS)}）")
+    if fmt == 'zip':
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for field, sheet_name in WORKBOOK_SHEETS.items():
+                archive.writestr(f"{sheet_name}.csv", getattr(workbook, field).to_csv(index=False))
+        return path
+    os.makedirs(path, exist_ok=True)
+    for field, sheet_name in WORKBOOK_SHEETS.items():
+        frame = getattr(workbook, field)
+        target = os.path.join(path, f"{sheet_name}.{fmt}")
+        if fmt == 'parquet':
+            frame.to_parquet(target, index=False)
+        else:
+            frame.to_csv(target, index=False)
+    return path
+
+
+def write_report_files(workbook, path, fmt='xlsx'):
+    """按格式写出：xlsx为单个工作簿，其它格式见write_report_tables"""
+    if fmt == 'xlsx':
+        return write_report_workbook(workbook, path)
+    return write_report_tables(workbook, path, fmt=fmt)
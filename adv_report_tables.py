@@ -0,0 +1,234 @@
+"""
+表格文件读取：每个工作表一个CSV / CSV.gz / Parquet文件，代替xlsx上传（需要pyarrow）
+
+    load_report_workbook(['1--all data.csv.gz', '3--匹配广告主.csv', '4--reject事件.csv', '2-reject规则.csv'])
+    load_report_workbook('20260127.zip')   # zip内为上述文件（可在子目录中）
+    load_report_workbook('./20260127/')    # 包含上述文件的目录
+
+- 文件名（去掉扩展名）为工作表名或ReportWorkbook字段名，如 1--all data.csv、sheet1_all_data.parquet
+- CSV由pyarrow.csv多线程解析（UTF-8，解码失败时按GB18030重试），Parquet由pyarrow读取，只读取SHEET_SCHEMAS中的列
+- 列类型与读取xlsx相同：标识列为object（纯数字的Offer ID为整数，空单元格为NaN），指标列为float64，Time为datetime64
+- zip中只有一个.xlsx时按xlsx读取（压缩上传）
+"""
+import io
+import os
+import zipfile
+
+import pandas as pd
+
+from adv_report_core import (
+    SHEET_SCHEMAS,
+    WORKBOOK_SHEETS,
+    ReportWorkbook,
+    load_report_workbook,
+    read_upload_bytes,
+    read_workbook_headers,
+    restore_schema_dtypes,
+    upload_files,
+    upload_name,
+)
+
+# 扩展名 → 格式（.csv.gz需在.csv之前判断）
+TABLE_FORMATS = {'.csv.gz': 'csv.gz', '.csv': 'csv', '.parquet': 'parquet'}
+CSV_FALLBACK_ENCODING = 'gb18030'
+# Time列的精度（与pandas读取xlsx的结果一致）
+TIME_DTYPE = 'datetime64[us]'
+# 只读取表头时解析的块大小
+HEADER_BLOCK_SIZE = 1 << 16
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("读取CSV/Parquet需要安装pyarrow：pip install pyarrow")
+    return pa, pacsv, pq
+
+
+def table_format(name):
+    """文件名 → (去掉扩展名的文件名, 格式)，不是表格文件时格式为None"""
+    lower = name.lower()
+    for suffix, fmt in TABLE_FORMATS.items():
+        if lower.endswith(suffix):
+            return name[:-len(suffix)], fmt
+    return name, None
+
+
+def match_sheet(name):
+    """文件名对应的工作表名（按工作表名或ReportWorkbook字段名匹配，不区分大小写），无法识别时为None"""
+    stem, fmt = table_format(os.path.basename(name))
+    if fmt is None:
+        return None
+    stem = stem.strip().lower()
+    for field, sheet_name in WORKBOOK_SHEETS.items():
+        if stem in (sheet_name.lower(), field):
+            return sheet_name
+    return None
+
+
+class TableSource:
+    """一个工作表文件：path为本地路径，或data为文件内容（上传文件 / zip成员）"""
+
+    def __init__(self, name, fmt, path=None, data=None):
+        self.name = name
+        self.fmt = fmt
+        self.path = path
+        self.data = data
+
+    def open(self):
+        """pyarrow输入流（CSV.gz按gzip解压）"""
+        pa, _, _ = _pyarrow()
+        source = self.path if self.path is not None else pa.py_buffer(self.data)
+        return pa.input_stream(source, compression='gzip' if self.fmt == 'csv.gz' else None)
+
+    def parquet_file(self):
+        pa, _, _ = _pyarrow()
+        return self.path if self.path is not None else pa.BufferReader(self.data)
+
+
+def _expand(uploaded_file):
+    """上传内容 → [(文件名, 本地路径或文件内容)]，zip展开为其中的文件"""
+    entries = []
+    for f in upload_files(uploaded_file):
+        name = upload_name(f)
+        if name.lower().endswith('.zip'):
+            archive_file = f if isinstance(f, (str, os.PathLike)) else io.BytesIO(read_upload_bytes(f))
+            with zipfile.ZipFile(archive_file) as archive:
+                for member in archive.infolist():
+                    member_name = os.path.basename(member.filename)
+                    if member.is_dir() or member.filename.startswith('__MACOSX') or member_name.startswith('.'):
+                        continue
+                    entries.append((member_name, archive.read(member)))
+        elif isinstance(f, (str, os.PathLike)):
+            entries.append((name, os.fspath(f)))
+        else:
+            entries.append((name, read_upload_bytes(f)))
+    return entries
+
+
+def collect_table_sources(uploaded_file):
+    """
+    上传内容 → ({工作表名: TableSource}, [未识别的文件名], xlsx条目或None)
+    同一工作表对应多个文件时抛出ValueError
+    """
+    sources, unknown, workbooks = {}, [], []
+    for name, content in _expand(uploaded_file):
+        if name.lower().endswith('.xlsx'):
+            workbooks.append((name, content))
+            continue
+        sheet_name = match_sheet(name)
+        if sheet_name is None:
+            unknown.append(name)
+            continue
+        if sheet_name in sources:
+            raise ValueError(f"工作表 {sheet_name} 对应多个文件：{sources[sheet_name].name}、{name}")
+        fmt = table_format(name)[1]
+        if isinstance(content, str):
+            sources[sheet_name] = TableSource(name, fmt, path=content)
+        else:
+            sources[sheet_name] = TableSource(name, fmt, data=content)
+    workbook = workbooks[0] if len(workbooks) == 1 and not sources else None
+    return sources, unknown, workbook
+
+
+def _csv_read_options(block_size=None, encoding='utf8'):
+    _, pacsv, _ = _pyarrow()
+    options = pacsv.ReadOptions(use_threads=True, encoding=encoding)
+    if block_size is not None:
+        options.block_size = block_size
+    return options
+
+
+def _with_encoding_fallback(read, encoding='utf8'):
+    """read(encoding)：UTF-8解码失败时按CSV_FALLBACK_ENCODING重试（平台导出的中文CSV常为GBK）"""
+    pa, _, _ = _pyarrow()
+    try:
+        return read(encoding)
+    except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+        message = str(e).lower()
+        if encoding == CSV_FALLBACK_ENCODING or ('utf8' not in message and 'utf-8' not in message):
+            raise
+        return read(CSV_FALLBACK_ENCODING)
+
+
+def _csv_header(source):
+    """CSV表头 → (列名列表, 编码)"""
+    _, pacsv, _ = _pyarrow()
+    return _with_encoding_fallback(lambda encoding: (list(pacsv.open_csv(
+        source.open(), read_options=_csv_read_options(HEADER_BLOCK_SIZE, encoding)
+    ).schema.names), encoding))
+
+
+def read_table_header(source):
+    """只读取表头（CSV解析第一个块，Parquet读取元数据），返回列名列表"""
+    _, _, pq = _pyarrow()
+    if source.fmt == 'parquet':
+        return list(pq.read_schema(source.parquet_file()).names)
+    return _csv_header(source)[0]
+
+
+def read_table(source, sheet_name):
+    """按SHEET_SCHEMAS读取一个工作表文件，列与类型同读取xlsx的结果"""
+    pa, pacsv, pq = _pyarrow()
+    schema = SHEET_SCHEMAS[sheet_name]
+    columns = list(schema)
+    header, encoding = (read_table_header(source), None) if source.fmt == 'parquet' else _csv_header(source)
+    missing = [col for col in columns if col not in header]
+    if missing:
+        raise ValueError(f"工作表 {sheet_name}（{source.name}）缺少列：{', '.join(missing)}")
+
+    float_columns = [col for col, dtype in schema.items() if dtype == 'float64']
+    if source.fmt == 'parquet':
+        table = pq.read_table(source.parquet_file(), columns=columns, use_threads=True)
+    else:
+        # 空单元格（及NA、N/A、null等，与pandas读取xlsx的默认缺失值相同）读为缺失值而不是空字符串
+        convert_options = pacsv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pa.float64() for col in float_columns},
+            strings_can_be_null=True,
+        )
+        table = _with_encoding_fallback(lambda csv_encoding: pacsv.read_csv(
+            source.open(), read_options=_csv_read_options(encoding=csv_encoding), convert_options=convert_options
+        ), encoding)
+    # 含缺失值的整数列保持整数（与xlsx单元格一致），再统一转为SHEET_SCHEMAS的类型
+    df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    for col in float_columns:
+        df[col] = df[col].astype('float64')
+    df = restore_schema_dtypes(df, sheet_name)
+    if 'Time' in schema:
+        df['Time'] = pd.to_datetime(df['Time']).astype(TIME_DTYPE)
+    return df[columns]
+
+
+def read_table_headers(uploaded_file):
+    """
+    只读取各工作表文件的表头，返回 ({工作表名: 表头列表}, 未识别的文件名, True)
+    zip中只有一个.xlsx时读取其工作表表头（同core.read_upload_headers）
+    """
+    sources, unknown, workbook = collect_table_sources(uploaded_file)
+    if workbook is not None:
+        name, content = workbook
+        headers, sheet_names = read_workbook_headers(content if isinstance(content, str) else io.BytesIO(content))
+        return headers, [sheet_name for sheet_name in sheet_names if sheet_name not in headers], False
+    return {sheet_name: read_table_header(source) for sheet_name, source in sources.items()}, unknown, True
+
+
+def load_report_tables(uploaded_file):
+    """读取四个工作表文件，返回ReportWorkbook（未压缩类型，由load_report_workbook统一压缩）"""
+    sources, unknown, workbook = collect_table_sources(uploaded_file)
+    if workbook is not None:
+        name, content = workbook
+        return load_report_workbook(
+            content if isinstance(content, str) else io.BytesIO(content), compact=False, validate=False
+        )
+    missing = [sheet_name for sheet_name in WORKBOOK_SHEETS.values() if sheet_name not in sources]
+    if missing:
+        hint = f"；未识别的文件：{', '.join(unknown)}" if unknown else ''
+        raise ValueError(
+            f"缺少工作表文件：{', '.join(missing)}（文件名应为工作表名，如 1--all data.csv）{hint}"
+        )
+    return ReportWorkbook(**{
+        field: read_table(sources[sheet_name], sheet_name) for field, sheet_name in WORKBOOK_SHEETS.items()
+    })
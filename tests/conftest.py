@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模块为仓库根目录下的平铺文件（adv_report_*.py），直接运行pytest时也能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,61 @@
+"""
+基准测试冒烟测试：小规模的生成 → 基准 → 保存/读取基线 → 与基线比较
+"""
+import copy
+
+from adv_report_bench import (
+    compare_to_baseline,
+    format_regression,
+    format_size_result,
+    load_baseline,
+    run_benchmark,
+    save_baseline,
+)
+
+GENERATOR_OPTIONS = dict(offers=100, affiliates=20, advertisers=8, days=8)
+
+
+def _faster_baseline(result, factor=0.1):
+    """把基线中的全部耗时与峰值内存缩小为factor倍，当前结果相对它必然"退化\""""
+    baseline = copy.deepcopy(result)
+    for size_result in baseline['sizes'].values():
+        size_result['total_s'] *= factor
+        if size_result['peak_rss_mb'] is not None:
+            size_result['peak_rss_mb'] *= factor
+        size_result['load'] = {fmt: seconds * factor for fmt, seconds in size_result['load'].items()}
+        size_result['stages'] = {name: wall * factor for name, wall in size_result['stages'].items()}
+    return baseline
+
+
+def test_benchmark_flags_regression_against_faster_baseline(tmp_path):
+    result = run_benchmark(sizes=(2000,), repeat=1, load=['csv'], **GENERATOR_OPTIONS)
+    size_result = result['sizes']['2000']
+    assert size_result['rows'] == 2000
+    assert size_result['total_s'] > 0
+    assert set(size_result['load']) == {'csv'}
+    assert size_result['stages']
+    assert format_size_result(size_result)
+
+    path = save_baseline(result, str(tmp_path / 'baseline.json'))
+    assert load_baseline(path) == result
+    assert compare_to_baseline(result, load_baseline(path), min_seconds=0, min_mb=0) == []
+
+    regressions = compare_to_baseline(result, _faster_baseline(result), min_seconds=0, min_mb=0)
+    metrics = {regression['metric'] for regression in regressions}
+    assert {'total_s', 'load:csv'} <= metrics
+    assert any(metric.startswith('stage:') for metric in metrics)
+    assert all(regression['rows'] == 2000 and regression['ratio'] > 1 for regression in regressions)
+    assert all(format_regression(regression) for regression in regressions)
+
+
+def test_compare_ignores_changes_below_threshold_and_noise_floor():
+    baseline = {'sizes': {'1000': {'total_s': 1.0, 'peak_rss_mb': 100.0, 'stages': {'cube': 0.01}}}}
+    current = {'sizes': {
+        '1000': {'total_s': 1.1, 'peak_rss_mb': 110.0, 'stages': {'cube': 0.04}},
+        '5000': {'total_s': 9.0, 'peak_rss_mb': 900.0, 'stages': {}},
+    }}
+    # 变慢10%低于阈值；阶段变慢4倍但绝对差值低于噪声下限；基线中没有的规模不比较
+    assert compare_to_baseline(current, baseline) == []
+    assert [r['metric'] for r in compare_to_baseline(current, baseline, threshold=0.05, min_mb=0)] == [
+        'total_s', 'peak_rss_mb'
+    ]
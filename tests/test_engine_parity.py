@@ -0,0 +1,185 @@
+"""
+执行引擎一致性测试：同一工作簿在各引擎、流式与非流式读取、紧凑与非紧凑类型下的分析结果
+必须与pandas基准逐表一致（按输出精度，见compare_report_results）；未安装的可选引擎跳过
+
+duckdb / polars引擎的汇总与立方查询各自实现，表格一~四的组装与pandas共用
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from adv_report_core import (
+    ENGINES,
+    SHEET_SCHEMAS,
+    WORKBOOK_SHEETS,
+    ReportWorkbook,
+    build_daily_aggregates,
+    check_engine_parity,
+    compare_report_frames,
+    compare_report_results,
+    load_report_workbook,
+    process_daily_report_web,
+)
+
+REJECT_EVENTS = {'install': False, 'purchase': False, 'fraud_install': True, 'rejected_purchase': True}
+
+
+def _as_schema(df, sheet_name):
+    dtypes = {col: dtype for col, dtype in SHEET_SCHEMAS[sheet_name].items() if dtype is not None}
+    return df.astype(dtypes)
+
+
+def build_workbook(rows=6000, offers=400, affiliates=80, advertisers=16, days=16, seed=7):
+    """
+    小规模随机工作簿：覆盖appnext的reject日期平移、只在最近几天出现的新预算Offer、
+    无收入的行、最新一天暂停的Offer与多日历史趋势
+    """
+    rng = np.random.default_rng(seed)
+    first_day = pd.Timestamp('2026-01-27') - pd.Timedelta(days=days - 1)
+    advertiser_names = np.array(
+        [f"Appnext_{i:02d}" if i < 3 else f"Advertiser_{i:03d}" for i in range(advertisers)], dtype=object
+    )
+    offer_ids = 100_000 + rng.choice(900_000, size=offers, replace=False)
+    offer_advertiser = rng.integers(0, advertisers, offers)
+    offer_first_day = np.where(rng.random(offers) < 0.1, days - 3, 0)
+    offer_weights = 1.0 / np.arange(1, offers + 1)
+    offer_weights /= offer_weights.sum()
+
+    offer = rng.choice(offers, size=rows, p=offer_weights)
+    day = offer_first_day[offer] + (rng.random(rows) * (days - offer_first_day[offer])).astype(np.int64)
+    clicks = rng.negative_binomial(2, 0.02, rows).astype(float)
+    conversions = rng.binomial(clicks.astype(np.int64), 0.02).astype(float)
+    revenue = np.round(conversions * rng.lognormal(0.0, 0.8, rows) * (rng.random(rows) > 0.3), 2)
+    sheet1 = pd.DataFrame({
+        'Time': first_day + pd.to_timedelta(day, unit='D') + pd.to_timedelta(rng.integers(0, 86_400, rows), unit='s'),
+        'Offer ID': offer_ids[offer].astype(object),
+        'App ID': np.array([f"com.app{i:04d}" for i in offer % (offers // 2)], dtype=object),
+        'Advertiser': advertiser_names[offer_advertiser[offer]],
+        'Affiliate': np.array([f"aff_{i:04d}" for i in rng.integers(0, affiliates, rows)], dtype=object),
+        'Status': np.where((day == days - 1) & (rng.random(rows) < 0.05), 'Paused', 'Active').astype(object),
+        'GEO': rng.choice(np.array(['US', 'IN', 'BR', 'DE'], dtype=object), rows),
+        'Total Revenue': revenue,
+        'Total Profit': np.round(revenue * rng.uniform(0.05, 0.4, rows), 2),
+        'Total Clicks': clicks,
+        'Total Conversions': conversions,
+    }).sort_values('Time', kind='stable').reset_index(drop=True)
+
+    level2 = np.arange(advertisers) // 3
+    sheet3 = pd.DataFrame({
+        'Advertiser': advertiser_names,
+        '二级广告主': np.array([f"二级_{i:02d}" for i in level2], dtype=object),
+        '三级广告主': np.array([f"三级_{i // 2:02d}" for i in level2], dtype=object),
+    })
+    reject_rows = rows // 10
+    events = np.array(list(REJECT_EVENTS), dtype=object)
+    sheet4 = pd.DataFrame({
+        'Time': first_day + pd.to_timedelta(rng.integers(0, days, reject_rows), unit='D')
+                + pd.to_timedelta(rng.integers(0, 86_400, reject_rows), unit='s'),
+        'Advertiser': advertiser_names[rng.integers(0, advertisers, reject_rows)],
+        'Event': events[rng.integers(0, len(events), reject_rows)],
+    }).sort_values('Time', kind='stable').reset_index(drop=True)
+    sheet2 = pd.DataFrame({
+        'Event': events,
+        '是否为reject': np.array(list(REJECT_EVENTS.values()), dtype=object),
+    })
+    return ReportWorkbook(
+        sheet1_all_data=_as_schema(sheet1, '1--all data'),
+        sheet3_advertiser=_as_schema(sheet3, '3--匹配广告主'),
+        sheet4_reject=_as_schema(sheet4, '4--reject事件'),
+        sheet2_reject_rule=_as_schema(sheet2, '2-reject规则'),
+    )
+
+
+def _require(engine):
+    if engine != 'pandas':
+        pytest.importorskip(engine)
+
+
+def _assert_same_results(expected, actual):
+    assert compare_report_results(expected, actual) == []
+
+
+@pytest.fixture(scope='module')
+def workbook_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('parity') / 'parity.xlsx'
+    workbook = build_workbook()
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for field, sheet_name in WORKBOOK_SHEETS.items():
+            getattr(workbook, field).to_excel(writer, sheet_name=sheet_name, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def load_workbook(workbook_path):
+    """按(streaming, compact)读取工作簿，每种读取方式只解析一次（分析不修改传入的工作簿）"""
+    workbooks = {}
+
+    def load(streaming=False, compact=True):
+        if (streaming, compact) not in workbooks:
+            workbooks[streaming, compact] = load_report_workbook(
+                workbook_path, streaming=streaming, compact=compact
+            )
+        return workbooks[streaming, compact]
+    return load
+
+
+@pytest.fixture(scope='module')
+def baseline(load_workbook):
+    """pandas引擎、非流式、紧凑类型的结果作为基准"""
+    return process_daily_report_web(None, workbook=load_workbook())
+
+
+@pytest.mark.parametrize('compact', [True, False], ids=['compact', 'plain'])
+@pytest.mark.parametrize('streaming', [False, True], ids=['pandas-read', 'streaming'])
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_matches_pandas_baseline(load_workbook, baseline, engine, streaming, compact):
+    _require(engine)
+    results = process_daily_report_web(None, workbook=load_workbook(streaming, compact), engine=engine)
+    _assert_same_results(baseline, results)
+
+
+@pytest.mark.parametrize('engine', [engine for engine in ENGINES if engine != 'pandas'])
+def test_check_engine_parity_reports_no_problems(load_workbook, engine):
+    _require(engine)
+    assert check_engine_parity(load_workbook(), engines=('pandas', engine), high_diff_threshold=5) == []
+
+
+def test_duckdb_closes_only_connections_it_creates(load_workbook):
+    duckdb = pytest.importorskip('duckdb')
+    from adv_report_duckdb import DuckDBReportFrames, connect
+
+    aggregates = build_daily_aggregates(load_workbook(), engine='duckdb')
+    frames = DuckDBReportFrames(aggregates)
+    assert len(frames.dates()) == 16
+    frames.close()
+    with pytest.raises(duckdb.ConnectionException):
+        frames.dates()
+
+    # 调用方传入的连接由调用方关闭
+    with connect() as connection:
+        frames = DuckDBReportFrames(aggregates, connection=connection)
+        frames.close()
+        assert connection.execute('SELECT COUNT(*) FROM cube').fetchone()[0] == len(aggregates.daily_cube)
+
+
+def test_compare_report_frames_at_output_precision():
+    expected = pd.DataFrame({
+        'Offer ID': [1, 2],
+        'Total Revenue': [10.25, 3.0],
+        'influence affiliate': ['aff_1 增加 6.00 美金/156.2%\naff_2 减少 6.00 美金', 'aff_3 新增产生流水 1.50 美金'],
+    })
+    # 舍入边界上相差一个最小单位、金额并列的行顺序不同：视为一致
+    close = expected.assign(**{
+        'Total Revenue': [10.26, 3.0],
+        'influence affiliate': ['aff_2 减少 6.00 美金\naff_1 增加 6.00 美金/156.3%', 'aff_3 新增产生流水 1.50 美金'],
+    })
+    assert compare_report_frames(expected, close) is None
+
+    assert compare_report_frames(expected, expected.assign(**{'Total Revenue': [10.27, 3.0]}))
+    assert compare_report_frames(expected, expected.assign(**{'Offer ID': [1, 3]}))
+    assert compare_report_frames(expected, expected.assign(**{
+        'influence affiliate': ['aff_1 增加 6.00 美金/156.4%\naff_2 减少 6.00 美金', 'aff_3 新增产生流水 1.50 美金']
+    }))
+    assert compare_report_frames(expected, expected.assign(**{
+        'influence affiliate': ['aff_1 增加 6.00 美金/156.2%\naff_4 减少 6.00 美金', 'aff_3 新增产生流水 1.50 美金']
+    }))
@@ -0,0 +1,51 @@
+"""
+解析结果缓存：缓存读回的工作簿必须与写入前相同（含混合数字和文本的标识列）
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from adv_report_core import (
+    WORKBOOK_SHEETS,
+    ParsedUploadCache,
+    ReportWorkbook,
+    apply_compact_schema,
+    process_daily_report_web,
+)
+from adv_report_synthetic import generate_report_workbook
+
+
+def _mixed_workbook():
+    """部分Offer ID为文本、其余为数字（同一列混合两种类型，Parquet无法直接写出）"""
+    workbook = generate_report_workbook(rows=3000, offers=200, affiliates=40, advertisers=12, days=8, seed=3)
+    rows = workbook.sheet1_all_data.copy()
+    rows['Offer ID'] = np.array(
+        [f"T{value}" if value % 3 == 0 else value for value in np.asarray(rows['Offer ID'], dtype=object)],
+        dtype=object
+    )
+    return apply_compact_schema(ReportWorkbook(**{**workbook.__dict__, 'sheet1_all_data': rows}))
+
+
+def test_mixed_columns_round_trip(tmp_path):
+    workbook = _mixed_workbook()
+    cache = ParsedUploadCache(str(tmp_path))
+    assert cache.put('digest', workbook)
+
+    cached = cache.get('digest')
+    for field in WORKBOOK_SHEETS:
+        pd.testing.assert_frame_equal(getattr(workbook, field), getattr(cached, field), obj=field)
+    assert {type(value) for value in cached.sheet1_all_data['Offer ID'].cat.categories} == {int, str}
+    expected = process_daily_report_web(None, workbook=workbook)
+    actual = process_daily_report_web(None, workbook=cached)
+    for key in ('table1', 'table2', 'table3', 'table4'):
+        pd.testing.assert_frame_equal(expected[key], actual[key], obj=key)
+
+
+def test_unconvertible_workbook_is_not_cached(tmp_path):
+    workbook = _mixed_workbook()
+    rows = workbook.sheet1_all_data.assign(Note=pd.Series([1j] * len(workbook.sheet1_all_data), dtype=object))
+    cache = ParsedUploadCache(str(tmp_path))
+    assert not cache.put('digest', ReportWorkbook(**{**workbook.__dict__, 'sheet1_all_data': rows}))
+    assert cache.get('digest') is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,103 @@
+"""
+本地聚合存储：由存储计算的报告必须与直接分析上传的工作簿相同
+"""
+import os
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from adv_report_core import REPORT_SHEETS, ReportWorkbook, apply_compact_schema, process_daily_report_web
+from adv_report_store import DailyAggregateStore
+from adv_report_synthetic import generate_report_workbook
+
+COMPARED = list(REPORT_SHEETS) + ['stats', 'newest_date_str']
+
+
+def _assert_same_results(expected, actual):
+    for key in COMPARED:
+        if isinstance(expected[key], pd.DataFrame):
+            pd.testing.assert_frame_equal(expected[key], actual[key], check_dtype=False, obj=key)
+        else:
+            assert expected[key] == actual[key], key
+
+
+def _replace(workbook, **sheets):
+    return ReportWorkbook(**{**workbook.__dict__, **sheets})
+
+
+@pytest.fixture(scope='module')
+def workbook():
+    return apply_compact_schema(generate_report_workbook(
+        rows=6000, offers=400, affiliates=80, advertisers=30, days=12, seed=5
+    ))
+
+
+@pytest.fixture(scope='module')
+def expected(workbook):
+    return process_daily_report_web(None, workbook=workbook)
+
+
+def _partial_newest_day(workbook, keep=0.5, seed=0):
+    """最新一天只保留部分行（数据尚未导出完整时的上传）"""
+    rng = np.random.default_rng(seed)
+    rows = workbook.sheet1_all_data
+    newest = rows['Time'].dt.normalize() == rows['Time'].max().normalize()
+    return _replace(workbook, sheet1_all_data=rows[~newest | (rng.random(len(rows)) < keep)].reset_index(drop=True))
+
+
+def test_reingest_replaces_partial_day(tmp_path, workbook, expected):
+    store = DailyAggregateStore(str(tmp_path))
+    store.ingest(_partial_newest_day(workbook))
+    partial = process_daily_report_web(None, aggregates=store.load())
+    assert partial['stats'] != expected['stats']
+
+    written = store.ingest(workbook)
+    assert written['cube'] == store.dates('cube')
+    _assert_same_results(expected, process_daily_report_web(None, aggregates=store.load()))
+
+
+def test_keep_existing_skips_stored_days(tmp_path, workbook):
+    store = DailyAggregateStore(str(tmp_path))
+    store.ingest(_partial_newest_day(workbook))
+    stale = process_daily_report_web(None, aggregates=store.load())
+    assert store.ingest(workbook, overwrite=False) == {'cube': [], 'reject': []}
+    assert process_daily_report_web(None, aggregates=store.load())['stats'] == stale['stats']
+
+
+def test_mixed_offer_ids_round_trip(tmp_path, workbook):
+    rows = workbook.sheet1_all_data.copy()
+    offer_ids = np.asarray(rows['Offer ID'], dtype=object)
+    rows['Offer ID'] = np.array(
+        [f"T{value}" if value % 3 == 0 else value for value in offer_ids], dtype=object
+    )
+    mixed = apply_compact_schema(_replace(workbook, sheet1_all_data=rows))
+    store = DailyAggregateStore(str(tmp_path))
+    store.ingest(mixed)
+    assert {type(value) for value in store.load().daily_cube['Offer ID'].astype(object)} == {int, str}
+    _assert_same_results(
+        process_daily_report_web(None, workbook=mixed), process_daily_report_web(None, aggregates=store.load())
+    )
+
+
+def test_failed_ingest_leaves_store_unchanged(tmp_path, workbook):
+    store = DailyAggregateStore(str(tmp_path))
+    store.ingest(_partial_newest_day(workbook))
+    before = {table: sorted(os.listdir(tmp_path / table)) for table in ('cube', 'reject', 'mapping')}
+    stats = process_daily_report_web(None, aggregates=store.load())['stats']
+
+    replace = os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 7:
+            raise OSError('disk full')
+        return replace(src, dst)
+
+    with mock.patch('adv_report_store.os.replace', failing_replace):
+        with pytest.raises(ValueError, match='回滚'):
+            store.ingest(workbook)
+    assert {table: sorted(os.listdir(tmp_path / table)) for table in ('cube', 'reject', 'mapping')} == before
+    assert process_daily_report_web(None, aggregates=store.load())['stats'] == stats
@@ -0,0 +1,68 @@
+"""
+表格文件上传：同一工作簿写为xlsx / CSV / CSV.gz / zip后读取，分析结果必须相同
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from adv_report_core import REPORT_SHEETS, ReportWorkbook, load_report_workbook, process_daily_report_web
+from adv_report_synthetic import generate_report_workbook, write_report_files
+
+FORMATS = ('csv', 'csv.gz', 'zip')
+COMPARED = list(REPORT_SHEETS) + ['stats', 'newest_date_str']
+
+
+def _with_blank_cells(workbook, fraction=0.03, seed=0):
+    """标识列、Status与二级广告主随机置空（模拟平台导出中的空单元格）"""
+    rng = np.random.default_rng(seed)
+
+    def blank(frame, columns):
+        frame = frame.copy()
+        for col in columns:
+            frame[col] = frame[col].where(rng.random(len(frame)) >= fraction, np.nan)
+        return frame
+
+    return ReportWorkbook(
+        sheet1_all_data=blank(workbook.sheet1_all_data, ['Offer ID', 'App ID', 'Status', 'GEO']),
+        sheet3_advertiser=blank(workbook.sheet3_advertiser, ['二级广告主']),
+        sheet4_reject=workbook.sheet4_reject,
+        sheet2_reject_rule=workbook.sheet2_reject_rule,
+    )
+
+
+@pytest.fixture(scope='module')
+def upload_dir(tmp_path_factory):
+    workbook = _with_blank_cells(generate_report_workbook(
+        rows=5000, offers=300, affiliates=60, advertisers=30, days=10, seed=3
+    ))
+    directory = tmp_path_factory.mktemp('tables')
+    for fmt in ('xlsx',) + FORMATS:
+        write_report_files(workbook, str(directory / f"upload.{fmt}"), fmt=fmt)
+    return directory
+
+
+@pytest.fixture(scope='module')
+def xlsx_results(upload_dir):
+    return process_daily_report_web(None, workbook=load_report_workbook(str(upload_dir / 'upload.xlsx')))
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_blank_cells_load_as_missing_like_xlsx(upload_dir, xlsx_results, fmt):
+    path = str(upload_dir / f"upload.{fmt}")
+    if fmt != 'zip':
+        path = sorted(os.path.join(path, name) for name in os.listdir(path))
+    workbook = load_report_workbook(path)
+    xlsx_workbook = load_report_workbook(str(upload_dir / 'upload.xlsx'))
+    for field in ('sheet1_all_data', 'sheet3_advertiser'):
+        pd.testing.assert_frame_equal(
+            getattr(workbook, field), getattr(xlsx_workbook, field), check_categorical=False, obj=field
+        )
+
+    results = process_daily_report_web(None, workbook=workbook)
+    for key in COMPARED:
+        if isinstance(xlsx_results[key], pd.DataFrame):
+            pd.testing.assert_frame_equal(results[key], xlsx_results[key], check_dtype=False, obj=key)
+        else:
+            assert results[key] == xlsx_results[key], key